@@ -0,0 +1,243 @@
+import collections
+import contextlib
+import os
+import signal
+import subprocess
+import threading
+import time
+import profiling
+
+# Default timeout (seconds) for any external command that does not specify one
+DEFAULT_TIMEOUT = 30
+
+# Default timeouts (seconds) per phase of work
+PHASE_TIMEOUTS = {
+    "probe": 10,       # which, pgrep, ifconfig/ip link show
+    "link": 15,        # interface down/address/up
+    "vpn_up": 60,      # wg-quick up, openvpn --daemon
+    "vpn_down": 30,    # wg-quick down, kill
+    "anonsurf": 90,    # anonsurf start/stop/change
+    "public_ip": 15,   # curl ifconfig.me
+    "misc": DEFAULT_TIMEOUT,
+}
+
+# How often a running command checks for cancellation and deadlines
+POLL_INTERVAL = 0.2
+
+# Time given to a process group to exit after SIGTERM before SIGKILL is sent
+KILL_GRACE = 2
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {
+    "forks": 0,
+    "failures": 0,
+    "timeouts": 0,
+    "cancellations": 0,
+    "fork_time": 0.0,
+    "exec_time": 0.0,
+    "per_program": {},
+}
+recent_errors = collections.deque(maxlen=20)
+rotation_history = collections.deque(maxlen=100)
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+    """Raised when a command exceeds its timeout or the current phase deadline."""
+
+    def __init__(self, returncode, cmd, timeout, output=None, stderr=None):
+        super().__init__(returncode, cmd, output=output, stderr=stderr)
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"Command '{' '.join(self.cmd)}' timed out after {self.timeout:.1f} seconds"
+
+
+class CommandCancelled(subprocess.CalledProcessError):
+    """Raised when a command is killed because its thread's stop event was set."""
+
+    def __str__(self):
+        return f"Command '{' '.join(self.cmd)}' was cancelled"
+
+
+def bind_stop_event(event):
+    """Bind a stop event to the calling thread; its commands are killed when it is set."""
+    _local.stop_event = event
+
+
+def _current_stop_event():
+    return getattr(_local, "stop_event", None)
+
+
+@contextlib.contextmanager
+def phase_deadline(seconds):
+    """Cap the total time of every command run inside the block on this thread."""
+    previous = getattr(_local, "deadline", None)
+    deadline = time.monotonic() + seconds
+    if previous is not None:
+        deadline = min(deadline, previous)
+    _local.deadline = deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def _effective_timeout(phase, timeout):
+    """Combine an explicit timeout, the phase default and any active phase deadline."""
+    if timeout is None:
+        timeout = PHASE_TIMEOUTS.get(phase, DEFAULT_TIMEOUT)
+    deadline = getattr(_local, "deadline", None)
+    if deadline is not None:
+        timeout = min(timeout, max(deadline - time.monotonic(), 0))
+    return timeout
+
+
+def _kill_process_group(proc):
+    """Terminate the whole process group of proc, escalating to SIGKILL."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            proc.wait(timeout=KILL_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def _record(cmd, fork_time, exec_time, outcome):
+    program = os.path.basename(cmd[0]) if cmd else "?"
+    _local.forks = getattr(_local, "forks", 0) + 1
+    with _stats_lock:
+        _stats["forks"] += 1
+        _stats["fork_time"] += fork_time
+        _stats["exec_time"] += exec_time
+        entry = _stats["per_program"].setdefault(program, {"count": 0, "time": 0.0})
+        entry["count"] += 1
+        entry["time"] += exec_time
+        if outcome == "timeout":
+            _stats["timeouts"] += 1
+        elif outcome == "cancelled":
+            _stats["cancellations"] += 1
+        elif outcome == "failed":
+            _stats["failures"] += 1
+
+
+def get_stats():
+    """Return a snapshot of the fork/exec counters."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+        snapshot["per_program"] = {k: dict(v) for k, v in _stats["per_program"].items()}
+    return snapshot
+
+
+def thread_fork_count():
+    """Return how many external commands the calling thread has run."""
+    return getattr(_local, "forks", 0)
+
+
+def record_rotation(kind, forks, logger=None, gap=None):
+    """Record the processes forked by one rotation and, if known, its downtime gap in seconds."""
+    rotation_history.append({"kind": kind, "forks": forks, "gap": gap, "time": time.time()})
+    if logger:
+        logger.debug(f"{kind} rotation forked {forks} process(es)")
+        if gap is not None:
+            logger.debug(f"{kind} rotation downtime: {gap:.1f}s")
+
+
+def run_command(cmd, logger=None, phase="misc", timeout=None, check=True,
+                stdout=subprocess.PIPE, text=True, cancellable=True, input=None):
+    """Run cmd in its own process group with a timeout, honouring the thread's stop event.
+
+    Returns a subprocess.CompletedProcess. stderr is always captured. Raises
+    CommandTimeout or CommandCancelled (both CalledProcessError subclasses) when the
+    command is killed, and CalledProcessError on a non-zero exit if check is set.
+    FileNotFoundError propagates when the program does not exist.
+    """
+    profiling.checkpoint()
+    timeout = _effective_timeout(phase, timeout)
+    stop_event = _current_stop_event() if cancellable else None
+    if logger:
+        logger.debug(f"Executing command ({phase}, timeout {timeout:.0f}s): {' '.join(cmd)}")
+
+    if stop_event is not None and stop_event.is_set():
+        raise CommandCancelled(-signal.SIGTERM, cmd)
+
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else None,
+                            stdout=stdout, stderr=subprocess.PIPE, text=text,
+                            start_new_session=True)
+    fork_time = time.monotonic() - start
+    deadline = start + timeout
+    outcome = None
+    out = err = None
+
+    while True:
+        wait = min(POLL_INTERVAL, max(deadline - time.monotonic(), 0))
+        try:
+            out, err = proc.communicate(input=input, timeout=wait)
+            break
+        except subprocess.TimeoutExpired:
+            if stop_event is not None and stop_event.is_set():
+                outcome = "cancelled"
+            elif time.monotonic() >= deadline:
+                outcome = "timeout"
+            if outcome:
+                _kill_process_group(proc)
+                out, err = proc.communicate()
+                break
+
+    exec_time = time.monotonic() - start
+    if outcome is None and proc.returncode != 0:
+        outcome = "failed"
+    _record(cmd, fork_time, exec_time, outcome)
+
+    if outcome:
+        recent_errors.append({
+            "cmd": " ".join(cmd),
+            "phase": phase,
+            "outcome": outcome,
+            "returncode": proc.returncode,
+            "stderr": (err or "").strip() if text else err,
+            "time": exec_time,
+        })
+        if logger and err:
+            logger.debug(f"stderr from '{' '.join(cmd)}': {err.strip() if text else err}")
+
+    if outcome == "timeout":
+        raise CommandTimeout(proc.returncode, cmd, timeout, output=out, stderr=err)
+    if outcome == "cancelled":
+        raise CommandCancelled(proc.returncode, cmd, output=out, stderr=err)
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=out, stderr=err)
+    return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+
+
+def check_output(cmd, logger=None, phase="probe", timeout=None, cancellable=True):
+    """Run cmd and return its stdout as text, raising CalledProcessError on failure."""
+    return run_command(cmd, logger, phase=phase, timeout=timeout, cancellable=cancellable).stdout
+
+
+def deadline_remaining():
+    """Return the seconds left before the thread's phase deadline, or None without one."""
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+def sleep(seconds):
+    """Sleep that returns early (True) when the thread's stop event is set or its phase
+    deadline passes, so retry loops end with the phase."""
+    profiling.checkpoint()
+    remaining = deadline_remaining()
+    expires = remaining is not None and remaining <= seconds
+    if expires:
+        seconds = remaining
+    stop_event = _current_stop_event()
+    if stop_event is None:
+        time.sleep(seconds)
+        return expires
+    return stop_event.wait(seconds) or expires
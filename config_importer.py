@@ -0,0 +1,247 @@
+import argparse
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import config_index
+import profile_validator
+from banner import display_banner
+from config_manager import get_next_available_file, log_message
+
+# Members larger than this are not VPN profiles or credentials and are skipped unread
+MAX_MEMBER_SIZE = 1024 * 1024
+MAX_AUTH_SIZE = 4 * 1024
+
+AUTH_EXTENSIONS = (".txt", ".auth", ".pass", ".creds")
+
+# Certificates and keys an OpenVPN config may name (ca, cert, key, tls-auth, tls-crypt); they
+# are inlined into the imported config, since the archive's layout is not kept
+KEY_EXTENSIONS = (".crt", ".cer", ".cert", ".pem", ".key", ".ca")
+MAX_KEY_SIZE = 64 * 1024
+
+
+def iter_members(archive_path):
+    """Yield (name, size, file object) for each regular file of a zip or tar archive.
+
+    Tar archives (plain or compressed) are read as a stream, so each file object is only
+    valid until the next member is requested.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as f:
+                    yield info.filename, info.file_size, f
+    else:
+        with tarfile.open(archive_path, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, member.size, archive.extractfile(member)
+
+
+def classify(name, size):
+    """Return 'openvpn', 'wireguard', 'auth', 'key' or None for an archive member."""
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name or size > MAX_MEMBER_SIZE:
+        return None
+    lower = base.lower()
+    if lower.endswith(".ovpn"):
+        return "openvpn"
+    if lower.endswith(".conf"):
+        return "wireguard"
+    if lower.endswith(AUTH_EXTENSIONS) and size <= MAX_AUTH_SIZE:
+        return "auth"
+    if lower.endswith(KEY_EXTENSIONS) and size <= MAX_KEY_SIZE:
+        return "key"
+    return None
+
+
+def stage_member(f, staging_dir, number):
+    """Copy one member line by line into the staging directory.
+
+    Return (staged path, sha256, auth-user-pass argument or None, has [Interface] section,
+    files named by ca/cert/key/tls-auth/tls-crypt lines).
+    """
+    staged_path = os.path.join(staging_dir, f"member-{number}")
+    digest = hashlib.sha256()
+    auth_ref = None
+    has_interface = False
+    file_refs = []
+    with open(staged_path, "wb") as out:
+        for line in f:
+            digest.update(line)
+            out.write(line)
+            stripped = line.strip()
+            if stripped.startswith(b"auth-user-pass"):
+                parts = stripped.split(None, 1)
+                auth_ref = parts[1].decode(errors="replace") if len(parts) > 1 else ""
+            elif stripped.lower() == b"[interface]":
+                has_interface = True
+            else:
+                parts = stripped.decode(errors="replace").split()
+                if len(parts) > 1 and parts[0] in profile_validator.OVPN_FILE_OPTIONS and parts[1] != "[inline]":
+                    file_refs.append(parts[1])
+    return staged_path, digest.hexdigest(), auth_ref, has_interface, file_refs
+
+
+def find_key_file(config_name, ref, key_files):
+    """Find the staged file an OpenVPN config names: the member at that path relative to the
+    config, else the archive's only member with that file name."""
+    relative = os.path.normpath(os.path.join(os.path.dirname(config_name), ref))
+    if relative in key_files:
+        return key_files[relative]
+    matches = [staged for name, staged in key_files.items() if os.path.basename(name) == os.path.basename(ref)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def inline_block(line, key_path):
+    """Return the inline form of a ca/cert/key/tls-auth/tls-crypt line naming key_path."""
+    parts = line.decode(errors="replace").split()
+    with open(key_path, "rb") as f:
+        content = f.read().rstrip(b"\n") + b"\n"
+    block = f"<{parts[0]}>\n".encode() + content + f"</{parts[0]}>\n".encode()
+    if parts[0] == "tls-auth" and len(parts) > 2:
+        block += f"key-direction {parts[2]}\n".encode()  # The direction argument of the file form
+    return block
+
+
+def write_atomically(source_path, target_path, auth_line=None, key_files=None):
+    """Copy a staged file to target_path via a temporary file and rename.
+
+    With auth_line, auth-user-pass lines are replaced by it. key_files maps the files named
+    by ca/cert/key/tls-auth/tls-crypt lines to staged copies, which replace the lines inline.
+    """
+    tmp_path = os.path.join(os.path.dirname(target_path), f".{os.path.basename(target_path)}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(source_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+        for line in src:
+            parts = line.split()
+            if auth_line is not None and line.strip().startswith(b"auth-user-pass"):
+                line = auth_line.encode()
+            elif key_files and len(parts) > 1 and parts[0].decode(errors="replace") in profile_validator.OVPN_FILE_OPTIONS \
+                    and parts[1].decode(errors="replace") in key_files:
+                line = inline_block(line, key_files[parts[1].decode(errors="replace")])
+            dst.write(line)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, target_path)
+
+
+def pair_auth(config_name, auth_ref, auth_files):
+    """Find the staged auth file for an OpenVPN config: the file its auth-user-pass line
+    names, else one with the config's stem, else the archive's only auth file."""
+    if auth_ref:
+        match = auth_files.get(os.path.basename(auth_ref))
+        if match:
+            return match
+    stem = os.path.splitext(os.path.basename(config_name))[0]
+    for name, staged in auth_files.items():
+        if os.path.splitext(name)[0] == stem:
+            return staged
+    if len(auth_files) == 1:
+        return next(iter(auth_files.values()))
+    return None
+
+
+def import_archive(archive_path, config_dir='OP_VPNS', auth_dir='AUTH', wg_dir='WG_VPNS', verbose=False):
+    """Import the OpenVPN and WireGuard profiles of a provider archive.
+
+    Profiles are renamed to the next free config-N (auth-N for credentials), duplicates of
+    already present profiles are skipped by content hash, and every file is written through
+    a temporary file and renamed into place. Members are streamed to a staging directory
+    one at a time, so memory use does not depend on the archive's size. Certificates and keys
+    an OpenVPN config names are inlined into it; a config naming one the archive lacks is not
+    imported (counted as incomplete).
+    Return a dict of counts.
+    """
+    counts = {"openvpn": 0, "wireguard": 0, "duplicates": 0, "skipped": 0, "incomplete": 0}
+    for directory in (config_dir, auth_dir, wg_dir):
+        os.makedirs(directory, exist_ok=True)
+    seen = config_index.known_hashes()
+    staging_dir = tempfile.mkdtemp(prefix=".import-", dir=".")
+    try:
+        configs = []
+        auth_files = {}
+        key_files = {}
+        for number, (name, size, f) in enumerate(iter_members(archive_path)):
+            kind = classify(name, size)
+            if kind is None:
+                counts["skipped"] += 1
+                continue
+            staged_path, sha256, auth_ref, has_interface, file_refs = stage_member(f, staging_dir, number)
+            if kind == "auth":
+                auth_files[os.path.basename(name)] = staged_path
+            elif kind == "key":
+                key_files[os.path.normpath(name)] = staged_path
+            elif kind == "wireguard" and not has_interface:
+                counts["skipped"] += 1
+                os.remove(staged_path)
+            elif sha256 in seen:
+                counts["duplicates"] += 1
+                os.remove(staged_path)
+            else:
+                seen.add(sha256)
+                configs.append((name, kind, staged_path, sha256, auth_ref, file_refs))
+
+        fallback_auth = get_next_available_file(auth_dir, "auth", ".txt")
+        next_numbers = {kind: config_index.next_number(kind) for kind in ("openvpn", "wireguard")}
+        imported = []
+        for name, kind, staged_path, sha256, auth_ref, file_refs in sorted(configs, key=lambda c: config_index.natural_key(c[0])):
+            inlined = {ref: find_key_file(name, ref, key_files) for ref in file_refs}
+            missing = [ref for ref, staged in inlined.items() if staged is None]
+            if missing:
+                log_message(f"Not importing {name}: it needs {', '.join(missing)}, which the archive does not contain.", True)
+                counts["incomplete"] += 1
+                continue
+            number = next_numbers[kind]
+            next_numbers[kind] += 1
+            details = {"source": os.path.basename(name), "source_sha256": sha256,
+                       "archive": os.path.basename(archive_path)}
+            if kind == "wireguard":
+                target_path = os.path.join(wg_dir, f"config-{number}.conf")
+                write_atomically(staged_path, target_path)
+            else:
+                target_path = os.path.join(config_dir, f"config-{number}.ovpn")
+                auth_line = None
+                if auth_ref is not None:
+                    auth_source = pair_auth(name, auth_ref, auth_files) or fallback_auth
+                    if auth_source:
+                        auth_path = os.path.join(auth_dir, f"auth-{number}.txt")
+                        write_atomically(auth_source, auth_path)  # Credentials land before the config names them
+                        auth_line = f"auth-user-pass {auth_path}\n"
+                        details["auth"] = auth_path
+                    else:
+                        log_message(f"No authentication file found for {name}.", verbose)
+                write_atomically(staged_path, target_path, auth_line, inlined)
+            imported.append((target_path, kind, config_index.file_sha256(target_path), details))
+            counts[kind] += 1
+            log_message(f"Imported {name} as {target_path}", verbose)
+
+        if imported:
+            config_index.add_all(imported)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import OpenVPN/WireGuard profiles from provider zip or tar archives.")
+    parser.add_argument("archives", nargs="+", help="Zip or tar (optionally compressed) archives to import")
+    parser.add_argument("-v", "--verbose", action="store_true", help="List every imported profile")
+    args = parser.parse_args()
+
+    display_banner()
+    for archive_path in args.archives:
+        try:
+            counts = import_archive(archive_path, verbose=args.verbose)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print(f"Failed to import {archive_path}: {e}")
+            continue
+        print(f"{archive_path}: imported {counts['openvpn']} OpenVPN and {counts['wireguard']} WireGuard profiles, "
+              f"skipped {counts['duplicates']} duplicates and {counts['skipped']} other files.")
+        if counts["incomplete"]:
+            print(f"{counts['incomplete']} OpenVPN profile(s) were not imported because the certificates or keys "
+                  f"they name are missing from the archive.")
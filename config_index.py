@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import profile_templates
+
+# Content hash, auth file and origin of every profile in the config directories
+INDEX_FILE = "profile_index.json"
+
+VPN_PROFILE_DIRS = {"wireguard": ("WG_VPNS", ".conf"), "openvpn": ("OP_VPNS", ".ovpn")}
+AUTH_DIR = "AUTH"
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_index = None
+_dir_mtimes = {}
+
+
+def natural_key(name):
+    """Sort key that orders config-2 before config-10."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load():
+    global _index
+    if _index is None:
+        try:
+            with open(INDEX_FILE, "r") as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+
+def _save():
+    # A unique temporary name, so the rotator and vpn_manager never write to the same one
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(INDEX_FILE)}.", suffix=".tmp",
+                                    dir=os.path.dirname(INDEX_FILE) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(_index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, INDEX_FILE)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _scan(vpn_type):
+    """Bring the index entries of one directory in line with the files on disk.
+
+    Only files whose size or mtime changed since the last scan are hashed again.
+    Return True if anything changed.
+    """
+    directory, extension = VPN_PROFILE_DIRS[vpn_type]
+    index = _load()
+    try:
+        names = [f for f in os.listdir(directory) if f.endswith(extension)]
+    except OSError:
+        names = []
+    present = set()
+    changed = False
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # Removed while scanning
+        present.add(path)
+        entry = index.get(path)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+            continue
+        entry = dict(entry or {}, type=vpn_type, size=st.st_size, mtime=st.st_mtime_ns)
+        try:
+            entry["sha256"] = file_sha256(path)
+        except OSError:
+            continue
+        index[path] = entry
+        changed = True
+    for path in [p for p, e in index.items() if e.get("type") == vpn_type and p not in present]:
+        del index[path]
+        changed = True
+    return changed
+
+
+def refresh(vpn_types=None, force=False):
+    """Rescan the config directories whose contents changed (by directory mtime)."""
+    with _lock:
+        changed = False
+        for vpn_type in vpn_types or VPN_PROFILE_DIRS:
+            directory = VPN_PROFILE_DIRS[vpn_type][0]
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = None
+            if force or _dir_mtimes.get(directory) != mtime:
+                changed = _scan(vpn_type) or changed
+                _dir_mtimes[directory] = mtime
+        if changed:
+            _save()
+        return changed
+
+
+def list_profiles(vpn_type):
+    """Return the config paths of vpn_type in natural order, including the templated profiles
+    (see profile_templates), which exist as files only once selected."""
+    refresh([vpn_type])
+    with _lock:
+        paths = [p for p, e in _load().items() if e.get("type") == vpn_type]
+    paths += profile_templates.list_profiles(*VPN_PROFILE_DIRS[vpn_type])
+    return sorted(paths, key=natural_key)
+
+
+def get(path):
+    if profile_templates.is_templated(path):
+        try:
+            sha256 = profile_templates.render(path)[1]
+        except (OSError, KeyError, ValueError):
+            return None
+        vpn_type = next(t for t, (_, extension) in VPN_PROFILE_DIRS.items() if path.endswith(extension))
+        return {"type": vpn_type, "sha256": sha256, "template": profile_templates.template_of(path)}
+    with _lock:
+        entry = _load().get(path)
+        return dict(entry) if entry else None
+
+
+def known_hashes(vpn_type=None):
+    """Return the content hashes of all indexed profiles (of vpn_type, if given), including
+    the hashes of the originals that imported profiles were rewritten from."""
+    refresh([vpn_type] if vpn_type else None)
+    hashes = set()
+    with _lock:
+        for entry in _load().values():
+            if vpn_type is None or entry.get("type") == vpn_type:
+                hashes.update(entry[key] for key in ("sha256", "source_sha256") if key in entry)
+    return hashes
+
+
+def next_number(vpn_type):
+    """Return the first N above every existing config-N of vpn_type (and auth-N for OpenVPN)."""
+    directory = VPN_PROFILE_DIRS[vpn_type][0]
+    highest = 0
+    for folder in (directory, AUTH_DIR) if vpn_type == "openvpn" else (directory,):
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            match = re.match(r"^(?:config|auth)-(\d+)\.", name)
+            if match:
+                highest = max(highest, int(match.group(1)))
+    return highest + 1
+
+
+def add_all(profiles):
+    """Record profiles written by the importer: (path, vpn_type, sha256, details) tuples,
+    details being e.g. {"auth": ..., "source": ...}. The index is saved once."""
+    with _lock:
+        index = _load()
+        for path, vpn_type, sha256, details in profiles:
+            st = os.stat(path)
+            index[path] = dict(details, type=vpn_type, sha256=sha256, size=st.st_size, mtime=st.st_mtime_ns)
+        _save()
@@ -0,0 +1,280 @@
+import collections
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+import privileged_ops
+
+# Address the stub listens on; the system resolver is pointed here while it runs
+DEFAULT_LISTEN = ("127.0.0.1", 53)
+
+# Name under which the stub registers itself with resolvconf
+RESOLVCONF_INTERFACE = "lo.stealth-shift"
+
+UPSTREAM_TIMEOUT = 2       # Seconds to wait for each upstream server
+MAX_TTL = 3600             # Upper bound for cached TTLs
+SERVE_STALE_FOR = 300      # Seconds an expired answer may be served while upstream is unreachable
+STALE_TTL = 30             # TTL given to stale answers (RFC 8767)
+MAX_ENTRIES = 10000        # LRU bound on cached answers
+
+TYPE_OPT = 41
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_upstreams = []
+_fallback_upstreams = []
+_server = None
+_server_thread = None
+_stats_lock = threading.Lock()  # The handlers run in one thread per query
+_stats = {"queries": 0, "hits": 0, "stale_hits": 0, "misses": 0, "upstream_failures": 0}
+
+
+def dns_servers_from_config(path):
+    """Return the DNS servers named in a WireGuard ('DNS =') or OpenVPN ('dhcp-option DNS') config."""
+    servers = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                match = re.match(r"^DNS\s*=\s*(.+)$", line, re.IGNORECASE)
+                if match:
+                    servers.extend(s.strip() for s in match.group(1).split(","))
+                    continue
+                match = re.match(r"^dhcp-option\s+DNS\s+(\S+)", line)
+                if match:
+                    servers.append(match.group(1))
+    except OSError:
+        return []
+    # Only literal addresses can be used as upstreams; WireGuard also allows search domains here
+    return [s for s in servers if re.fullmatch(r"[0-9.]+|[0-9a-fA-F:]+", s)]
+
+
+def system_nameservers(path="/etc/resolv.conf"):
+    """Return the non-loopback nameservers currently configured for the system."""
+    servers = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver" and not parts[1].startswith("127."):
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers
+
+
+def _skip_name(message, offset):
+    """Return the offset just past the (possibly compressed) domain name at offset."""
+    while True:
+        length = message[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+def _parse_question(message):
+    """Return ((qname, qtype, qclass), end_offset) for the first question in message."""
+    offset = 12
+    labels = []
+    while message[offset] != 0:
+        length = message[offset]
+        labels.append(message[offset + 1:offset + 1 + length].decode("ascii", "replace").lower())
+        offset += length + 1
+    offset += 1
+    qtype, qclass = struct.unpack("!HH", message[offset:offset + 4])
+    return (".".join(labels), qtype, qclass), offset + 4
+
+
+def _ttl_offsets(message, question_end):
+    """Return (offsets of each RR's TTL field, minimum TTL) for answer and authority records."""
+    ancount, nscount, arcount = struct.unpack("!HHH", message[6:12])
+    offset = question_end
+    offsets = []
+    min_ttl = None
+    for index in range(ancount + nscount + arcount):
+        offset = _skip_name(message, offset)
+        rtype, _, ttl, rdlength = struct.unpack("!HHIH", message[offset:offset + 10])
+        if rtype != TYPE_OPT:
+            offsets.append(offset + 4)
+            if index < ancount + nscount:
+                min_ttl = ttl if min_ttl is None else min(min_ttl, ttl)
+        offset += 10 + rdlength
+    return offsets, min_ttl
+
+
+def _make_error(query, rcode):
+    """Build a header-and-question-only response to query with the given rcode."""
+    _, question_end = _parse_question(query)
+    flags = struct.unpack("!H", query[2:4])[0]
+    flags = 0x8000 | (flags & 0x0100) | 0x0080 | rcode  # QR, copy RD, set RA
+    return query[:2] + struct.pack("!HHHHH", flags, 1, 0, 0, 0) + query[12:question_end]
+
+
+def _store(key, response, question_end):
+    rcode = response[3] & 0x0F
+    truncated = response[2] & 0x02
+    if truncated or rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+        return
+    try:
+        offsets, min_ttl = _ttl_offsets(response, question_end)
+    except (IndexError, struct.error):
+        return
+    if not min_ttl:
+        return  # Nothing cacheable (no records, or TTL 0)
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), min(min_ttl, MAX_TTL), bytearray(response), offsets)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _from_cache(key, query_id, allow_stale=False):
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is None:
+        return None
+    stored, ttl, response, offsets = entry
+    age = int(time.monotonic() - stored)
+    if age >= ttl and not (allow_stale and age < ttl + SERVE_STALE_FOR):
+        return None
+    answer = bytearray(response)
+    answer[0:2] = query_id
+    for offset in offsets:
+        original = struct.unpack("!I", answer[offset:offset + 4])[0]
+        struct.pack_into("!I", answer, offset, max(original - age, 0) if age < ttl else STALE_TTL)
+    return bytes(answer)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _forward(query):
+    """Send query to each upstream in turn and return the first response, or None."""
+    for upstream in list(_upstreams):
+        family = socket.AF_INET6 if ":" in upstream[0] else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(UPSTREAM_TIMEOUT)
+            try:
+                sock.sendto(query, upstream)
+                response, _ = sock.recvfrom(4096)
+            except OSError:
+                _count("upstream_failures")
+                continue
+        if response[:2] == query[:2]:
+            return response
+    return None
+
+
+def resolve(query):
+    """Answer a raw DNS query from the cache or through the current upstreams."""
+    _count("queries")
+    try:
+        key, question_end = _parse_question(query)
+    except (IndexError, struct.error):
+        return None  # Not a DNS query we can answer
+
+    cached = _from_cache(key, query[:2])
+    if cached:
+        _count("hits")
+        return cached
+
+    _count("misses")
+    response = _forward(query)
+    if response is not None:
+        _store(key, response, question_end)
+        return response
+
+    # Upstream unreachable, typically mid-rotation: fall back to a recently expired answer
+    stale = _from_cache(key, query[:2], allow_stale=True)
+    if stale:
+        _count("stale_hits")
+        return stale
+    return _make_error(query, RCODE_SERVFAIL)
+
+
+class _DNSHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        query, sock = self.request
+        response = resolve(query)
+        if response:
+            sock.sendto(response, self.client_address)
+
+
+class _DNSServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def set_upstreams(servers, logger=None, port=53):
+    """Point the stub at new upstream servers (e.g. the new tunnel's DNS). The cache is kept."""
+    _upstreams[:] = [(s, port) if isinstance(s, str) else tuple(s) for s in servers]
+    if logger:
+        logger.debug(f"DNS cache upstreams: {', '.join(f'{h}:{p}' for h, p in _upstreams)}")
+
+
+def use_config_upstreams(config_path, logger=None):
+    """Forward through the DNS servers of the tunnel config being brought up, or the fallback."""
+    set_upstreams(dns_servers_from_config(config_path) or _fallback_upstreams, logger)
+
+
+def start_dns_cache(logger, listen=DEFAULT_LISTEN, upstreams=None):
+    """Start the caching DNS stub in a background thread and return its (host, port).
+
+    upstreams are used until a tunnel config names its own DNS servers, and for configs
+    that name none.
+    """
+    global _server, _server_thread
+    if upstreams:
+        _fallback_upstreams[:] = upstreams
+        set_upstreams(upstreams, logger)
+    _server = _DNSServer(listen, _DNSHandler)
+    _server_thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    _server_thread.start()
+    address = _server.server_address
+    logger.debug(f"DNS cache listening on {address[0]}:{address[1]}")
+    return address
+
+
+def stop_dns_cache(logger):
+    """Stop the DNS stub; the cache is discarded."""
+    global _server, _server_thread
+    if _server is None:
+        return
+    _server.shutdown()
+    _server.server_close()
+    _server = None
+    _server_thread = None
+    with _cache_lock:
+        _cache.clear()
+    logger.debug(f"DNS cache stopped: {get_stats()}")
+
+
+def is_running():
+    return _server is not None
+
+
+def get_stats():
+    with _cache_lock:
+        entries = len(_cache)
+    with _stats_lock:
+        return dict(_stats, entries=entries)
+
+
+def use_as_system_resolver(logger):
+    """Make the stub the system's only nameserver through resolvconf."""
+    privileged_ops.run_privileged(["resolvconf", "-a", RESOLVCONF_INTERFACE, "-m", "0", "-x"], logger,
+                                  input=f"nameserver {DEFAULT_LISTEN[0]}\n")
+
+
+def restore_system_resolver(logger):
+    """Remove the stub's resolvconf entry."""
+    privileged_ops.run_privileged(["resolvconf", "-d", RESOLVCONF_INTERFACE, "-f"], logger, check=False)
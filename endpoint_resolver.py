@@ -0,0 +1,127 @@
+import ipaddress
+import re
+import socket
+import threading
+import time
+
+# How long (seconds) a resolved endpoint is reused
+CACHE_TTL = 600
+
+WG_ENDPOINT_PATTERN = re.compile(r"^(\s*Endpoint\s*=\s*)(\S+)(\s*)$", re.IGNORECASE)
+OVPN_REMOTE_PATTERN = re.compile(r"^(\s*remote\s+)(\S+)(.*)$")
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _is_literal(host):
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+def _split_wg_endpoint(value):
+    """Split a WireGuard 'host:port' or '[v6]:port' endpoint into (host, port)."""
+    if value.startswith("["):
+        host, _, port = value[1:].partition("]:")
+        return host, port
+    host, _, port = value.rpartition(":")
+    return host, port
+
+
+def config_endpoint_hosts(path):
+    """Return the endpoint host names (not literal IPs) used by a WireGuard or OpenVPN config."""
+    hosts = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                match = WG_ENDPOINT_PATTERN.match(line)
+                if match:
+                    host = _split_wg_endpoint(match.group(2))[0]
+                else:
+                    match = OVPN_REMOTE_PATTERN.match(line)
+                    if not match:
+                        continue
+                    host = match.group(2)
+                if not _is_literal(host) and host not in hosts:
+                    hosts.append(host)
+    except OSError:
+        pass
+    return hosts
+
+
+def resolve_host(host, logger=None):
+    """Resolve host to a literal IP through the cache; return None if it cannot be resolved."""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(host)
+    if cached and now - cached[1] < CACHE_TTL:
+        return cached[0]
+    try:
+        infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_UDP)
+    except OSError as e:
+        if logger:
+            logger.debug(f"Could not resolve VPN endpoint {host}: {e}")
+        return cached[0] if cached else None  # An old answer beats none during a rotation
+    # Prefer IPv4, as the tunnel underlay usually is
+    infos.sort(key=lambda info: info[0] != socket.AF_INET)
+    address = infos[0][4][0]
+    with _cache_lock:
+        _cache[host] = (address, now)
+    if logger:
+        logger.debug(f"Resolved VPN endpoint {host} to {address}")
+    return address
+
+
+def prefetch(config_paths, logger=None):
+    """Resolve the endpoints of the given configs ahead of time, e.g. while the old tunnel is up."""
+    for path in config_paths:
+        for host in config_endpoint_hosts(path):
+            resolve_host(host, logger)
+
+
+def with_literal_endpoints(lines, logger=None):
+    """Return config lines with endpoint host names replaced by their resolved IPs."""
+    result = []
+    for line in lines:
+        match = WG_ENDPOINT_PATTERN.match(line)
+        if match:
+            host, port = _split_wg_endpoint(match.group(2))
+            address = None if _is_literal(host) else resolve_host(host, logger)
+            if address:
+                endpoint = f"[{address}]:{port}" if ":" in address else f"{address}:{port}"
+                line = f"{match.group(1)}{endpoint}{match.group(3)}"
+        else:
+            match = OVPN_REMOTE_PATTERN.match(line)
+            if match and not _is_literal(match.group(2)):
+                address = resolve_host(match.group(2), logger)
+                if address:
+                    newline = "\n" if line.endswith("\n") else ""
+                    line = f"{match.group(1)}{address}{match.group(3)}{newline}"
+        result.append(line)
+    return result
+
+
+def config_endpoints(path, logger=None):
+    """Return the resolved endpoints of a config: 'ip:port' for WireGuard peers, the IP of each
+    OpenVPN remote. Hosts that cannot be resolved are left out."""
+    try:
+        with open(path, "r") as f:
+            lines = with_literal_endpoints(f.readlines(), logger)
+    except OSError:
+        return []
+    endpoints = []
+    for line in lines:
+        match = WG_ENDPOINT_PATTERN.match(line)
+        if match:
+            host = _split_wg_endpoint(match.group(2))[0]
+        else:
+            match = OVPN_REMOTE_PATTERN.match(line)
+            if not match:
+                continue
+            host = match.group(2)
+        if _is_literal(host):
+            endpoints.append(match.group(2))
+    return endpoints
@@ -0,0 +1,149 @@
+import os
+import random
+import re
+import socket
+import subprocess
+import time
+import command_executor
+import endpoint_resolver
+import net_inventory
+import privileged_ops
+
+# Route lookups for this address show where ordinary traffic leaves; 'ip route get' sends nothing
+ROUTE_PROBE_ADDRESS = "1.1.1.1"
+
+# A handshake older than this is stale (WireGuard rekeys every 2 minutes while traffic flows)
+MAX_HANDSHAKE_AGE = 180
+
+# Seconds to wait for the first handshake of a tunnel that was just brought up
+HANDSHAKE_WAIT = 5
+
+# Fraction of rotations whose exit is also confirmed with an external echo service
+DEFAULT_EXTERNAL_RATE = 0.1
+
+ROUTE_DEVICE_PATTERN = re.compile(r"\bdev\s+(\S+)")
+
+_external_rate = DEFAULT_EXTERNAL_RATE
+
+
+def configure(external_rate):
+    """Set the fraction of rotations checked externally (1 = every rotation, and no local checks)."""
+    global _external_rate
+    _external_rate = max(0.0, min(1.0, external_rate))
+
+
+def local_checks_enabled():
+    return _external_rate < 1.0
+
+
+def external_check_due():
+    """Return True if this rotation's exit should also be confirmed externally."""
+    return random.random() < _external_rate
+
+
+def route_device(address=ROUTE_PROBE_ADDRESS, logger=None):
+    """Return the device the kernel would send traffic to address through, or None."""
+    try:
+        output = command_executor.check_output(["ip", "-o", "route", "get", address], logger, phase="probe")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = ROUTE_DEVICE_PATTERN.search(output)
+    return match.group(1) if match else None
+
+
+def _nudge(address=ROUTE_PROBE_ADDRESS, device=None):
+    """Queue one empty UDP datagram (discard port) so a fresh WireGuard peer starts its handshake.
+
+    With device, the datagram leaves through that device whatever the routes say (needs root).
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            if device:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, device.encode())
+            s.sendto(b"", (address, 9))
+    except OSError:
+        pass
+
+
+def wireguard_peers(device, logger=None):
+    """Return [{'endpoint', 'latest_handshake'}] for the peers of a WireGuard device ('wg show dump')."""
+    output = privileged_ops.run_privileged(["wg", "show", device, "dump"], logger, phase="probe").stdout
+    peers = []
+    for line in output.splitlines()[1:]:  # The first line describes the interface itself
+        fields = line.split("\t")
+        if len(fields) >= 5:
+            peers.append({"endpoint": fields[2], "latest_handshake": int(fields[4] or 0)})
+    return peers
+
+
+def wait_for_handshake(device, endpoints, logger, bind=False):
+    """Wait up to HANDSHAKE_WAIT for the peer of a WireGuard device at one of endpoints to have a
+    recent handshake. Return that endpoint's IP, or None.
+
+    With bind, the nudge is sent through device itself, for a tunnel no route leads to yet.
+    """
+    deadline = time.monotonic() + HANDSHAKE_WAIT
+    nudged = False
+    while True:
+        try:
+            peers = wireguard_peers(device, logger)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.debug(f"Could not read the peers of {device}: {e}")
+            return None
+        peer = next((p for p in peers if p["endpoint"] in endpoints), None)
+        if peer is None:
+            logger.debug(f"{device} has no peer at {', '.join(sorted(endpoints)) or 'the profile endpoint'}")
+            return None
+        age = time.time() - peer["latest_handshake"]
+        if peer["latest_handshake"] and age <= MAX_HANDSHAKE_AGE:
+            return peer["endpoint"].rpartition(":")[0].strip("[]")
+        if time.monotonic() >= deadline:
+            logger.debug(f"{device} has no recent handshake with {peer['endpoint']}")
+            return None
+        if not nudged:
+            _nudge(device=device if bind else None)
+            nudged = True
+        if command_executor.sleep(0.5):
+            return None
+
+
+def verify_wireguard(profile, logger):
+    """Check a WireGuard profile's tunnel: traffic is routed through its device, the device's peer
+    is the profile's endpoint and has a recent handshake. Return the endpoint IP, or None."""
+    device = os.path.splitext(os.path.basename(profile))[0]  # wg-quick names the device after the file
+    routed = route_device(logger=logger)
+    if routed != device:
+        logger.debug(f"Default traffic goes through {routed}, not {device}")
+        return None
+    return wait_for_handshake(device, set(endpoint_resolver.config_endpoints(profile, logger)), logger)
+
+
+def verify_openvpn(profile, logger):
+    """Check an OpenVPN profile's tunnel: traffic is routed through an up tun/tap device and one of
+    the profile's remotes is routed outside it. Return that remote's IP, or None."""
+    routed = route_device(logger=logger)
+    if not routed or not os.path.exists(os.path.join(net_inventory.SYSFS_NET, routed, "tun_flags")):
+        logger.debug(f"Default traffic goes through {routed}, not a tun/tap device")
+        return None
+    info = net_inventory.get_interface(routed, max_age=0)
+    if not info or info["operstate"] == "down":
+        logger.debug(f"Tunnel device {routed} is down")
+        return None
+    for remote in endpoint_resolver.config_endpoints(profile, logger):
+        underlay = route_device(remote, logger)
+        if underlay and underlay != routed:
+            return remote
+    logger.debug(f"No remote of {profile} is routed outside {routed}")
+    return None
+
+
+def verify_local(profile, logger):
+    """Verify the tunnel of profile from local evidence only. Return its exit (the VPN server's
+    address), or None when there is no such evidence or the profile has no local checks."""
+    if not profile:
+        return None
+    if profile.endswith(".conf"):
+        return verify_wireguard(profile, logger)
+    if profile.endswith(".ovpn"):
+        return verify_openvpn(profile, logger)
+    return None  # Anonsurf: Tor's exit is only visible from outside
@@ -1,6 +1,7 @@
 import subprocess
 import sys
 import os
+import privileged_ops
 from banner import display_banner
 
 def prompt_user_for_sudo():
@@ -10,7 +11,7 @@ def prompt_user_for_sudo():
 
 def stop_wireguard():
     try:
-        interface = subprocess.run(['sudo', 'wg', 'show'], capture_output=True, text=True, check=True)
+        interface = privileged_ops.run_privileged(['wg', 'show'], phase="probe")
         lines = interface.stdout.strip().split('\n')
 
         # Check if lines is empty or contains only an empty string
@@ -27,8 +28,8 @@ def stop_wireguard():
             if line.startswith('interface: '):
                 if current_interface:
                     # Stop the previous interface before moving to the next
-                    subprocess.run(['sudo', 'wg-quick', 'down', f'WG_VPNS/{current_interface}.conf'], 
-                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                    privileged_ops.run_privileged(['wg-quick', 'down', f'WG_VPNS/{current_interface}.conf'],
+                                                  phase="vpn_down")
                     stopped_interfaces.append(current_interface)
 
                 # Update the current interface
@@ -36,8 +37,8 @@ def stop_wireguard():
 
         # Stop the last interface if there is one
         if current_interface:
-            subprocess.run(['sudo', 'wg-quick', 'down', f'WG_VPNS/{current_interface}.conf'], 
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            privileged_ops.run_privileged(['wg-quick', 'down', f'WG_VPNS/{current_interface}.conf'],
+                                          phase="vpn_down")
             stopped_interfaces.append(current_interface)
 
         if stopped_interfaces:
@@ -51,9 +52,9 @@ def stop_wireguard():
 
 def stop_openvpn():
     try:
-        openvpn_pids = subprocess.check_output(['pgrep', 'openvpn']).decode('utf-8').strip().split('\n')
+        openvpn_pids = privileged_ops.find_pids('openvpn')
         if openvpn_pids:
-            subprocess.run(['sudo', 'kill'] + openvpn_pids, check=True)
+            privileged_ops.kill_pids(openvpn_pids)
             print("Stopped OpenVPN Successfully.")
         else:
             print("No OpenVPN active service found.")
@@ -63,12 +64,12 @@ def stop_openvpn():
 def stop_anonsurf():
     try:
         # Check if AnonSurf is active
-        result = subprocess.run(['sudo', 'anonsurf', 'status'], capture_output=True, text=True, check=True)
+        result = privileged_ops.run_privileged(['anonsurf', 'status'], phase="anonsurf")
 
         # Check the status output for "active"
         if "active" in result.stdout and "inactive" not in result.stdout:
             # If active, stop AnonSurf
-            subprocess.run(['sudo', 'anonsurf', 'stop'], capture_output=True, text=True, check=True)
+            privileged_ops.run_privileged(['anonsurf', 'stop'], phase="anonsurf")
             print("Stopped AnonSurf Successfully.")
         else:
             print("No AnonSurf active service found.")
@@ -0,0 +1,278 @@
+import os
+import subprocess
+import threading
+import command_executor
+import net_inventory
+import privileged_ops
+
+# DHCP lease and pid files of the identities
+POOL_DIR = "/run/stealth-shift/macvlan"
+
+# Identities are macvlan devices named DEVICE_PREFIX0, DEVICE_PREFIX1, ...
+DEVICE_PREFIX = "ssmv"
+
+# Metric of the default route through the active identity; lower than the metrics DHCP clients
+# and NetworkManager give the parent's own default route, so it wins without removing that one
+ROUTE_METRIC = 10
+
+# Without these, the parent answers ARP for the identities' addresses with its own MAC
+# (written for the parent interface, restored on shutdown)
+ARP_SYSCTLS = {"arp_ignore": "1", "arp_announce": "2"}
+
+_pool = None
+
+
+def _parse_lease(path):
+    """Return (address, netmask, router) from the last lease in a dhclient lease file, or None."""
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+    except OSError:
+        return None
+    lease = text.rpartition("lease {")[2]
+    values = {}
+    for line in lease.splitlines():
+        words = line.strip().rstrip(";").split()
+        if len(words) >= 2 and words[0] == "fixed-address":
+            values["address"] = words[1]
+        elif len(words) >= 3 and words[0] == "option" and words[1] in ("subnet-mask", "routers"):
+            values[words[1]] = words[2].split(",")[0]
+    if "address" not in values or "routers" not in values:
+        return None
+    return values["address"], values.get("subnet-mask", "255.255.255.0"), values["routers"]
+
+
+def _prefix_length(netmask):
+    return sum(bin(int(octet)).count("1") for octet in netmask.split("."))
+
+
+class Identity:
+    """One macvlan sub-interface of the parent, with its own MAC and DHCP lease."""
+
+    def __init__(self, parent, device, mac):
+        self.parent = parent
+        self.device = device
+        self.mac = mac
+        self.lease_file = os.path.join(POOL_DIR, f"{device}.lease")
+        self.pid_file = os.path.join(POOL_DIR, f"{device}.pid")
+        self.address = None
+        self.gateway = None
+
+    def _dhclient(self, *options):
+        # -sf /bin/true: take the lease but leave addresses and routes to us
+        return ["dhclient", *options, "-sf", "/bin/true", "-pf", self.pid_file, "-lf", self.lease_file, self.device]
+
+    def start(self, logger):
+        """Create the device and acquire an address on it; the default route is not touched."""
+        privileged_ops.ip_batch([
+            ["link", "add", "link", self.parent, "name", self.device, "address", self.mac, "type", "macvlan", "mode", "bridge"],
+            ["link", "set", self.device, "up"],
+        ], logger)
+        try:
+            privileged_ops.run_privileged(self._dhclient("-1"), logger, phase="link", timeout=60)
+            lease = _parse_lease(self.lease_file)
+            if lease is None:
+                raise subprocess.CalledProcessError(1, "dhclient", output=f"no usable lease for {self.device}")
+            address, netmask, self.gateway = lease
+            privileged_ops.ip_batch([["addr", "add", f"{address}/{_prefix_length(netmask)}", "dev", self.device]], logger)
+            self.address = address
+        except subprocess.CalledProcessError:
+            self.stop(logger)
+            raise
+
+    def stop(self, logger):
+        """Release the lease and remove the device."""
+        if os.path.exists(self.pid_file):
+            privileged_ops.run_privileged(self._dhclient("-r"), logger, phase="link", check=False, cancellable=False)
+        privileged_ops.run_privileged(["ip", "link", "del", self.device], logger, phase="link",
+                                      check=False, cancellable=False)
+        for path in (self.lease_file, self.pid_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        net_inventory.invalidate(self.device)
+
+
+class MacvlanPool:
+    """A pool of macvlan identities over one parent interface.
+
+    A rotation moves the default route and the VPN underlay's host routes to the next identity,
+    so the host's MAC on the wire changes without bouncing the parent's link. The retired
+    identity is replaced in the background by one with a fresh MAC and lease.
+    """
+
+    def __init__(self, parent, size, generate_mac, logger):
+        self.parent = parent
+        self.size = size
+        self.generate_mac = generate_mac
+        self.logger = logger
+        self.spares = []
+        self.active = None
+        self.retired = []
+        self.starting = set()
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.underlay = net_inventory.default_route()
+        self.saved_sysctls = {}
+        self.stopping = False
+        os.makedirs(POOL_DIR, mode=0o700, exist_ok=True)
+
+    def _free_device(self):
+        used = {i.device for i in self.spares + self.retired} | self.starting | ({self.active.device} if self.active else set())
+        number = 0
+        while f"{DEVICE_PREFIX}{number}" in used or net_inventory.interface_exists(f"{DEVICE_PREFIX}{number}"):
+            number += 1
+        return f"{DEVICE_PREFIX}{number}"
+
+    def _set_sysctls(self):
+        for name, value in ARP_SYSCTLS.items():
+            path = f"/proc/sys/net/ipv4/conf/{self.parent}/{name}"
+            try:
+                with open(path, "r") as f:
+                    self.saved_sysctls[path] = f.read().strip()
+                with open(path, "w") as f:
+                    f.write(value + "\n")
+            except OSError as e:
+                self.logger.warning(f"Could not set {path}: {e}")
+
+    def _spawn(self):
+        with self.lock:
+            identity = Identity(self.parent, self._free_device(), self.generate_mac(self.logger))
+            self.starting.add(identity.device)
+        try:
+            identity.start(self.logger)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.error(f"Failed to bring up MAC identity {identity.device}: {e}")
+            return None
+        finally:
+            with self.lock:
+                self.starting.discard(identity.device)
+        with self.lock:
+            self.spares.append(identity)
+        self.logger.debug(f"MAC identity {identity.device} ready: {identity.mac}, {identity.address}")
+        return identity
+
+    def _host_routes(self, device):
+        """Return the /32 routes via a gateway on device (VPN servers' underlay routes)."""
+        try:
+            output = command_executor.check_output(["ip", "-o", "-4", "route", "show", "dev", device], self.logger)
+        except (OSError, subprocess.CalledProcessError):
+            return []
+        routes = []
+        for line in output.splitlines():
+            words = line.split()
+            if "via" in words and words[0] != "default" and ("/" not in words[0] or words[0].endswith("/32")):
+                routes.append(words[0])
+        return routes
+
+    def _route_through(self, identity):
+        """Move the default route and the host routes of the current device to identity."""
+        old_device = self.active.device if self.active else self.parent
+        via = ["via", identity.gateway, "dev", identity.device, "src", identity.address]
+        commands = [["route", "replace", "default"] + via + ["metric", str(ROUTE_METRIC)]]
+        commands += [["route", "replace", prefix] + via for prefix in self._host_routes(old_device)]
+        privileged_ops.ip_batch(commands, self.logger)
+
+    def start(self):
+        """Bring up the identities; the first rotate() routes through one. Return the number up."""
+        self._set_sysctls()
+        failures = 0
+        while len(self.spares) < self.size and failures < self.size * 3:
+            if self._spawn() is None:
+                failures += 1
+        return len(self.spares)
+
+    def rotate(self):
+        """Switch to the next ready identity and refresh the previous one in the background.
+
+        Return the new active identity, or None if no identity is ready.
+        """
+        with self.lock:
+            if not self.spares:
+                return None
+            identity = self.spares.pop(0)
+        try:
+            self._route_through(identity)
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Failed to route through MAC identity {identity.device}: {e}")
+            with self.lock:
+                self.spares.append(identity)
+            return None
+        with self.lock:
+            previous, self.active = self.active, identity
+            if previous:
+                self.retired.append(previous)
+        if previous:
+            self.refresh_async()
+        return identity
+
+    def _refresh(self):
+        while not self.stopping:
+            with self.lock:
+                if not self.retired:
+                    break
+                identity = self.retired.pop(0)
+                replace = len(self.spares) + 1 < self.size
+            identity.stop(self.logger)  # Its routes have moved to the active identity
+            if replace:
+                self._spawn()
+
+    def refresh_async(self):
+        """Replace retired identities with fresh ones in the background."""
+        if self.refresh_thread is not None and self.refresh_thread.is_alive():
+            return
+        self.refresh_thread = threading.Thread(target=self._refresh, daemon=True)
+        self.refresh_thread.start()
+
+    def current_mac(self):
+        with self.lock:
+            return self.active.mac if self.active else None
+
+    def shutdown(self):
+        """Route back through the parent and remove every identity."""
+        self.stopping = True
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
+        with self.lock:
+            identities = self.spares + self.retired + ([self.active] if self.active else [])
+            active, self.active, self.spares, self.retired = self.active, None, [], []
+        if active:
+            commands = [["route", "del", "default", "metric", str(ROUTE_METRIC)]]
+            if self.underlay:
+                gateway, device = self.underlay
+                commands += [["route", "replace", prefix, "via", gateway, "dev", device]
+                             for prefix in self._host_routes(active.device)]
+            privileged_ops.ip_batch(commands, self.logger, check=False, cancellable=False)
+        for identity in identities:
+            identity.stop(self.logger)
+        for path, value in self.saved_sysctls.items():
+            try:
+                with open(path, "w") as f:
+                    f.write(value + "\n")
+            except OSError:
+                pass
+        self.saved_sysctls.clear()
+
+
+def start_pool(parent, size, generate_mac, logger):
+    """Bring up a pool of size macvlan identities over parent. Return it, or None if none came up."""
+    global _pool
+    _pool = MacvlanPool(parent, size, generate_mac, logger)
+    if not _pool.start():
+        _pool.shutdown()
+        _pool = None
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def shutdown_pool(logger):
+    global _pool
+    if _pool is None:
+        return
+    logger.debug("Removing the macvlan MAC identities")
+    _pool.shutdown()
+    _pool = None
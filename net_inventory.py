@@ -0,0 +1,129 @@
+import os
+import socket
+import struct
+import threading
+import time
+
+SYSFS_NET = "/sys/class/net"
+
+# How long (seconds) a snapshot of an interface is reused before sysfs is read again
+CACHE_TTL = 1.0
+
+# Interface flag bits from <linux/if.h>
+IFF_UP = 0x1
+
+# Interface names are limited to IFNAMSIZ - 1 characters by the kernel
+MAX_INTERFACE_NAME_LENGTH = 15
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _read(path, default=None):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _read_interface(name):
+    """Read a snapshot of one interface from sysfs, or None if it does not exist."""
+    base = os.path.join(SYSFS_NET, name)
+    if not os.path.isdir(base):
+        return None
+
+    flags = _read(os.path.join(base, "flags"), "0x0")
+    carrier = _read(os.path.join(base, "carrier"))  # Unreadable while the link is down
+    try:
+        driver = os.path.basename(os.readlink(os.path.join(base, "device", "driver")))
+    except OSError:
+        driver = None  # Virtual interfaces have no bound driver
+
+    return {
+        "name": name,
+        "address": _read(os.path.join(base, "address")),
+        "operstate": _read(os.path.join(base, "operstate"), "unknown"),
+        "carrier": carrier == "1" if carrier is not None else None,
+        "type": int(_read(os.path.join(base, "type"), "0")),
+        "flags": int(flags, 16),
+        "driver": driver,
+    }
+
+
+def get_interface(name, max_age=CACHE_TTL):
+    """Return a cached snapshot of the interface (refreshed after max_age seconds), or None."""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(name)
+        if cached and now - cached[0] <= max_age:
+            return cached[1]
+    info = _read_interface(name)
+    with _cache_lock:
+        _cache[name] = (now, info)
+    return info
+
+
+def invalidate(name=None):
+    """Drop cached snapshots, e.g. after changing an interface's address or state."""
+    with _cache_lock:
+        if name is None:
+            _cache.clear()
+        else:
+            _cache.pop(name, None)
+
+
+def list_interfaces():
+    """Return the names of all network interfaces."""
+    try:
+        return sorted(os.listdir(SYSFS_NET))
+    except OSError:
+        return []
+
+
+def is_valid_interface_name(name):
+    """Check a name against the kernel's rules for interface names."""
+    return (
+        0 < len(name) <= MAX_INTERFACE_NAME_LENGTH
+        and name not in (".", "..")
+        and not any(c == "/" or c == ":" or c.isspace() for c in name)
+    )
+
+
+def interface_exists(name):
+    """Return True if the interface exists (has a /sys/class/net entry)."""
+    return get_interface(name) is not None
+
+
+def get_mac(name):
+    """Return the hardware address of the interface, or None."""
+    info = get_interface(name)
+    return info["address"] if info else None
+
+
+def is_admin_up(name):
+    """Return True if the interface is administratively up (IFF_UP), like 'UP' in ifconfig."""
+    info = get_interface(name, max_age=0)
+    return bool(info and info["flags"] & IFF_UP)
+
+
+def is_oper_up(name):
+    """Return True if the interface's operational state is up, like 'state UP' in ip link."""
+    info = get_interface(name, max_age=0)
+    return bool(info and info["operstate"] == "up")
+
+
+def default_route(path="/proc/net/route"):
+    """Return (gateway, interface) of the IPv4 default route from /proc/net/route, or None."""
+    try:
+        with open(path, "r") as f:
+            next(f)  # Header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 8 or fields[1] != "00000000" or fields[7] != "00000000":
+                    continue
+                gateway = socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+                return gateway, fields[0]
+    except (OSError, StopIteration):
+        pass
+    return None
@@ -0,0 +1,438 @@
+import argparse
+import getpass
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import command_executor
+import dns_cache
+import endpoint_resolver
+import privileged_ops
+import rotation_metrics
+
+# Rendered configs, pid files and logs of the namespaced tunnels
+NETNS_DIR = "/run/stealth-shift/netns"
+
+# Running exits (namespace -> vpn type, profile, since), read by the launcher
+STATE_FILE = "/run/stealth-shift/netns/exits.json"
+
+# Namespaces are named EXIT_PREFIX0, EXIT_PREFIX1, ... so the launcher can address them by number
+EXIT_PREFIX = "ssexit"
+
+# OpenVPN exits reach the internet through a veth pair in 10.200.<index>.0/30, masqueraded by the host
+UNDERLAY_NET = "10.200.{index}.{host}"
+MAX_EXITS = 255  # One third octet per exit
+
+IP_FORWARD = "/proc/sys/net/ipv4/ip_forward"
+
+READY_TIMEOUT = 30  # Seconds an OpenVPN exit gets to complete initialisation
+
+# Only these keys are understood by 'wg setconf'; the rest are wg-quick extensions
+WG_SETCONF_KEYS = {"privatekey", "listenport", "fwmark", "publickey", "presharedkey",
+                   "allowedips", "endpoint", "persistentkeepalive"}
+
+OPENVPN_READY_MARKER = "Initialization Sequence Completed"
+
+_state_lock = threading.Lock()
+_exits = []
+_saved_ip_forward = None  # The host's ip_forward before the first OpenVPN exit enabled it
+
+
+def _write_private(path, lines):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.writelines(lines)
+
+
+def wireguard_setconf_lines(lines):
+    """Split a wg-quick config into (lines for 'wg setconf', interface addresses)."""
+    setconf, addresses = [], []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("["):
+            setconf.append(stripped + "\n")
+            continue
+        key, sep, value = stripped.partition("=")
+        if not sep:
+            continue
+        key = key.strip().lower()
+        if key == "address":
+            addresses += [address.strip() for address in value.split(",") if address.strip()]
+        elif key in WG_SETCONF_KEYS:
+            setconf.append(stripped + "\n")
+    return setconf, addresses
+
+
+def create_namespace(namespace, logger):
+    privileged_ops.ip_batch([["netns", "add", namespace]], logger)
+    privileged_ops.ip_batch([["link", "set", "lo", "up"]], logger, netns=namespace)
+
+
+def delete_namespace(namespace, logger):
+    """Remove the namespace and everything in it; must run even after Ctrl+C."""
+    privileged_ops.run_privileged(["ip", "netns", "del", namespace], logger, phase="vpn_down",
+                                  check=False, cancellable=False)
+
+
+def add_wireguard_device(profile, namespace, device, logger, work_dir=NETNS_DIR):
+    """Bring profile up as device inside namespace and return its addresses.
+
+    The device is created in the main namespace, so its UDP socket uses the physical
+    underlay, and then moved into the namespace, where it can carry the default route.
+    """
+    with open(profile, "r") as f:
+        lines = endpoint_resolver.with_literal_endpoints(f.readlines(), logger)
+    setconf, addresses = wireguard_setconf_lines(lines)
+    setconf_path = os.path.join(work_dir, f"{device}.conf")
+    os.makedirs(work_dir, mode=0o700, exist_ok=True)
+    _write_private(setconf_path, setconf)
+    try:
+        privileged_ops.ip_batch([["link", "add", device, "type", "wireguard"]], logger)
+        try:
+            privileged_ops.run_privileged(["wg", "setconf", device, setconf_path], logger, phase="vpn_up")
+            privileged_ops.ip_batch([["link", "set", device, "netns", namespace]], logger)
+        except subprocess.CalledProcessError:
+            privileged_ops.run_privileged(["ip", "link", "del", device], logger, phase="vpn_down",
+                                          check=False, cancellable=False)
+            raise
+    finally:
+        os.remove(setconf_path)
+    commands = [["addr", "add", address, "dev", device] for address in addresses]
+    commands.append(["link", "set", device, "up"])
+    privileged_ops.ip_batch(commands, logger, netns=namespace)
+    return addresses
+
+
+def route_default(namespace, device, logger, ipv6=False):
+    """Point the namespace's default route(s) at device, replacing the previous ones."""
+    commands = [["route", "replace", "0.0.0.0/0", "dev", device]]
+    if ipv6:
+        commands.append(["route", "replace", "::/0", "dev", device])
+    privileged_ops.ip_batch(commands, logger, netns=namespace)
+
+
+def write_namespace_resolv_conf(namespace, profile):
+    """Give the namespace the profile's DNS servers ('ip netns exec' bind-mounts this file)."""
+    servers = dns_cache.dns_servers_from_config(profile) or dns_cache.system_nameservers()
+    directory = os.path.join("/etc/netns", namespace)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, "resolv.conf.tmp")
+    with open(tmp_path, "w") as f:
+        f.writelines(f"nameserver {server}\n" for server in servers)
+    os.replace(tmp_path, os.path.join(directory, "resolv.conf"))
+
+
+def wait_for_log(log_path, marker, timeout):
+    """Wait until marker appears in the log file; False on timeout or shutdown."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            with open(log_path, "r") as f:
+                if marker in f.read():
+                    return True
+        except OSError:
+            pass
+        if command_executor.sleep(0.2):
+            return False
+    return False
+
+
+def _save_state():
+    with _state_lock:
+        data = {exit.namespace: exit.describe() for exit in _exits}
+    tmp_path = f"{STATE_FILE}.tmp"
+    try:
+        os.makedirs(NETNS_DIR, mode=0o700, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, STATE_FILE)
+    except OSError:
+        pass
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class ExitNamespace:
+    """One exit: a network namespace whose traffic leaves through its own tunnel.
+
+    Exits rotate make-before-break: the next device is brought up beside the current one,
+    takes over the default route, and only then is the old device deleted. OpenVPN runs
+    inside the namespace over a NATed veth underlay, one daemon per device.
+    """
+
+    def __init__(self, index, vpn_type, interval, choose_config, logger):
+        self.index = index
+        self.vpn_type = vpn_type
+        self.interval = interval
+        self.choose_config = choose_config
+        self.logger = logger
+        self.namespace = f"{EXIT_PREFIX}{index}"
+        self.device = None
+        self.profile = None
+        self.since = None
+        self.pid = None
+        self.remotes = []  # Servers of the running OpenVPN tunnel, routed via the underlay
+        self._underlay_rules = []
+
+    def describe(self):
+        return {"index": self.index, "vpn_type": self.vpn_type, "profile": self.profile,
+                "device": self.device, "since": self.since, "interval": self.interval}
+
+    def create(self):
+        create_namespace(self.namespace, self.logger)
+        if self.vpn_type == "openvpn":
+            self._add_underlay()
+
+    def _add_underlay(self):
+        host_side, ns_side = f"{self.namespace}h", f"{self.namespace}n"
+        host_ip = UNDERLAY_NET.format(index=self.index, host=1)
+        ns_ip = UNDERLAY_NET.format(index=self.index, host=2)
+        privileged_ops.ip_batch([["link", "add", host_side, "type", "veth", "peer", "name", ns_side],
+                                 ["link", "set", ns_side, "netns", self.namespace],
+                                 ["addr", "add", f"{host_ip}/30", "dev", host_side],
+                                 ["link", "set", host_side, "up"]], self.logger)
+        privileged_ops.ip_batch([["addr", "add", f"{ns_ip}/30", "dev", ns_side],
+                                 ["link", "set", ns_side, "up"],
+                                 ["route", "add", "default", "via", host_ip]], self.logger, netns=self.namespace)
+        _enable_forwarding()
+        subnet = UNDERLAY_NET.format(index=self.index, host="0/30")
+        self._underlay_rules = [("nat", "POSTROUTING", ["-s", subnet, "-j", "MASQUERADE"]),
+                                ("filter", "FORWARD", ["-i", host_side, "-j", "ACCEPT"]),
+                                ("filter", "FORWARD", ["-o", host_side, "-j", "ACCEPT"])]
+        for table, chain, rule in self._underlay_rules:
+            privileged_ops.run_privileged(["iptables", "-t", table, "-I", chain] + rule, self.logger)
+
+    def rotate(self):
+        """Move the exit to a newly chosen profile, not one another exit uses. Return True on success."""
+        with _state_lock:
+            in_use = {exit.profile for exit in _exits if exit is not self and exit.profile}
+        profile = self.choose_config(self.vpn_type, exclude=in_use)
+        if profile is None:
+            self.logger.error(f"{self.namespace}: every valid profile is in use by another exit; keeping {self.profile}")
+            return False
+        forks_before = command_executor.thread_fork_count()
+        start = time.monotonic()
+        try:
+            if self.vpn_type == "wireguard":
+                self._rotate_wireguard(profile)
+            else:
+                self._rotate_openvpn(profile)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.error(f"{self.namespace}: failed to bring up {profile}: {e}")
+            rotation_metrics.record_attempt(profile, False)
+            return False
+        write_namespace_resolv_conf(self.namespace, profile)
+        self.profile, self.since = profile, time.time()
+        rotation_metrics.record_attempt(profile, True)
+        rotation_metrics.record_rotation(f"netns:{self.namespace}", command_executor.thread_fork_count() - forks_before,
+                                         self.logger, gap=time.monotonic() - start)
+        _save_state()
+        self.logger.info(f"{self.namespace}: now exiting through {profile}")
+        return True
+
+    def _rotate_wireguard(self, profile):
+        previous = self.device
+        device = f"{self.namespace}{'b' if previous and previous.endswith('a') else 'a'}"
+        addresses = add_wireguard_device(profile, self.namespace, device, self.logger)
+        try:
+            route_default(self.namespace, device, self.logger, any(":" in a for a in addresses))
+        except subprocess.CalledProcessError:
+            privileged_ops.ip_batch([["link", "del", device]], self.logger, netns=self.namespace, check=False)
+            raise
+        self.device = device
+        if previous:
+            privileged_ops.ip_batch([["link", "del", previous]], self.logger, netns=self.namespace, check=False)
+
+    def _rotate_openvpn(self, profile):
+        previous, previous_pid, previous_remotes = self.device, self.pid, self.remotes
+        device = f"{self.namespace}{'u' if previous and previous.endswith('t') else 't'}"
+        config_path, pid_path, log_path = (os.path.join(NETNS_DIR, f"{device}{ext}") for ext in (".ovpn", ".pid", ".log"))
+        os.makedirs(NETNS_DIR, mode=0o700, exist_ok=True)
+        with open(profile, "r") as f:
+            lines = endpoint_resolver.with_literal_endpoints(f.readlines(), self.logger)
+        _write_private(config_path, lines)
+        remotes = [m.group(1) for m in (re.match(r"^\s*remote\s+(\S+)", line) for line in lines) if m]
+        for path in (pid_path, log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        # The servers stay on the underlay, or the handshake would go into the current tunnel
+        added = [remote for remote in remotes if remote not in previous_remotes]
+        if added:
+            host_ip = UNDERLAY_NET.format(index=self.index, host=1)
+            privileged_ops.ip_batch([["route", "replace", f"{remote}/32", "via", host_ip] for remote in added],
+                                    self.logger, netns=self.namespace)
+        # Routes are set here rather than pushed, so two daemons can run side by side
+        privileged_ops.run_privileged(["ip", "netns", "exec", self.namespace, "openvpn", "--config", config_path,
+                                       "--route-nopull", "--dev", device, "--dev-type", "tun",
+                                       "--writepid", pid_path, "--log", log_path, "--daemon"],
+                                      self.logger, phase="vpn_up")
+        try:
+            with open(pid_path, "r") as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            pid = None
+        try:
+            if not wait_for_log(log_path, OPENVPN_READY_MARKER, READY_TIMEOUT):
+                raise OSError("OpenVPN did not complete initialisation")
+            # Same split routes as redirect-gateway def1, so the underlay default route stays intact
+            privileged_ops.ip_batch([["route", "replace", "0.0.0.0/1", "dev", device],
+                                     ["route", "replace", "128.0.0.0/1", "dev", device]],
+                                    self.logger, netns=self.namespace)
+        except (OSError, subprocess.CalledProcessError):
+            # The current tunnel keeps the exit
+            _stop_openvpn(pid, self.logger)
+            _del_host_routes(added, self.namespace, self.logger)
+            raise
+        self.device, self.pid, self.remotes = device, pid, remotes
+        _stop_openvpn(previous_pid, self.logger)
+        _del_host_routes([remote for remote in previous_remotes if remote not in remotes], self.namespace, self.logger)
+
+    def run(self, stop_event):
+        """Rotate the exit every interval seconds until stop_event is set."""
+        command_executor.bind_stop_event(stop_event)
+        while not stop_event.wait(self.interval):
+            self.rotate()
+
+    def destroy(self):
+        if self.vpn_type == "openvpn":
+            _stop_openvpn(self.pid, self.logger)
+            self.pid = None
+            for table, chain, rule in self._underlay_rules:
+                privileged_ops.run_privileged(["iptables", "-t", table, "-D", chain] + rule, self.logger,
+                                              phase="vpn_down", check=False, cancellable=False)
+        delete_namespace(self.namespace, self.logger)
+        try:
+            os.remove(os.path.join("/etc/netns", self.namespace, "resolv.conf"))
+            os.rmdir(os.path.join("/etc/netns", self.namespace))
+        except OSError:
+            pass
+
+
+def _stop_openvpn(pid, logger):
+    if pid:
+        privileged_ops.kill_pids([pid], logger)
+        for _ in range(25):  # Let the daemon exit and take its tun device with it
+            if not os.path.exists(f"/proc/{pid}"):
+                break
+            time.sleep(0.2)
+
+
+def _del_host_routes(remotes, namespace, logger):
+    if remotes:
+        privileged_ops.ip_batch([["route", "del", f"{remote}/32"] for remote in remotes], logger,
+                                netns=namespace, check=False)
+
+
+def _enable_forwarding():
+    """Turn on IPv4 forwarding for the underlays, remembering the setting stop_exits restores."""
+    global _saved_ip_forward
+    with _state_lock:
+        if _saved_ip_forward is None:
+            with open(IP_FORWARD, "r") as f:
+                _saved_ip_forward = f.read().strip()
+        with open(IP_FORWARD, "w") as f:
+            f.write("1\n")
+
+
+def _restore_forwarding(logger):
+    global _saved_ip_forward
+    with _state_lock:
+        saved, _saved_ip_forward = _saved_ip_forward, None
+    if saved is None or saved == "1":
+        return
+    try:
+        with open(IP_FORWARD, "w") as f:
+            f.write(saved + "\n")
+    except OSError as e:
+        logger.warning(f"Could not restore {IP_FORWARD} to {saved}: {e}")
+
+
+def start_exits(vpn_type, intervals, choose_config, logger, stop_event):
+    """Bring up one exit namespace per interval and rotate each on its own schedule.
+
+    Return the rotation threads. The exits are brought up concurrently.
+    """
+    exits = [ExitNamespace(index, vpn_type, interval, choose_config, logger) for index, interval in enumerate(intervals)]
+    with _state_lock:
+        _exits.extend(exits)
+
+    def bring_up(exit):
+        command_executor.bind_stop_event(stop_event)
+        try:
+            exit.create()
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.error(f"{exit.namespace}: failed to create the namespace: {e}")
+            return
+        exit.rotate()
+        exit.run(stop_event)
+
+    threads = [threading.Thread(target=bring_up, args=(exit,), daemon=True) for exit in exits]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def stop_exits(logger):
+    """Tear down every exit namespace started by start_exits."""
+    with _state_lock:
+        exits = list(_exits)
+        _exits.clear()
+    for exit in exits:
+        exit.destroy()
+        logger.debug(f"Removed exit namespace {exit.namespace}")
+    _restore_forwarding(logger)
+    try:
+        os.remove(STATE_FILE)
+    except OSError:
+        pass
+
+
+def resolve_namespace(name):
+    """Accept an exit namespace by name or by number."""
+    return f"{EXIT_PREFIX}{name}" if name.isdigit() else name
+
+
+def launch(namespace, command):
+    """Replace this process with command running inside namespace, as the invoking user."""
+    user = os.environ.get("SUDO_USER") if privileged_ops.is_root() else getpass.getuser()
+    as_user = ["sudo", "-u", user, "--"] if user and user != "root" else []
+    cmd = privileged_ops.privileged(["ip", "netns", "exec", namespace] + as_user + command)
+    os.execvp(cmd[0], cmd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a command through one of the exits started with 'stealth_shift.py --exits M'.")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("list", help="List the running exits")
+    run_parser = subparsers.add_parser("run", help="Run a command inside an exit's namespace")
+    run_parser.add_argument("exit", help="Exit number or namespace name (see 'list')")
+    run_parser.add_argument("command", nargs=argparse.REMAINDER, help="Command and its arguments")
+    args = parser.parse_args()
+
+    if args.action == "list":
+        exits = load_state()
+        if not exits:
+            print("No exits are running." if privileged_ops.is_root() else "No exits found (the list is only readable as root).")
+        for namespace, exit in sorted(exits.items(), key=lambda item: item[1]["index"]):
+            since = time.strftime("%H:%M:%S", time.localtime(exit["since"])) if exit["since"] else "-"
+            print(f"{exit['index']}  {namespace}  {exit['vpn_type']}  {exit['profile'] or 'connecting'}  since {since}")
+        sys.exit(0)
+
+    namespace = resolve_namespace(args.exit)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not os.path.exists(os.path.join("/run/netns", namespace)):
+        print(f"No network namespace named {namespace}. Use 'list' to see the running exits.")
+        sys.exit(1)
+    if not command:
+        print("No command given.")
+        sys.exit(1)
+    launch(namespace, command)
@@ -0,0 +1,224 @@
+import os
+import re
+import subprocess
+import threading
+import dns_cache
+import endpoint_resolver
+import net_inventory
+import privileged_ops
+
+# Runtime files (rendered configs, pid files and logs) of the standby instances
+POOL_DIR = "/run/stealth-shift/openvpn-pool"
+
+# Standby tunnels use tun devices from this number upwards, clear of OpenVPN's own tun0...
+FIRST_TUN_NUMBER = 100
+
+# Line OpenVPN logs once the tunnel is authenticated and configured
+READY_MARKER = "Initialization Sequence Completed"
+
+_pool = None
+
+
+class StandbyTunnel:
+    """One OpenVPN instance started with --route-nopull on its own tun device."""
+
+    def __init__(self, config, device):
+        self.config = config
+        self.device = device
+        self.config_path = os.path.join(POOL_DIR, f"{device}.ovpn")
+        self.pid_file = os.path.join(POOL_DIR, f"{device}.pid")
+        self.log_file = os.path.join(POOL_DIR, f"{device}.log")
+        self.remotes = []
+
+    def prepare(self, logger):
+        """Write the config with literal remotes, so they are known before the daemon starts."""
+        with open(self.config, "r") as file:
+            lines = endpoint_resolver.with_literal_endpoints(file.readlines(), logger)
+        self.remotes = [m.group(1) for m in (re.match(r"^\s*remote\s+(\S+)", line) for line in lines) if m]
+        fd = os.open(self.config_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            file.writelines(lines)
+
+    def start(self, logger):
+        privileged_ops.run_privileged([
+            "openvpn", "--config", self.config_path,
+            "--route-nopull", "--dev", self.device, "--dev-type", "tun",
+            "--writepid", self.pid_file, "--log", self.log_file, "--daemon",
+        ], logger, phase="vpn_up")
+
+    def pid(self):
+        try:
+            with open(self.pid_file, "r") as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def is_alive(self):
+        pid = self.pid()
+        return pid is not None and os.path.exists(f"/proc/{pid}")
+
+    def is_ready(self):
+        """Return True once the instance has finished its handshake and configured its device."""
+        try:
+            with open(self.log_file, "r") as file:
+                return READY_MARKER in file.read()
+        except OSError:
+            return False
+
+    def stop(self, logger):
+        pid = self.pid()
+        if pid is not None:
+            privileged_ops.kill_pids([pid], logger)
+        for path in (self.config_path, self.pid_file, self.log_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class OpenVPNPool:
+    """A pool of pre-connected standby OpenVPN tunnels; a rotation is a route switch to one of them."""
+
+    def __init__(self, size, choose_config, logger):
+        self.size = size
+        self.choose_config = choose_config
+        self.logger = logger
+        self.standbys = []
+        self.active = None
+        self.lock = threading.Lock()
+        self.fill_thread = None
+        self.underlay = net_inventory.default_route()
+        self.host_routes = set()
+        self.stopping = False
+        os.makedirs(POOL_DIR, mode=0o700, exist_ok=True)
+
+    def _free_device(self):
+        used = {t.device for t in self.standbys} | ({self.active.device} if self.active else set())
+        number = FIRST_TUN_NUMBER
+        while f"tun{number}" in used or net_inventory.interface_exists(f"tun{number}"):
+            number += 1
+        return f"tun{number}"
+
+    def _add_host_routes(self, tunnel):
+        """Keep each standby's server reachable through the physical underlay after a route switch."""
+        if not self.underlay:
+            return
+        gateway, device = self.underlay
+        commands = [["route", "replace", f"{remote}/32", "via", gateway, "dev", device]
+                    for remote in tunnel.remotes if remote not in self.host_routes]
+        if commands:
+            privileged_ops.ip_batch(commands, self.logger)
+            self.host_routes.update(tunnel.remotes)
+
+    def _spawn(self):
+        with self.lock:
+            tunnel = StandbyTunnel(self.choose_config("openvpn"), self._free_device())
+            self.standbys.append(tunnel)
+        try:
+            tunnel.prepare(self.logger)
+            # The underlay routes go in first: once another tunnel holds the default routes, a
+            # daemon started without them would send its handshake into that tunnel
+            self._add_host_routes(tunnel)
+            tunnel.start(self.logger)
+            self.logger.debug(f"Started standby OpenVPN tunnel {tunnel.device} with {tunnel.config}")
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.error(f"Failed to start standby OpenVPN tunnel: {e}")
+            with self.lock:
+                self.standbys.remove(tunnel)
+            tunnel.stop(self.logger)
+            return False
+        return True
+
+    def _fill(self):
+        failures = 0
+        while not self.stopping and len(self.standbys) < self.size and failures < self.size * 3:
+            if not self._spawn():
+                failures += 1
+
+    def fill_async(self):
+        """Top the pool up to its size in the background."""
+        if self.fill_thread is not None and self.fill_thread.is_alive():
+            return
+        self.fill_thread = threading.Thread(target=self._fill, daemon=True)
+        self.fill_thread.start()
+
+    def _prune(self):
+        """Drop standby instances that have died (e.g. auth failure)."""
+        with self.lock:
+            dead = [t for t in self.standbys if t.pid() is not None and not t.is_alive()]
+            for tunnel in dead:
+                self.standbys.remove(tunnel)
+        for tunnel in dead:
+            self.logger.debug(f"Standby OpenVPN tunnel {tunnel.device} exited; replacing it")
+            tunnel.stop(self.logger)
+
+    def pool_pids(self):
+        tunnels = self.standbys + ([self.active] if self.active else [])
+        return {pid for pid in (t.pid() for t in tunnels) if pid is not None}
+
+    def activate(self):
+        """Switch the default routes to a connected standby. Return its config, or None if none is ready."""
+        self._prune()
+        with self.lock:
+            tunnel = next((t for t in self.standbys if t.is_ready()), None)
+            if tunnel is None:
+                return None
+            self.standbys.remove(tunnel)
+
+        # Same split routes as redirect-gateway def1, so the original default route stays intact
+        privileged_ops.ip_batch([
+            ["route", "replace", "0.0.0.0/1", "dev", tunnel.device],
+            ["route", "replace", "128.0.0.0/1", "dev", tunnel.device],
+        ], self.logger, phase="vpn_up")
+        if dns_cache.is_running():
+            dns_cache.use_config_upstreams(tunnel.config, self.logger)
+
+        previous, self.active = self.active, tunnel
+        if previous is not None:
+            previous.stop(self.logger)
+        else:
+            # The first switch retires the regular instance started before the pool existed
+            others = [pid for pid in privileged_ops.find_pids("openvpn") if pid not in self.pool_pids()]
+            privileged_ops.kill_pids(others, self.logger)
+        self.logger.debug(f"Switched to standby OpenVPN tunnel {tunnel.device} ({tunnel.config})")
+
+        self.fill_async()
+        return tunnel.config
+
+    def forget(self):
+        """Forget every instance, e.g. after all OpenVPN processes were killed by a regular restart."""
+        with self.lock:
+            tunnels = self.standbys + ([self.active] if self.active else [])
+            self.standbys = []
+            self.active = None
+        for tunnel in tunnels:
+            tunnel.stop(self.logger)
+
+    def shutdown(self):
+        self.stopping = True
+        self.forget()
+        if self.host_routes:
+            privileged_ops.ip_batch([["route", "del", f"{remote}/32"] for remote in self.host_routes],
+                                    self.logger, check=False)
+            self.host_routes.clear()
+
+
+def start_pool(size, choose_config, logger):
+    """Create the standby pool and start filling it in the background."""
+    global _pool
+    _pool = OpenVPNPool(size, choose_config, logger)
+    _pool.fill_async()
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def shutdown_pool(logger):
+    global _pool
+    if _pool is None:
+        return
+    logger.debug("Stopping standby OpenVPN tunnels")
+    _pool.shutdown()
+    _pool = None
@@ -0,0 +1,86 @@
+import os
+import re
+import signal
+import command_executor
+
+
+def is_root():
+    """Return True when the process already has root privileges."""
+    return os.geteuid() == 0
+
+
+def privileged(cmd):
+    """Return cmd prefixed with sudo only when not already running as root."""
+    if is_root():
+        return list(cmd)
+    return ["sudo"] + list(cmd)
+
+
+def run_privileged(cmd, logger=None, phase="misc", **kwargs):
+    """Run a command that needs root, without forking sudo when already root."""
+    return command_executor.run_command(privileged(cmd), logger, phase=phase, **kwargs)
+
+
+def chmod(path, mode, logger=None):
+    """Change file permissions in-process instead of forking chmod."""
+    if is_root() or os.stat(path).st_uid == os.geteuid():
+        os.chmod(path, mode)
+    else:
+        run_privileged(["chmod", f"{mode:o}", path], logger)
+    if logger:
+        logger.debug(f"Permissions set for file: {path}")
+
+
+def find_pids(pattern):
+    """Return the PIDs whose process name matches pattern, like pgrep, by reading /proc."""
+    regex = re.compile(pattern)
+    pids = []
+    own_pid = os.getpid()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == own_pid:
+            continue
+        try:
+            with open(f"/proc/{entry}/comm", "r") as f:
+                name = f.read().strip()
+        except OSError:
+            continue  # Process exited while scanning
+        if regex.search(name):
+            pids.append(int(entry))
+    return pids
+
+
+def kill_pids(pids, logger=None, sig=signal.SIGTERM):
+    """Signal each PID in-process; return the PIDs that were signalled."""
+    signalled = []
+    for pid in pids:
+        try:
+            os.kill(int(pid), sig)
+            signalled.append(int(pid))
+        except ProcessLookupError:
+            if logger:
+                logger.debug(f"Process {pid} already exited.")
+        except PermissionError:
+            run_privileged(["kill", f"-{int(sig)}", str(pid)], logger, phase="vpn_down")
+            signalled.append(int(pid))
+    return signalled
+
+
+def ip_batch(commands, logger=None, phase="link", netns=None, **kwargs):
+    """Apply several 'ip' commands with a single fork using 'ip -batch -'.
+
+    Each entry is an argument list without the leading 'ip', e.g.
+    ["link", "set", "dev", "eth0", "down"]. Execution stops at the first failing line.
+    With netns, the commands are applied inside that network namespace.
+    """
+    script = "\n".join(" ".join(cmd) for cmd in commands) + "\n"
+    namespace = ["-n", netns] if netns else []
+    return run_privileged(["ip"] + namespace + ["-batch", "-"], logger, phase=phase, input=script, **kwargs)
+
+
+def set_link_address(interface, new_mac, logger=None, bounce=True):
+    """Set the hardware address of interface with one 'ip' process, bouncing the link if needed."""
+    commands = [["link", "set", "dev", interface, "address", new_mac]]
+    if bounce:
+        commands.insert(0, ["link", "set", "dev", interface, "down"])
+        commands.append(["link", "set", "dev", interface, "up"])
+    return ip_batch(commands, logger)
@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import command_executor
+import endpoint_resolver
+import netns_tunnels
+import privileged_ops
+import profile_scoreboard
+import profile_templates
+import profile_validator
+
+# Rendered configs, pid files and logs of the tunnels under test
+BENCHMARK_DIR = "/run/stealth-shift/benchmark"
+
+DEFAULT_DURATION = 5     # Seconds of sustained download and of upload per profile
+READY_TIMEOUT = 30       # Seconds a tunnel gets to carry its first connection to the target
+PING_COUNT = 5           # Round trips averaged (median) for the RTT
+CHUNK_SIZE = 64 * 1024
+
+
+# Stand-in target server. Run it on a host reachable through the exits
+# (python profile_benchmark.py --serve PORT). One request per connection:
+#   PING        -> PONG (repeated until the client closes)
+#   DOWN <sec>  -> a stream of data for <sec> seconds
+#   UP          -> reads until EOF, then answers with the number of bytes received
+
+class _BenchmarkHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = self.rfile.readline().split()
+        if not request:
+            return
+        command = request[0].upper()
+        if command == b"PING":
+            self.wfile.write(b"PONG\n")
+            for line in self.rfile:
+                self.wfile.write(b"PONG\n")
+        elif command == b"DOWN" and len(request) == 2:
+            chunk = b"\0" * CHUNK_SIZE
+            deadline = time.monotonic() + min(float(request[1]), 60)
+            while time.monotonic() < deadline:
+                self.wfile.write(chunk)
+        elif command == b"UP":
+            received = 0
+            while True:
+                data = self.rfile.read1(CHUNK_SIZE)
+                if not data:
+                    break
+                received += len(data)
+            self.wfile.write(f"{received}\n".encode())
+
+
+class BenchmarkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port, host="0.0.0.0"):
+    """Run the stand-in target server until interrupted."""
+    with BenchmarkServer((host, port), _BenchmarkHandler) as server:
+        server.serve_forever()
+
+
+def parse_target(target):
+    """Split 'host:port' and resolve host once, so no DNS is needed inside a tunnel."""
+    host, _, port = target.rpartition(":")
+    host = host.strip("[]")
+    address = endpoint_resolver.resolve_host(host) or host
+    return address, int(port)
+
+
+def _connect(target, timeout=10):
+    return socket.create_connection(target, timeout=timeout)
+
+
+def wait_until_reachable(target, timeout=READY_TIMEOUT, stop_event=None):
+    """Retry connecting to target until it answers; return the seconds waited, or None."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            _connect(target, timeout=2).close()
+            return time.monotonic() - start
+        except OSError:
+            pass
+        if stop_event is not None and stop_event.wait(0.2):
+            return None
+        elif stop_event is None:
+            time.sleep(0.2)
+    return None
+
+
+def measure_rtt(target):
+    """Return the median application-level round trip to target in milliseconds."""
+    samples = []
+    with _connect(target) as sock:
+        stream = sock.makefile("rb")
+        for _ in range(PING_COUNT):
+            start = time.monotonic()
+            sock.sendall(b"PING\n")
+            if not stream.readline():
+                raise OSError("Connection closed by benchmark target")
+            samples.append((time.monotonic() - start) * 1000)
+    return statistics.median(samples)
+
+
+def measure_download(target, duration):
+    """Return the sustained download rate from target in Mbit/s."""
+    received = 0
+    with _connect(target) as sock:
+        sock.sendall(f"DOWN {duration}\n".encode())
+        start = time.monotonic()
+        while True:
+            data = sock.recv(CHUNK_SIZE)
+            if not data:
+                break
+            received += len(data)
+        elapsed = time.monotonic() - start
+    return received * 8 / elapsed / 1e6
+
+
+def measure_upload(target, duration):
+    """Return the sustained upload rate to target in Mbit/s, as counted by the target."""
+    chunk = b"\0" * CHUNK_SIZE
+    with _connect(target) as sock:
+        sock.sendall(b"UP\n")
+        start = time.monotonic()
+        while time.monotonic() - start < duration:
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+        reply = sock.makefile("rb").readline()
+        elapsed = time.monotonic() - start
+    return int(reply) * 8 / elapsed / 1e6
+
+
+def measure(target, duration=DEFAULT_DURATION, stop_event=None):
+    """Measure readiness, RTT and throughput to target through the current route."""
+    ready = wait_until_reachable(target, stop_event=stop_event)
+    if ready is None:
+        raise OSError(f"Benchmark target {target[0]}:{target[1]} not reachable")
+    return {
+        "ready_s": ready,
+        "rtt_ms": measure_rtt(target),
+        "download_mbps": measure_download(target, duration),
+        "upload_mbps": measure_upload(target, duration),
+    }
+
+
+def _write_private(path, lines):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.writelines(lines)
+
+
+def wireguard_netns_up(profile, namespace, device, logger):
+    """Bring profile up as device inside its own network namespace, carrying its default route."""
+    netns_tunnels.create_namespace(namespace, logger)
+    addresses = netns_tunnels.add_wireguard_device(profile, namespace, device, logger, work_dir=BENCHMARK_DIR)
+    netns_tunnels.route_default(namespace, device, logger, any(":" in address for address in addresses))
+
+
+def wireguard_netns_down(namespace, device, logger):
+    """Remove the namespace (and with it the device); must run even after Ctrl+C."""
+    netns_tunnels.delete_namespace(namespace, logger)
+    privileged_ops.run_privileged(["ip", "link", "del", device], logger, phase="vpn_down",
+                                  check=False, cancellable=False)
+
+
+def measure_in_netns(namespace, target, duration, logger):
+    """Run measure() in a child process inside namespace and return its results."""
+    cmd = ["ip", "netns", "exec", namespace, sys.executable, os.path.abspath(__file__),
+           "--measure", f"{target[0]}:{target[1]}", "--duration", str(duration)]
+    output = privileged_ops.run_privileged(cmd, logger, timeout=READY_TIMEOUT + 2 * duration + 30).stdout
+    return json.loads(output)
+
+
+def benchmark_wireguard(profile, index, target, duration, logger):
+    namespace, device = f"ssbench{index}", f"ssbwg{index}"
+    start = time.monotonic()
+    try:
+        wireguard_netns_up(profile, namespace, device, logger)
+        setup = time.monotonic() - start
+        result = measure_in_netns(namespace, target, duration, logger)
+        result["handshake_s"] = setup + result.pop("ready_s")
+        return result
+    finally:
+        wireguard_netns_down(namespace, device, logger)
+
+
+def benchmark_openvpn(profile, target, duration, logger, stop_event=None):
+    """Bring profile up as the host's tunnel (one at a time), measure through it and stop it."""
+    config_path = os.path.join(BENCHMARK_DIR, os.path.basename(profile))
+    pid_path = os.path.join(BENCHMARK_DIR, "openvpn.pid")
+    log_path = os.path.join(BENCHMARK_DIR, "openvpn.log")
+    with open(profile, "r") as f:
+        _write_private(config_path, endpoint_resolver.with_literal_endpoints(f.readlines(), logger))
+    for path in (pid_path, log_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    start = time.monotonic()
+    try:
+        privileged_ops.run_privileged(["openvpn", "--config", config_path, "--writepid", pid_path,
+                                       "--log", log_path, "--daemon"], logger, phase="vpn_up")
+        if not netns_tunnels.wait_for_log(log_path, netns_tunnels.OPENVPN_READY_MARKER, READY_TIMEOUT):
+            raise OSError("OpenVPN did not complete initialisation")
+        setup = time.monotonic() - start
+        result = measure(target, duration, stop_event)
+        result["handshake_s"] = setup + result.pop("ready_s")
+        return result
+    finally:
+        try:
+            with open(pid_path, "r") as f:
+                pid = int(f.read().strip())
+            privileged_ops.kill_pids([pid], logger)
+            for _ in range(25):  # Let the routes go before the next profile comes up
+                if not os.path.exists(f"/proc/{pid}"):
+                    break
+                time.sleep(0.2)
+        except (OSError, ValueError):
+            pass
+
+
+def benchmark_profile(vpn_type, profile, target, duration, logger, index=0, stop_event=None):
+    """Benchmark one profile and store the result in the scoreboard. Return it, or None on failure."""
+    logger.debug(f"Benchmarking {profile}")
+    try:
+        profile_templates.materialize(profile, logger)
+        if vpn_type == "wireguard":
+            result = benchmark_wireguard(profile, index, target, duration, logger)
+        else:
+            result = benchmark_openvpn(profile, target, duration, logger, stop_event)
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        if not (stop_event and stop_event.is_set()):
+            logger.error(f"Benchmark of {profile} failed: {e}")
+            profile_scoreboard.record_failure(profile, str(e))
+        return None
+    profile_scoreboard.record(profile, type=vpn_type, ok=True, **result)
+    logger.info(f"{profile}: handshake {result['handshake_s']:.1f}s, RTT {result['rtt_ms']:.0f} ms, "
+                f"down {result['download_mbps']:.1f} Mbit/s, up {result['upload_mbps']:.1f} Mbit/s")
+    return result
+
+
+def run_benchmark(vpn_types, target, logger, duration=DEFAULT_DURATION, parallel=0, stop_event=None):
+    """Benchmark every valid profile of vpn_types against target ('host:port').
+
+    WireGuard profiles run in network namespaces, up to parallel at once (0 = one at a
+    time); OpenVPN profiles run one at a time as the host's tunnel.
+    Return {profile: result or None}.
+    """
+    os.makedirs(BENCHMARK_DIR, mode=0o700, exist_ok=True)
+    target = parse_target(target)
+    results = {}
+    profile_validator.refresh(logger, tuple(vpn_types))  # Profiles known to be invalid are skipped
+
+    def worker(indexed_profiles):
+        command_executor.bind_stop_event(stop_event)
+        for index, profile in indexed_profiles:
+            if stop_event is not None and stop_event.is_set():
+                return
+            results[profile] = benchmark_profile("wireguard", profile, target, duration, logger,
+                                                 index=index, stop_event=stop_event)
+
+    if "wireguard" in vpn_types:
+        indexed_profiles = list(enumerate(profile_validator.valid_profiles("wireguard")))
+        lanes = max(1, min(parallel, len(indexed_profiles)))
+        threads = [threading.Thread(target=worker, args=(indexed_profiles[lane::lanes],))
+                   for lane in range(lanes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if "openvpn" in vpn_types:
+        for profile in profile_validator.valid_profiles("openvpn"):
+            if stop_event is not None and stop_event.is_set():
+                break
+            results[profile] = benchmark_profile("openvpn", profile, target, duration, logger,
+                                                 stop_event=stop_event)
+
+    ok = [r for r in results.values() if r]
+    logger.info(f"Benchmarked {len(results)} profile(s): {len(ok)} ok, {len(results) - len(ok)} failed. "
+                f"Results saved to {profile_scoreboard.SCOREBOARD_FILE}.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in target server and client for VPN profile benchmarks.")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Run the benchmark target server on PORT")
+    parser.add_argument("--bind", default="0.0.0.0", help="Address the server listens on (default: 0.0.0.0)")
+    parser.add_argument("--measure", metavar="HOST:PORT", help="Measure against a target and print the results as JSON")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds per throughput test")
+    args = parser.parse_args()
+
+    if args.serve:
+        try:
+            serve(args.serve, args.bind)
+        except KeyboardInterrupt:
+            pass
+    elif args.measure:
+        try:
+            print(json.dumps(measure(parse_target(args.measure), args.duration)))
+        except OSError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    else:
+        parser.print_help()
@@ -0,0 +1,99 @@
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+# Per-profile measurements, keyed by config path (e.g. "WG_VPNS/config-3.conf")
+SCOREBOARD_FILE = "profile_scoreboard.json"
+
+# Weight given to a profile whose last benchmark failed, relative to the slowest working one
+FAILED_WEIGHT = 0.05
+
+_lock = threading.Lock()
+_scores = None
+_preferred_metric = None
+
+
+def _load():
+    global _scores
+    if _scores is None:
+        try:
+            with open(SCOREBOARD_FILE, "r") as f:
+                _scores = json.load(f)
+        except (OSError, ValueError):
+            _scores = {}
+    return _scores
+
+
+def _save():
+    # A unique temporary name, so the rotator and vpn_manager never write to the same one
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(SCOREBOARD_FILE)}.", suffix=".tmp",
+                                    dir=os.path.dirname(SCOREBOARD_FILE) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(_scores, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, SCOREBOARD_FILE)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def record(profile, **metrics):
+    """Merge metrics (e.g. download_mbps=..., rtt_ms=...) into profile's entry and save the scoreboard."""
+    with _lock:
+        entry = _load().setdefault(profile, {})
+        entry.update(metrics)
+        entry["updated"] = time.time()
+        _save()
+
+
+def record_failure(profile, reason):
+    """Mark profile's last benchmark as failed, keeping its previous measurements."""
+    with _lock:
+        entry = _load().setdefault(profile, {})
+        entry["failures"] = entry.get("failures", 0) + 1
+        entry["last_error"] = reason
+        entry["ok"] = False
+        entry["updated"] = time.time()
+        _save()
+
+
+def get(profile):
+    with _lock:
+        entry = _load().get(profile)
+        return dict(entry) if entry else None
+
+
+def get_all():
+    with _lock:
+        return {profile: dict(entry) for profile, entry in _load().items()}
+
+
+def prefer(metric):
+    """Make choose() favour profiles with a higher value of metric (None restores random choice)."""
+    global _preferred_metric
+    _preferred_metric = metric
+
+
+def choose(profiles):
+    """Pick one of profiles, at random or weighted by the preferred metric when one is set.
+
+    Profiles without a measurement get the median weight so they are still tried; profiles
+    whose last benchmark failed are picked rarely.
+    """
+    if _preferred_metric is None:
+        return random.choice(profiles)
+    with _lock:
+        scores = _load()
+        values = {p: scores[p].get(_preferred_metric) for p in profiles
+                  if p in scores and scores[p].get("ok", True) and scores[p].get(_preferred_metric)}
+        failed = {p for p in profiles if p in scores and not scores[p].get("ok", True)}
+    if not values:
+        return random.choice(profiles)
+    default = statistics.median(values.values())
+    floor = min(values.values()) * FAILED_WEIGHT
+    weights = [floor if p in failed else values.get(p, default) for p in profiles]
+    return random.choices(profiles, weights=weights)[0]
@@ -0,0 +1,156 @@
+import collections
+import csv
+import glob
+import hashlib
+import os
+import string
+import threading
+
+# Rendered profiles live here (tmpfs), under the name of their config directory. Their paths
+# are the profiles' names everywhere (scoreboard, metrics, validation), rendered or not.
+RENDER_DIR = "/run/stealth-shift/rendered"
+
+# A template is <name><extension>.tmpl next to its server table <name>.csv, e.g.
+# WG_VPNS/provider.conf.tmpl and WG_VPNS/provider.csv
+TEMPLATE_SUFFIX = ".tmpl"
+
+# Column that names each row's profile (<name>-<value><extension>, see profile_name); rows are
+# numbered without it
+KEY_COLUMN = "name"
+
+# Rendered texts kept in memory
+RENDER_CACHE_SIZE = 64
+
+# wg-quick names the device after the file and refuses names longer than IFNAMSIZ - 1, so
+# longer WireGuard profile names are shortened to a prefix and a hash of the full name
+WG_EXTENSION = ".conf"
+MAX_INTERFACE_NAME = 15
+NAME_HASH_LENGTH = 4
+
+_lock = threading.Lock()
+_tables = {}    # Template path -> (stamp, {profile path: row})
+_profiles = {}  # Profile path -> (template path, extension)
+_renders = collections.OrderedDict()  # Profile path -> (stamp, text, sha256)
+_written = {}   # Profile path -> sha256 of the file last written
+
+
+class TemplateError(ValueError):
+    """Raised when a template refers to a column its server table does not have."""
+
+
+def _stamp(*paths):
+    """Return the (mtime, size) of each file, so edits to the template or the table are noticed."""
+    stamp = []
+    for path in paths:
+        st = os.stat(path)
+        stamp.append((st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+
+def _table_path(template):
+    name = os.path.basename(template)[:-len(TEMPLATE_SUFFIX)]
+    return os.path.join(os.path.dirname(template), os.path.splitext(name)[0] + ".csv")
+
+
+def profile_name(base, key, extension):
+    """Return the file name stem of a row's profile: <base>-<key>, shortened for WireGuard."""
+    name = f"{base}-{key}"
+    if extension == WG_EXTENSION and len(name) > MAX_INTERFACE_NAME:
+        digest = hashlib.sha256(name.encode()).hexdigest()[:NAME_HASH_LENGTH]
+        name = f"{name[:MAX_INTERFACE_NAME - NAME_HASH_LENGTH - 1]}-{digest}"
+    return name
+
+
+def _load_table(template, extension):
+    """Return {profile path: row} for a template, re-reading its server table only when changed."""
+    table = _table_path(template)
+    stamp = _stamp(template, table)
+    with _lock:
+        cached = _tables.get(template)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    base = os.path.splitext(os.path.basename(table))[0]
+    render_dir = os.path.join(RENDER_DIR, os.path.basename(os.path.dirname(os.path.abspath(template))))
+    rows = {}
+    with open(table, "r", newline="") as f:
+        for number, row in enumerate(csv.DictReader(f), 1):
+            row = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+            key = row.get(KEY_COLUMN) or str(number)
+            rows[os.path.join(render_dir, profile_name(base, key, extension) + extension)] = row
+    with _lock:
+        _tables[template] = (stamp, rows)
+        for path in rows:
+            _profiles[path] = (template, extension)
+    return rows
+
+
+def list_profiles(directory, extension):
+    """Return the profile paths defined by the templates for extension in directory."""
+    paths = []
+    for template in sorted(glob.glob(os.path.join(glob.escape(directory), f"*{extension}{TEMPLATE_SUFFIX}"))):
+        try:
+            paths.extend(_load_table(template, extension))
+        except (OSError, csv.Error):
+            continue  # No server table (yet), or one that cannot be read
+    return paths
+
+
+def is_templated(path):
+    with _lock:
+        return path in _profiles
+
+
+def render(path):
+    """Return (text, sha256) of a templated profile, rendering it only if its template or row changed."""
+    with _lock:
+        template, extension = _profiles[path]
+    row = _load_table(template, extension).get(path)
+    if row is None:
+        raise KeyError(path)  # Its row was removed from the server table
+    stamp = _stamp(template, _table_path(template))
+    with _lock:
+        cached = _renders.get(path)
+        if cached and cached[0] == stamp:
+            _renders.move_to_end(path)
+            return cached[1], cached[2]
+    with open(template, "r") as f:
+        try:
+            text = string.Template(f.read()).substitute(row)
+        except (KeyError, ValueError) as e:
+            raise TemplateError(f"{template}: no value for {e} in the server table") from e
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    with _lock:
+        _renders[path] = (stamp, text, digest)
+        while len(_renders) > RENDER_CACHE_SIZE:
+            _renders.popitem(last=False)
+    return text, digest
+
+
+def template_of(path):
+    with _lock:
+        return _profiles[path][0]
+
+
+def materialize(path, logger=None):
+    """Write a templated profile to RENDER_DIR if its file is missing or stale; return path.
+
+    Other profiles are returned unchanged.
+    """
+    if not is_templated(path):
+        return path
+    text, digest = render(path)
+    with _lock:
+        current = _written.get(path) == digest and os.path.exists(path)
+    if current:
+        return path
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    with _lock:
+        _written[path] = digest
+    if logger:
+        logger.debug(f"Rendered {path} from {_profiles[path][0]}")
+    return path
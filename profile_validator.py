@@ -0,0 +1,335 @@
+import base64
+import concurrent.futures
+import ipaddress
+import os
+import re
+import socket
+import threading
+import time
+import config_index
+import profile_templates
+
+# Up to this many changed profiles are checked in-process; more go to a process pool
+INLINE_LIMIT = 4
+
+WG_REQUIRED_INTERFACE_KEYS = ("privatekey", "address")
+WG_REQUIRED_PEER_KEYS = ("publickey", "allowedips", "endpoint")
+
+# OpenVPN options that name a file, and the PEM block each must (inline or on disk) contain
+OVPN_FILE_OPTIONS = {
+    "ca": "CERTIFICATE",
+    "cert": "CERTIFICATE",
+    "key": "PRIVATE KEY",
+    "tls-auth": "OpenVPN Static key",
+    "tls-crypt": "OpenVPN Static key",
+}
+
+# Problems that may be gone on a later check (DNS was down, e.g. mid-rotation); profiles with
+# them are checked again after RECHECK_INTERVAL seconds even if unchanged
+UNRESOLVABLE = "cannot resolve"
+RECHECK_INTERVAL = 300
+
+# Seconds between the rotator's checks for new or changed profiles (see refresh)
+REFRESH_INTERVAL = 30
+
+_lock = threading.Lock()
+_results = {}  # Config path -> (sha256 it was validated at, stamp of its files, its files, problems)
+_recheck_at = {}  # Config path -> time.monotonic() after which an unresolvable profile is checked again
+
+
+def _is_wg_key(value):
+    try:
+        return len(base64.b64decode(value, validate=True)) == 32
+    except ValueError:
+        return False
+
+
+def _check_port(port, problems, where):
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        problems.append(f"{where}: invalid port '{port}'")
+
+
+def _check_resolvable(host, problems, where):
+    try:
+        ipaddress.ip_address(host)
+        return
+    except ValueError:
+        pass
+    try:
+        socket.getaddrinfo(host, None)
+    except OSError:
+        problems.append(f"{where}: {UNRESOLVABLE} '{host}'")
+
+
+def validate_wireguard(text, resolve=True):
+    """Return the problems found in a wg-quick config."""
+    problems = []
+    sections = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("["):
+            sections.append((line.lower(), {}))
+            continue
+        key, sep, value = line.partition("=")
+        if not sep or not sections:
+            problems.append(f"line {number}: not a 'Key = Value' line inside a section")
+            continue
+        sections[-1][1][key.strip().lower()] = value.strip()
+
+    interfaces = [values for name, values in sections if name == "[interface]"]
+    peers = [values for name, values in sections if name == "[peer]"]
+    if len(interfaces) != 1:
+        problems.append("exactly one [Interface] section is required")
+    if not peers:
+        problems.append("at least one [Peer] section is required")
+
+    for values in interfaces:
+        for key in WG_REQUIRED_INTERFACE_KEYS:
+            if key not in values:
+                problems.append(f"[Interface]: missing {key}")
+        if "privatekey" in values and not _is_wg_key(values["privatekey"]):
+            problems.append("[Interface]: PrivateKey is not a base64 32-byte key")
+        for address in values.get("address", "").split(","):
+            try:
+                if address.strip():
+                    ipaddress.ip_interface(address.strip())
+            except ValueError:
+                problems.append(f"[Interface]: invalid Address '{address.strip()}'")
+
+    for number, values in enumerate(peers, 1):
+        where = f"[Peer] {number}"
+        for key in WG_REQUIRED_PEER_KEYS:
+            if key not in values:
+                problems.append(f"{where}: missing {key}")
+        for key in ("publickey", "presharedkey"):
+            if key in values and not _is_wg_key(values[key]):
+                problems.append(f"{where}: {key} is not a base64 32-byte key")
+        for network in values.get("allowedips", "").split(","):
+            try:
+                if network.strip():
+                    ipaddress.ip_network(network.strip(), strict=False)
+            except ValueError:
+                problems.append(f"{where}: invalid AllowedIPs entry '{network.strip()}'")
+        if "endpoint" in values:
+            endpoint = values["endpoint"]
+            if endpoint.startswith("["):
+                host, _, port = endpoint[1:].partition("]:")
+            else:
+                host, _, port = endpoint.rpartition(":")
+            if not host:
+                problems.append(f"{where}: Endpoint '{endpoint}' is not host:port")
+            else:
+                _check_port(port, problems, where)
+                if resolve:
+                    _check_resolvable(host, problems, where)
+    return problems
+
+
+def _check_pem(content, marker, problems, where):
+    if f"-----BEGIN {marker}" not in content and not (marker == "PRIVATE KEY" and "PRIVATE KEY-----" in content):
+        problems.append(f"{where}: no '{marker}' PEM block")
+
+
+def validate_openvpn(text, resolve=True):
+    """Return the problems found in an OpenVPN client config."""
+    problems = []
+    options = {}
+    inline = {}
+    block, block_lines = None, []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if block:
+            if stripped == f"</{block}>":
+                inline[block] = "\n".join(block_lines)
+                block, block_lines = None, []
+            else:
+                block_lines.append(stripped)
+            continue
+        match = re.match(r"^<([\w-]+)>$", stripped)
+        if match:
+            block = match.group(1).lower()
+            continue
+        if not stripped or stripped[0] in "#;":
+            continue
+        parts = stripped.split()
+        options.setdefault(parts[0].lower(), []).append(parts[1:])
+    if block:
+        problems.append(f"<{block}> block is not closed")
+
+    if "remote" not in options:
+        problems.append("missing remote")
+    if "dev" not in options:
+        problems.append("missing dev")
+    if "ca" not in options and "ca" not in inline:
+        problems.append("missing ca")
+
+    for args in options.get("remote", []):
+        if not args:
+            problems.append("remote without a host")
+            continue
+        if len(args) > 1:
+            _check_port(args[1], problems, f"remote {args[0]}")
+        if resolve:
+            _check_resolvable(args[0], problems, "remote")
+
+    for option, marker in OVPN_FILE_OPTIONS.items():
+        if option in inline:
+            _check_pem(inline[option], marker, problems, f"<{option}>")
+        for args in options.get(option, []):
+            if not args or args[0] == "[inline]":
+                continue
+            try:
+                with open(args[0], "r") as f:
+                    _check_pem(f.read(), marker, problems, f"{option} {args[0]}")
+            except OSError as e:
+                problems.append(f"{option}: cannot read {args[0]} ({e.strerror})")
+
+    for args in options.get("auth-user-pass", []):
+        if not args:
+            problems.append("auth-user-pass names no file; OpenVPN would prompt for credentials")
+            continue
+        try:
+            with open(args[0], "r") as f:
+                lines = [line for line in f.read().splitlines() if line.strip()]
+            if len(lines) < 2:
+                problems.append(f"auth file {args[0]} needs a username and a password line")
+        except OSError as e:
+            problems.append(f"auth file {args[0]} cannot be read ({e.strerror})")
+    return problems
+
+
+def openvpn_files(text):
+    """Return the files (certificates, keys, auth files) an OpenVPN config's validity depends on."""
+    files = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 2 or parts[1] == "[inline]":
+            continue
+        if parts[0].lower() in OVPN_FILE_OPTIONS or parts[0].lower() == "auth-user-pass":
+            files.append(parts[1])
+    return files
+
+
+def _files_stamp(files):
+    """Return the (mtime, size) of each file, or None for a missing one."""
+    stamp = []
+    for path in files:
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _read_text(path):
+    try:
+        if profile_templates.is_templated(path):
+            return profile_templates.render(path)[0]
+        with open(path, "r") as f:
+            return f.read()
+    except (OSError, KeyError, ValueError):
+        return ""  # Reported by the validation itself
+
+
+def validate_text(text, vpn_type, resolve=True):
+    """Return the problems found in the contents of a config of vpn_type."""
+    if vpn_type == "wireguard":
+        return validate_wireguard(text, resolve)
+    return validate_openvpn(text, resolve)
+
+
+def validate_profile(path, vpn_type, resolve=True, text=None):
+    """Return the problems found in a config file, or in text (a templated profile rendered by
+    the caller). Runs in pool worker processes."""
+    if text is None:
+        try:
+            with open(path, "r") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            return [f"cannot read config ({e})"]
+    return validate_text(text, vpn_type, resolve)
+
+
+def validate_all(profiles, resolve=True):
+    """Validate (path, vpn_type) pairs, in a process pool when there are many. Return {path: problems}."""
+    texts = {}
+    failed = {}
+    for path, _ in profiles:
+        if profile_templates.is_templated(path):
+            try:
+                texts[path] = profile_templates.render(path)[0]
+            except (OSError, KeyError, ValueError) as e:
+                failed[path] = [f"cannot render template ({e})"]
+    profiles = [(path, vpn_type) for path, vpn_type in profiles if path not in failed]
+    if len(profiles) <= INLINE_LIMIT:
+        failed.update({path: validate_profile(path, vpn_type, resolve, texts.get(path)) for path, vpn_type in profiles})
+        return failed
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        results = pool.map(validate_profile, [p for p, _ in profiles], [t for _, t in profiles],
+                           [resolve] * len(profiles), [texts.get(p) for p, _ in profiles], chunksize=8)
+        failed.update(zip((p for p, _ in profiles), results))
+        return failed
+
+
+def refresh(logger=None, vpn_types=("wireguard", "openvpn")):
+    """Validate every profile that is new or changed since it was last validated, counting
+    changes to the files it refers to (such as its auth file).
+
+    Called at startup and periodically from the rotator's main thread; rotations only read
+    the results (see valid_profiles), so they never wait for DNS or a process pool.
+    Return the number of profiles checked.
+    """
+    pending = []
+    now = time.monotonic()
+    profiles = [(path, vpn_type) for vpn_type in vpn_types for path in config_index.list_profiles(vpn_type)]
+    with _lock:
+        for path, vpn_type in profiles:
+            entry = config_index.get(path) or {}
+            cached = _results.get(path)
+            if cached is None or cached[0] != entry.get("sha256") or cached[1] != _files_stamp(cached[2]) \
+                    or now >= _recheck_at.get(path, now + 1):
+                pending.append((path, vpn_type, entry.get("sha256")))
+    if not pending:
+        return 0
+
+    files = {path: openvpn_files(_read_text(path)) if vpn_type == "openvpn" else []
+             for path, vpn_type, _ in pending}
+    stamps = {path: _files_stamp(files[path]) for path in files}
+    results = validate_all([(path, vpn_type) for path, vpn_type, _ in pending])
+    reported = set()
+    with _lock:
+        for path, _, sha256 in pending:
+            previous = _results.get(path)
+            if results[path] and not (previous and previous[3] == results[path]):
+                reported.add(path)  # Warn once per distinct set of problems
+            if any(UNRESOLVABLE in problem for problem in results[path]):
+                _recheck_at[path] = now + RECHECK_INTERVAL
+            else:
+                _recheck_at.pop(path, None)
+            _results[path] = (sha256, stamps[path], files[path], results[path])
+    if logger:
+        for path, _, _ in pending:
+            if path in reported:
+                logger.warning(f"Excluding invalid profile {path}: {'; '.join(results[path])}")
+        invalid = sum(1 for path, _, _ in pending if results[path])
+        logger.debug(f"Validated {len(pending)} profile(s): {invalid} invalid")
+    return len(pending)
+
+
+def get_problems(path):
+    with _lock:
+        cached = _results.get(path)
+    return cached[3] if cached else None
+
+
+def valid_profiles(vpn_type):
+    """Return the profiles of vpn_type that passed their last validation (see refresh).
+
+    Profiles not validated yet are left out until the next refresh.
+    """
+    profiles = config_index.list_profiles(vpn_type)
+    with _lock:
+        return [path for path in profiles if path in _results and not _results[path][3]]
@@ -0,0 +1,343 @@
+import ast
+import cProfile
+import collections
+import functools
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+# Reports are written here (relative to the working directory, like the other data files)
+PROFILE_DIR = "profiles"
+
+MODES = ("cpu", "alloc", "sample")
+TOGGLE_SIGNAL = signal.SIGUSR1
+
+SAMPLE_INTERVAL = 0.005   # Seconds between stack samples of the sampling profiler
+TRACEMALLOC_FRAMES = 25   # Stack depth kept per allocation
+TOP_FUNCTIONS = 5         # Functions listed per subsystem
+
+SUBSYSTEMS = ("MAC", "VPN", "probe", "UI", "other")
+
+# Where work is attributed: the innermost frame that is listed here decides the subsystem,
+# so shared helpers (command_executor, privileged_ops, net_inventory, logging) count for
+# whichever subsystem called them
+SUBSYSTEM_FUNCTIONS = {
+    "stealth_shift": {
+        "MAC": {"generate_mac_address", "is_valid_mac", "get_current_mac", "set_mac_ioctl", "change_mac_interface_ioctl",
+                "execute_commands", "bring_interface_down_and_up", "get_interface_driver",
+                "load_mac_strategy_cache", "save_mac_strategy_cache", "apply_mac_strategy", "change_mac",
+                "save_primary_mac_to_file", "read_primary_mac_from_file", "set_primary_mac"},
+        "VPN": {"choose_vpn_config", "choose_vpn_candidates", "write_runtime_config", "wireguard_device",
+                "wireguard_device_exists", "wireguard_up",
+                "openvpn_up", "start_wireguard", "stop_wireguard", "start_openvpn", "stop_openvpn",
+                "start_anonsurf", "stop_anonsurf", "start_VPN", "stop_VPN", "stop_vpn_for_rotation",
+                "start_vpn_with_retries", "roll_back_rotation"},
+        "probe": {"verify_new_exit", "verify_public_ip_changed", "get_public_ip", "fetch_initial_public_ip",
+                  "wait_for_interface_up", "get_interface_status", "interface_exists"},
+        "UI": {"countdown", "clear_line"},
+    },
+}
+SUBSYSTEM_MODULES = {
+    "openvpn_pool": "VPN", "wg_multipath": "VPN", "netns_tunnels": "VPN", "endpoint_resolver": "VPN",
+    "dns_cache": "VPN", "config_index": "VPN", "profile_validator": "VPN", "profile_scoreboard": "VPN",
+    "traffic_monitor": "probe", "exit_verifier": "probe", "tor_control": "VPN",
+    "banner": "UI", "rotation_metrics": "UI",
+}
+
+_lock = threading.Lock()
+_mode = None
+_window = 0
+_logger = None
+_window_id = 0        # Incremented whenever a window opens
+_active = False
+_started = None
+_timer = None
+_profile = None       # Interpreter-wide cProfile (Python 3.12+)
+_thread_profiles = {}  # Thread ident -> (window id, cProfile) (older Pythons, see checkpoint())
+_sampler = None
+_baseline = None
+_local = threading.local()
+
+
+def _module_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def subsystem_of(filename, function):
+    """Return the subsystem a single frame belongs to, or None for shared code."""
+    module = _module_name(filename)
+    if module in SUBSYSTEM_MODULES:
+        return SUBSYSTEM_MODULES[module]
+    for subsystem, functions in SUBSYSTEM_FUNCTIONS.get(module, {}).items():
+        if function in functions:
+            return subsystem
+    return None
+
+
+def classify(frames):
+    """Return the subsystem of a stack given as (filename, function) pairs, innermost first."""
+    for filename, function in frames:
+        subsystem = subsystem_of(filename, function)
+        if subsystem:
+            return subsystem
+    return "other"
+
+
+@functools.lru_cache(maxsize=None)
+def _function_ranges(filename):
+    try:
+        with open(filename, "r") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError):
+        return []
+    return sorted((node.lineno, node.end_lineno, node.name) for node in ast.walk(tree)
+                  if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)))
+
+
+def function_at(filename, lineno):
+    """Return the name of the innermost function defined around lineno (tracemalloc frames
+    carry no function names)."""
+    name = "<module>"
+    for start, end, function in _function_ranges(filename):
+        if start > lineno:
+            break
+        if lineno <= end:
+            name = function
+    return name
+
+
+class _Snapshot:
+    """Lets pstats read a profiler's stats without disabling it from the wrong thread."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _attribute_cpu(stats):
+    """Split every function's own time over subsystems, following its callers up to the
+    nearest classified function in proportion to the time each caller accounted for.
+    Return {subsystem: {function label: seconds}}."""
+    memo = {}
+
+    def shares(func, visiting):
+        if func in memo:
+            return memo[func]
+        subsystem = subsystem_of(func[0], func[2])
+        if subsystem:
+            result = {subsystem: 1.0}
+        else:
+            callers = {caller: entry for caller, entry in (stats[func][4] if func in stats else {}).items()
+                       if caller not in visiting}
+            caller_time = sum(entry[2] for entry in callers.values())
+            result = collections.Counter()
+            for caller, entry in callers.items():
+                weight = entry[2] / caller_time if caller_time else 1 / len(callers)
+                for name, share in shares(caller, visiting | {func}).items():
+                    result[name] += weight * share
+            result = dict(result) or {"other": 1.0}
+        memo[func] = result
+        return result
+
+    report = {subsystem: collections.Counter() for subsystem in SUBSYSTEMS}
+    for func, (_, _, tottime, _, _) in stats.items():
+        label = f"{os.path.basename(func[0])}:{func[1]} {func[2]}"
+        for subsystem, share in shares(func, frozenset()).items():
+            report[subsystem][label] += tottime * share
+    return report
+
+
+class Sampler(threading.Thread):
+    """Low-overhead sampling profiler: every SAMPLE_INTERVAL it looks at each thread's stack
+    and charges the CPU time the thread used since the previous sample to that stack."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop_event = threading.Event()
+        self.cpu_seen = {}
+        self.report = {subsystem: collections.Counter() for subsystem in SUBSYSTEMS}
+        self.samples = 0
+
+    def _thread_cpu(self, ident):
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (OSError, AttributeError):
+            return None
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                cpu = self._thread_cpu(ident)
+                if cpu is None:
+                    continue
+                used = cpu - self.cpu_seen.get(ident, cpu)
+                self.cpu_seen[ident] = cpu
+                if used <= 0:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append((frame.f_code.co_filename, frame.f_code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                subsystem = classify((f[0], f[1]) for f in frames)
+                label = f"{os.path.basename(frames[0][0])}:{frames[0][2]} {frames[0][1]}"
+                self.report[subsystem][label] += used
+                self.samples += 1
+
+
+def configure(mode, window, logger):
+    """Arm profiling in mode ('cpu', 'alloc' or 'sample'); TOGGLE_SIGNAL starts and stops a window.
+
+    A window closes by itself after window seconds (0 = only on the next signal).
+    """
+    global _mode, _window, _logger
+    _mode, _window, _logger = mode, window, logger
+    signal.signal(TOGGLE_SIGNAL, _on_signal)
+
+
+def _on_signal(signum, frame):
+    # Reports are written off the signal handler, which interrupts whatever the main thread was doing
+    threading.Thread(target=toggle, daemon=True).start()
+
+
+def toggle():
+    with _lock:
+        active = _active
+    if active:
+        stop()
+    else:
+        start()
+
+
+def start():
+    """Open a profiling window."""
+    global _active, _started, _window_id, _timer, _profile, _sampler, _baseline
+    with _lock:
+        if _active or _mode is None:
+            return
+        _window_id += 1
+        _active, _started = True, time.monotonic()
+        if _mode == "cpu" and sys.version_info >= (3, 12):
+            _profile = cProfile.Profile()  # Profiles every thread of the interpreter
+            _profile.enable()
+        elif _mode == "alloc":
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _baseline = tracemalloc.take_snapshot()
+        elif _mode == "sample":
+            _sampler = Sampler()
+            _sampler.start()
+        if _window:
+            _timer = threading.Timer(_window, stop)
+            _timer.daemon = True
+            _timer.start()
+    print(f"\nProfiling ({_mode}) started" + (f" for {_window}s." if _window else f"; send signal {TOGGLE_SIGNAL.name} again to stop."), flush=True)
+
+
+def checkpoint():
+    """Start or stop this thread's cProfile to follow the current window.
+
+    Before Python 3.12 a cProfile only sees the thread that enabled it, so each thread
+    enables its own from here (called by command_executor and the countdown loop).
+    """
+    if _mode != "cpu" or sys.version_info >= (3, 12):
+        return
+    window = _window_id if _active else None
+    current = getattr(_local, "window", None)
+    if current == window:
+        return
+    profile = getattr(_local, "profile", None)
+    if profile is not None:
+        profile.disable()
+    _local.window, _local.profile = window, None
+    if window is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+        _local.profile = profile
+        with _lock:
+            _thread_profiles[threading.get_ident()] = (window, profile)
+
+
+def stop():
+    """Close the window and write its per-subsystem report. Return the report path."""
+    global _active, _timer, _profile, _sampler, _baseline
+    with _lock:
+        if not _active:
+            return None
+        _active = False
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+        elapsed = time.monotonic() - _started
+        raw_path = None
+        if _mode == "cpu":
+            if _profile is not None:
+                _profile.disable()
+                profiles = [_profile]
+                _profile = None
+            else:
+                profiles = [p for window, p in _thread_profiles.values() if window == _window_id]
+                _thread_profiles.clear()
+            stats = pstats.Stats()
+            for profile in profiles:
+                profile.snapshot_stats()
+                stats.add(_Snapshot(profile.stats))
+            report, unit = _attribute_cpu(stats.stats), "CPU seconds"
+            raw_path = _report_path("prof")
+            stats.dump_stats(raw_path)
+        elif _mode == "alloc":
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            report, unit = {subsystem: collections.Counter() for subsystem in SUBSYSTEMS}, "KiB allocated and still held"
+            for stat in snapshot.compare_to(_baseline, "traceback"):
+                if stat.size_diff <= 0:
+                    continue
+                frames = [(f.filename, function_at(f.filename, f.lineno), f.lineno) for f in reversed(stat.traceback)]
+                subsystem = classify((f[0], f[1]) for f in frames)
+                label = f"{os.path.basename(frames[0][0])}:{frames[0][2]} {frames[0][1]}"
+                report[subsystem][label] += stat.size_diff / 1024
+            _baseline = None
+        else:
+            _sampler.stop_event.set()
+            _sampler.join()
+            report, unit = _sampler.report, "sampled CPU seconds"
+            _sampler = None
+
+    path = _report_path("txt")
+    try:
+        with open(path, "w") as f:
+            f.write(format_report(report, unit, elapsed))
+    except OSError as e:
+        _logger.error(f"Failed to write the profile report: {e}")
+        return None
+    print(f"\nProfiling ({_mode}) stopped after {elapsed:.0f}s; report written to {path}"
+          + (f" (raw cProfile data: {raw_path})" if raw_path else ""), flush=True)
+    return path
+
+
+def _report_path(extension):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"profile-{_mode}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+
+
+def format_report(report, unit, elapsed):
+    """Render {subsystem: {function label: amount}} as a table of subsystems with their top functions."""
+    totals = {subsystem: sum(report[subsystem].values()) for subsystem in SUBSYSTEMS}
+    grand_total = sum(totals.values()) or 1
+    lines = [f"{_mode} profile over {elapsed:.1f}s ({unit})", ""]
+    for subsystem in SUBSYSTEMS:
+        lines.append(f"{subsystem:<6} {totals[subsystem]:12.3f} {100 * totals[subsystem] / grand_total:6.1f}%")
+    for subsystem in SUBSYSTEMS:
+        if not report[subsystem]:
+            continue
+        lines += ["", f"{subsystem}:"]
+        for label, amount in report[subsystem].most_common(TOP_FUNCTIONS):
+            lines.append(f"  {amount:12.3f}  {label}")
+    return "\n".join(lines) + "\n"
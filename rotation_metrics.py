@@ -0,0 +1,161 @@
+import collections
+import json
+import os
+import threading
+import time
+import command_executor
+
+# Snapshot of the rotator's state, rewritten after every rotation event (read by vpn_manager's
+# dashboard and status_report, which may run without root). It lives outside the 0700 runtime
+# directory, which holds configs with keys, in a directory of its own that anyone may read.
+METRICS_DIR = "/run/stealth-shift-status"
+METRICS_FILE = os.path.join(METRICS_DIR, "metrics.json")
+
+# Weight of the newest outcome in a profile's health score and latency average
+HEALTH_ALPHA = 0.3
+
+_lock = threading.Lock()
+_enabled = False
+_current = {}
+_profiles = {}
+_macs = {}
+_last_good_profile = None
+exit_history = collections.deque(maxlen=100)
+slo_violations = collections.deque(maxlen=100)
+
+
+def enable():
+    """Start publishing snapshots to METRICS_FILE."""
+    global _enabled
+    _enabled = True
+    publish()
+
+
+def _profile(profile):
+    return _profiles.setdefault(profile, {"attempts": 0, "failures": 0, "health": 1.0, "latency": None})
+
+
+def set_current_tunnel(vpn_type, profile):
+    """Record the tunnel that is now carrying traffic."""
+    with _lock:
+        _current.clear()
+        _current.update({"vpn_type": vpn_type, "profile": profile, "since": time.time()})
+    publish()
+
+
+def set_mac(interface, mac, device=None):
+    """Record the MAC interface now shows on the network (device: the macvlan identity carrying it)."""
+    with _lock:
+        _macs[interface] = {"mac": mac, "device": device or interface, "since": time.time()}
+    publish()
+
+
+def record_attempt(profile, ok):
+    """Record whether bringing up profile worked; its health is an average of recent outcomes."""
+    with _lock:
+        entry = _profile(profile)
+        entry["attempts"] += 1
+        if not ok:
+            entry["failures"] += 1
+        entry["health"] = (1 - HEALTH_ALPHA) * entry["health"] + HEALTH_ALPHA * (1.0 if ok else 0.0)
+    publish()
+
+
+def record_exit(exit_ip, time_to_exit, method="echo", endpoint=None):
+    """Record a verified rotation and the seconds from rotation start until it was verified.
+
+    method is "echo" when exit_ip came from an external echo service, "tor" when it is the
+    Tor exit seen through the SOCKS port after NEWNYM, and "local" when the tunnel was
+    verified from local evidence only: exit_ip is then None, since only the VPN server's
+    address (endpoint) is known, which is not where traffic leaves.
+    """
+    global _last_good_profile
+    with _lock:
+        if exit_ip:
+            _current["exit_ip"] = exit_ip
+        if endpoint:
+            _current["endpoint"] = endpoint
+        entry = {"time": time.time(), "seconds": time_to_exit, "exit_ip": exit_ip, "method": method}
+        if endpoint:
+            entry["endpoint"] = endpoint
+        exit_history.append(entry)
+        profile = _current.get("profile")
+        if profile:
+            _last_good_profile = profile
+            entry = _profile(profile)
+            previous = entry["latency"]
+            entry["latency"] = time_to_exit if previous is None else (1 - HEALTH_ALPHA) * previous + HEALTH_ALPHA * time_to_exit
+    publish()
+
+
+def record_slo_violation(vpn_type, elapsed, budget, rolled_back_to=None):
+    """Record a rotation that was not verified within its latency budget."""
+    with _lock:
+        slo_violations.append({"time": time.time(), "vpn_type": vpn_type, "elapsed": elapsed,
+                               "budget": budget, "profile": _current.get("profile"),
+                               "rolled_back_to": rolled_back_to})
+    publish()
+
+
+def current_profile():
+    with _lock:
+        return _current.get("profile")
+
+
+def last_good_profile():
+    """Return the profile of the last rotation whose new exit was verified."""
+    return _last_good_profile
+
+
+def record_rotation(kind, forks, logger=None, gap=None):
+    """Record a finished rotation (see command_executor.record_rotation) and publish it."""
+    command_executor.record_rotation(kind, forks, logger, gap=gap)
+    publish()
+
+
+def snapshot():
+    with _lock:
+        return {
+            "updated": time.time(),
+            "pid": os.getpid(),
+            "running": _enabled,
+            "current": dict(_current),
+            "macs": {interface: dict(entry) for interface, entry in _macs.items()},
+            "rotations": list(command_executor.rotation_history),
+            "exits": list(exit_history),
+            "slo_violations": list(slo_violations),
+            "profiles": {profile: dict(entry) for profile, entry in _profiles.items()},
+        }
+
+
+def _write(data):
+    """Write a snapshot atomically as a world-readable file (0644 in a 0755 directory)."""
+    tmp_path = f"{METRICS_FILE}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        os.chmod(METRICS_DIR, 0o755)  # Regardless of the umask
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, METRICS_FILE)
+    except OSError:
+        pass  # The dashboard is optional; never let it break a rotation
+
+
+def publish():
+    """Write the current snapshot atomically, if publishing is enabled."""
+    if not _enabled:
+        return
+    _write(snapshot())
+
+
+def disable():
+    """Publish a final snapshot marked as not running and stop publishing."""
+    global _enabled
+    if not _enabled:
+        return
+    with _lock:
+        _current.clear()
+    _enabled = False
+    _write(snapshot())
@@ -0,0 +1,339 @@
+import argparse
+import contextlib
+import io
+import ipaddress
+import json
+import logging
+import random
+import statistics
+import subprocess
+import sys
+import time
+import command_executor
+import config_index
+import endpoint_resolver
+import exit_verifier
+import privileged_ops
+import profile_scoreboard
+import profile_validator
+import rotation_metrics
+import stealth_shift
+
+# Public IP the simulated host has without a tunnel, and the base of the simulated exit IPs
+INITIAL_IP = "192.0.2.1"
+EXIT_IP_BASE = ipaddress.IPv4Address("198.51.100.1")
+
+# Behaviour of a profile unless the scenario says otherwise. latency and probe_latency are
+# seconds: a number (mean, with 'jitter' as standard deviation) or a list to sample from.
+DEFAULT_BEHAVIOUR = {
+    "latency": 2.0,            # Bringing the tunnel up (or failing to)
+    "jitter": 0.5,
+    "failure_rate": 0.05,      # Probability that bringing it up fails
+    "exit_failure_rate": 0.0,  # Probability that it comes up but carries no traffic
+    "teardown": 0.5,           # Bringing it down
+    "probe_latency": 0.3,      # One public IP request
+    "download_mbps": None,     # Benchmark result seen by --prefer-fast
+}
+MAC_LATENCY = 0.2
+
+
+class VirtualClock:
+    """Simulated time; sleeping advances it instantly."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1.0e9 + self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+
+class VirtualEvent:
+    """Stand-in for the rotator's stop event: waiting advances the virtual clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._set = False
+
+    def set(self):
+        self._set = True
+
+    def clear(self):
+        self._set = False
+
+    def is_set(self):
+        return self._set
+
+    def wait(self, timeout=None):
+        if not self._set and timeout:
+            self.clock.sleep(timeout)
+        return self._set
+
+
+class FakeBackend:
+    """Scripted tunnels: replaces wg-quick/openvpn, pgrep and the public IP lookup."""
+
+    def __init__(self, clock, behaviours, rng, spawn=False):
+        self.clock = clock
+        self.spawn = spawn
+        self.behaviours = behaviours
+        self.rng = rng
+        self.profiles = sorted(behaviours, key=config_index.natural_key)
+        self.running = None
+        self.exit_works = False
+        self.down_since = None
+        self.outages = []
+        self.cycle_retries = 0
+        self.retries = []
+        self.selected = {profile: 0 for profile in self.profiles}
+        self.failed = {profile: 0 for profile in self.profiles}
+
+    def _sample(self, value, jitter=0.0):
+        if isinstance(value, list):
+            return self.rng.choice(value)
+        return max(self.rng.gauss(value, jitter) if jitter else value, 0.01)
+
+    def _fork(self):
+        """With spawn, run a real (trivial) child where the tunnel command would run, so the
+        process handling around it is exercised."""
+        if self.spawn:
+            command_executor.run_command(["true"], phase="misc")
+
+    def _spend(self, seconds, cmd):
+        """Advance the clock like a command taking seconds, timing out at the phase deadline."""
+        self._fork()
+        remaining = command_executor.deadline_remaining()
+        if remaining is not None and remaining < seconds:
+            self.clock.sleep(remaining)
+            raise command_executor.CommandTimeout(-9, cmd, remaining)
+        self.clock.sleep(seconds)
+
+    def up(self, filename, logger):
+        behaviour = self.behaviours[filename]
+        self.selected[filename] += 1
+        try:
+            self._spend(self._sample(behaviour["latency"], behaviour["jitter"]), ["up", filename])
+            if self.rng.random() < behaviour["failure_rate"]:
+                raise subprocess.CalledProcessError(1, ["up", filename])
+        except subprocess.CalledProcessError:
+            self.failed[filename] += 1
+            self.cycle_retries += 1
+            raise
+        self.running = filename
+        self.exit_works = self.rng.random() >= behaviour["exit_failure_rate"]
+        if self.exit_works and self.down_since is not None:
+            self.outages.append(self.clock.now - self.down_since)
+            self.down_since = None
+
+    def down(self, verbose=False, logger=None):
+        if self.running is None:
+            return
+        self._fork()
+        self.clock.sleep(self._sample(self.behaviours[self.running]["teardown"]))
+        self.running = None
+        if self.down_since is None:
+            self.down_since = self.clock.now
+
+    def find_pids(self, pattern):
+        return [1] if self.running else []
+
+    def get_public_ip(self, logger):
+        behaviour = self.behaviours.get(self.running, DEFAULT_BEHAVIOUR)
+        try:
+            self._spend(self._sample(behaviour["probe_latency"]), ["curl", "-s", "ifconfig.me"])
+        except subprocess.CalledProcessError:
+            return None
+        if self.running is None:
+            return INITIAL_IP
+        if not self.exit_works:
+            return None
+        return str(EXIT_IP_BASE + self.profiles.index(self.running))
+
+    def end_cycle(self):
+        self.retries.append(self.cycle_retries)
+        self.cycle_retries = 0
+
+
+def jain_fairness(counts):
+    """Jain's fairness index: 1.0 when every profile was selected equally often, 1/n at worst."""
+    counts = list(counts)
+    total = sum(counts)
+    squares = sum(c * c for c in counts)
+    return (total * total) / (len(counts) * squares) if squares else 1.0
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def load_scenario(path, vpn_type, profile_count, defaults):
+    """Return {profile: behaviour}: profile_count generated profiles with defaults, then the
+    scenario file's 'defaults' and per-profile overrides (which may add profiles)."""
+    scenario = {}
+    if path:
+        with open(path, "r") as f:
+            scenario = json.load(f)
+    defaults = dict(DEFAULT_BEHAVIOUR, **defaults, **scenario.get("defaults", {}))
+    directory, extension = ("WG_VPNS", ".conf") if vpn_type == "wireguard" else ("OP_VPNS", ".ovpn")
+    behaviours = {f"{directory}/config-{i}{extension}": dict(defaults) for i in range(1, profile_count + 1)}
+    for profile, overrides in scenario.get("profiles", {}).items():
+        behaviours[profile] = dict(behaviours.get(profile, defaults), **overrides)
+    return behaviours
+
+
+def simulate(behaviours, vpn_type="wireguard", cycles=1000, interval=300, mode="vc", seed=0,
+             prefer_fast=False, rotation_budget=0, fallback_profiles=(), change_mac=None, interface="sim0",
+             spawn=False):
+    """Run the real rotation loop for cycles rotations against fake backends on a virtual clock.
+
+    mode is "vc" (VPN rotation, -vc) or "rc" (MAC and VPN together, -rc). change_mac, if
+    given, replaces the simulated MAC change (e.g. to run the real one). With spawn, every
+    fake tunnel command and probe also forks a real 'true'. Return a report dict.
+    """
+    clock = VirtualClock()
+    rng = random.Random(seed)
+    backend = FakeBackend(clock, behaviours, rng, spawn)
+    stop = VirtualEvent(clock)
+    logger = logging.getLogger("rotation_simulator")
+    logger.setLevel(logging.CRITICAL)
+    counters = {"cycles": 0, "verified": 0, "rollbacks": 0}
+
+    def record_rotation(kind, forks, logger=None, gap=None):
+        counters["cycles"] += 1
+        backend.end_cycle()
+        if counters["cycles"] >= cycles:
+            stop.set()
+
+    def record_exit(exit_ip, time_to_exit, method="echo", endpoint=None):
+        counters["verified"] += 1
+
+    def record_slo_violation(*args, **kwargs):
+        counters["rollbacks"] += 1
+
+    scores = {profile: {"download_mbps": b["download_mbps"], "ok": True}
+              for profile, b in behaviours.items() if b["download_mbps"]}
+
+    random_state = random.getstate()
+    random.seed(seed)
+    wall_start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        def patch(owner, name, value):
+            original = getattr(owner, name)
+            setattr(owner, name, value)
+            stack.callback(setattr, owner, name, original)
+
+        patch(time, "monotonic", clock.monotonic)
+        patch(time, "time", clock.time)
+        patch(time, "sleep", clock.sleep)
+        patch(stealth_shift, "stop_event", stop)
+        patch(stealth_shift, "rotation_budget", rotation_budget)
+        patch(stealth_shift, "fallback_profiles", list(fallback_profiles))
+        patch(stealth_shift, "wireguard_up", backend.up)
+        patch(stealth_shift, "openvpn_up", backend.up)
+        patch(stealth_shift, "stop_wireguard", backend.down)
+        patch(stealth_shift, "stop_openvpn", backend.down)
+        patch(stealth_shift, "get_public_ip", backend.get_public_ip)
+        patch(exit_verifier, "_external_rate", 1.0)  # Fake tunnels leave no local evidence
+        patch(stealth_shift, "wait_for_interface_up", lambda interface, logger, timeout=60: True)
+        patch(stealth_shift, "change_mac", change_mac or (lambda interface, new_mac, logger: clock.sleep(MAC_LATENCY) or True))
+        patch(privileged_ops, "find_pids", backend.find_pids)
+        patch(stealth_shift, "wireguard_device_exists", lambda filename: backend.running is not None)
+        patch(endpoint_resolver, "prefetch", lambda config_paths, logger=None: None)
+        patch(profile_validator, "valid_profiles", lambda vpn_type: list(backend.profiles))
+        patch(profile_scoreboard, "_scores", scores)
+        patch(profile_scoreboard, "_save", lambda: None)
+        patch(profile_scoreboard, "_preferred_metric", "download_mbps" if prefer_fast else None)
+        patch(rotation_metrics, "record_rotation", record_rotation)
+        patch(rotation_metrics, "record_exit", record_exit)
+        patch(rotation_metrics, "record_slo_violation", record_slo_violation)
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+
+        stealth_shift.start_vpn_with_retries(vpn_type, logger)
+        backend.cycle_retries = 0
+        if mode == "rc":
+            stealth_shift.change_mac_and_vpn_periodically(vpn_type, interface, logger, interval, INITIAL_IP)
+        else:
+            stealth_shift.change_vpn_periodically(vpn_type, interface, logger, interval, INITIAL_IP)
+        if backend.down_since is not None:
+            backend.outages.append(clock.now - backend.down_since)  # Still down at the end
+    random.setstate(random_state)
+
+    outages = backend.outages or [0.0]
+    selected = [backend.selected[p] for p in backend.profiles]
+    return {
+        "cycles": counters["cycles"],
+        "virtual_seconds": clock.now,
+        "wall_seconds": time.perf_counter() - wall_start,
+        "verified_exits": counters["verified"],
+        "failed_rotations": counters["cycles"] - counters["verified"],
+        "rollbacks": counters["rollbacks"],
+        "downtime": {
+            "total": sum(backend.outages),
+            "mean": statistics.mean(outages),
+            "p50": _percentile(outages, 0.5),
+            "p95": _percentile(outages, 0.95),
+            "max": max(outages),
+            "availability": 1 - sum(backend.outages) / clock.now if clock.now else 1.0,
+        },
+        "retries": {
+            "total": sum(backend.retries),
+            "mean": statistics.mean(backend.retries) if backend.retries else 0.0,
+            "max": max(backend.retries, default=0),
+        },
+        "fairness": jain_fairness(selected),
+        "profiles": {p: {"selected": backend.selected[p], "failed": backend.failed[p]} for p in backend.profiles},
+    }
+
+
+def print_report(report):
+    downtime, retries = report["downtime"], report["retries"]
+    print(f"{report['cycles']} rotations, {report['virtual_seconds'] / 3600:.1f} simulated hours "
+          f"in {report['wall_seconds']:.2f}s")
+    print(f"Verified exits:   {report['verified_exits']} ({report['failed_rotations']} rotations without one, "
+          f"{report['rollbacks']} rolled back)")
+    print(f"Downtime:         {downtime['total']:.0f}s total, mean {downtime['mean']:.2f}s, "
+          f"p50 {downtime['p50']:.2f}s, p95 {downtime['p95']:.2f}s, max {downtime['max']:.2f}s "
+          f"({downtime['availability'] * 100:.3f}% available)")
+    print(f"Retries:          {retries['total']} total, {retries['mean']:.2f} per rotation, max {retries['max']}")
+    print(f"Fairness (Jain):  {report['fairness']:.3f}")
+    for profile, counts in report["profiles"].items():
+        print(f"  {profile}: selected {counts['selected']}, failed {counts['failed']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate thousands of rotations against scripted fake tunnels on a virtual clock.")
+    parser.add_argument("--scenario", help="JSON file with 'defaults' and per-profile 'profiles' behaviour overrides")
+    parser.add_argument("--vpn", choices=("wireguard", "openvpn"), default="wireguard", help="VPN type to simulate (default: wireguard)")
+    parser.add_argument("--mode", choices=("vc", "rc"), default="vc", help="Rotate the VPN only (vc) or MAC and VPN together (rc)")
+    parser.add_argument("--cycles", type=int, default=1000, help="Rotations to simulate (default: 1000)")
+    parser.add_argument("--interval", type=float, default=300, help="Seconds between rotations (default: 300)")
+    parser.add_argument("--profiles", type=int, default=10, help="Number of generated profiles (default: 10)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_BEHAVIOUR["latency"], help="Mean seconds to bring a tunnel up")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_BEHAVIOUR["jitter"], help="Standard deviation of the latency")
+    parser.add_argument("--failure-rate", type=float, default=DEFAULT_BEHAVIOUR["failure_rate"], help="Probability that bringing a tunnel up fails")
+    parser.add_argument("--exit-failure-rate", type=float, default=DEFAULT_BEHAVIOUR["exit_failure_rate"], help="Probability that a tunnel comes up without a working exit")
+    parser.add_argument("--prefer-fast", action="store_true", help="Select profiles weighted by the scenario's download_mbps")
+    parser.add_argument("--rotation-budget", type=int, default=0, metavar="SECONDS", help="Roll back rotations not verified within SECONDS")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        behaviours = load_scenario(args.scenario, args.vpn, args.profiles, {
+            "latency": args.latency, "jitter": args.jitter, "failure_rate": args.failure_rate,
+            "exit_failure_rate": args.exit_failure_rate})
+    except (OSError, ValueError) as e:
+        print(f"Cannot load scenario {args.scenario}: {e}")
+        sys.exit(1)
+    report = simulate(behaviours, args.vpn, args.cycles, args.interval, args.mode, args.seed,
+                      args.prefer_fast, args.rotation_budget)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
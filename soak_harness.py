@@ -0,0 +1,162 @@
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import warnings
+import privileged_ops
+import rotation_simulator
+import stealth_shift
+
+# Rotations between two resource samples
+DEFAULT_CHUNK = 500
+
+# The first samples are taken while caches, deques and pools are still filling up
+WARMUP_FRACTION = 0.25
+
+# Growth between the early and the late part of the run that counts as a leak
+TOLERANCES = {"rss_kib": 8 * 1024, "fds": 2, "threads": 2, "zombies": 0}
+
+# Interface the shim MAC change points the real ioctl at; it does not exist, so every rotation
+# goes through the ioctl's error path
+SHIM_INTERFACE = "sssoak-none"
+
+# Namespace and dummy interface used by --netns
+SOAK_NAMESPACE = "sssoak"
+SOAK_INTERFACE = "soak0"
+
+
+def sample_resources():
+    """Return the process's RSS (KiB), open fds, threads and zombie children."""
+    rss = 0
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    pid = os.getpid()
+    zombies = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue  # Exited while scanning
+        if fields[0] == "Z" and int(fields[1]) == pid:
+            zombies += 1
+    return {"rss_kib": rss, "fds": len(os.listdir("/proc/self/fd")),
+            "threads": threading.active_count(), "zombies": zombies}
+
+
+def find_leaks(samples):
+    """Compare the late part of the run with the early part (after warm-up) for each metric.
+
+    Return {metric: growth} for the metrics that grew beyond their tolerance.
+    """
+    start = int(len(samples) * WARMUP_FRACTION)
+    steady = samples[start:]
+    if len(steady) < 4:
+        return {}
+    half = len(steady) // 2
+    leaks = {}
+    for metric, tolerance in TOLERANCES.items():
+        early = statistics.median(s[metric] for s in steady[:half])
+        late = statistics.median(s[metric] for s in steady[half:])
+        final = steady[-1][metric]
+        growth = max(late, final) - early
+        if growth > tolerance:
+            leaks[metric] = growth
+    return leaks
+
+
+def shim_change_mac(interface, new_mac, logger):
+    """MAC change for the shim backend: runs the real ioctl against SHIM_INTERFACE (failing
+    every time) and advances the virtual clock the simulator patched into time.sleep."""
+    stealth_shift.change_mac_interface_ioctl(SHIM_INTERFACE, new_mac, logger)
+    time.sleep(rotation_simulator.MAC_LATENCY)
+    return True
+
+
+def soak(cycles, chunk=DEFAULT_CHUNK, interface=None, vpn_type="wireguard", profiles=10, failure_rate=0.05,
+         seed=0, progress=None):
+    """Run cycles MAC+VPN rotations against the simulator's fake tunnels, sampling resources
+    every chunk rotations. With interface, MAC changes are real (use a dummy interface).
+    Each fake tunnel command forks a real child, so descriptors and zombies are exercised.
+
+    Sockets, files and processes that are dropped without being closed are counted too
+    (ResourceWarning): CPython's reference counting reclaims them at once, so they never
+    show up as growing fds, but any of them is reported as a leak.
+
+    Return (samples, leaks).
+    """
+    behaviours = rotation_simulator.load_scenario(None, vpn_type, profiles, {"failure_rate": failure_rate})
+    samples = [dict(sample_resources(), cycles=0)]
+    done = 0
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        while done < cycles:
+            count = min(chunk, cycles - done)
+            change_mac = stealth_shift.change_mac if interface else shim_change_mac
+            rotation_simulator.simulate(behaviours, vpn_type, count, mode="rc", seed=seed + done,
+                                        change_mac=change_mac, interface=interface or "sim0", spawn=True)
+            done += count
+            unclosed = sum(1 for warning in caught if issubclass(warning.category, ResourceWarning))
+            samples.append(dict(sample_resources(), cycles=done, unclosed=unclosed))
+            if progress:
+                progress(samples[-1])
+    leaks = find_leaks(samples)
+    if samples[-1].get("unclosed"):
+        leaks["unclosed"] = samples[-1]["unclosed"]
+    return samples, leaks
+
+
+def run_in_netns(argv):
+    """Re-run this harness inside a fresh namespace with a dummy interface for real MAC changes."""
+    privileged_ops.ip_batch([["netns", "add", SOAK_NAMESPACE]])
+    try:
+        privileged_ops.ip_batch([["link", "add", SOAK_INTERFACE, "type", "dummy"],
+                                 ["link", "set", SOAK_INTERFACE, "up"]], netns=SOAK_NAMESPACE)
+        cmd = privileged_ops.privileged(["ip", "netns", "exec", SOAK_NAMESPACE, sys.executable,
+                                         os.path.abspath(__file__), "--interface", SOAK_INTERFACE] + argv)
+        return subprocess.call(cmd)
+    finally:
+        privileged_ops.run_privileged(["ip", "netns", "del", SOAK_NAMESPACE], check=False, cancellable=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak test: run many MAC/VPN rotations and fail if RSS, fds, threads or zombie children keep growing, or if anything is left unclosed.")
+    parser.add_argument("--cycles", type=int, default=20000, help="Rotations to run (default: 20000)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help=f"Rotations between resource samples (default: {DEFAULT_CHUNK})")
+    parser.add_argument("--vpn", choices=("wireguard", "openvpn"), default="wireguard", help="VPN type of the fake tunnels")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="Probability that bringing a fake tunnel up fails")
+    parser.add_argument("--interface", help="Change the MAC of this (dummy) interface for real instead of using the shim")
+    parser.add_argument("--netns", action="store_true", help="Create a namespace with a dummy interface and run with real MAC changes inside it (needs root)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args, _ = parser.parse_known_args()
+
+    if args.netns:
+        forwarded = [arg for arg in sys.argv[1:] if arg != "--netns"]
+        sys.exit(run_in_netns(forwarded))
+
+    logging.basicConfig(level=logging.CRITICAL)
+    start = time.monotonic()
+
+    def progress(sample):
+        print(f"{sample['cycles']:>8} rotations  RSS {sample['rss_kib'] / 1024:7.1f} MiB  fds {sample['fds']:4}  "
+              f"threads {sample['threads']:3}  zombies {sample['zombies']}  unclosed {sample['unclosed']}", flush=True)
+
+    samples, leaks = soak(args.cycles, args.chunk, args.interface, args.vpn, failure_rate=args.failure_rate,
+                          seed=args.seed, progress=progress)
+    print(f"\n{samples[-1]['cycles']} rotations in {time.monotonic() - start:.1f}s")
+    if leaks:
+        for metric, growth in leaks.items():
+            if metric == "unclosed":
+                print(f"FAIL: {growth} socket(s), file(s) or process(es) were never closed")
+            else:
+                print(f"FAIL: {metric} grew by {growth} (tolerance {TOLERANCES[metric]})")
+        sys.exit(1)
+    print("PASS: no unbounded growth in RSS, fds, threads or zombie children, and nothing left unclosed.")
@@ -0,0 +1,125 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import net_inventory
+import rotation_metrics
+
+# Interfaces whose primary MAC has been saved (by -p, -r or -rc) count as managed
+PRIMARY_MAC_SUFFIX = "_primary_mac.txt"
+
+# ARPHRD_NONE: the link type of WireGuard and tun devices
+ARPHRD_NONE = 65534
+
+
+def managed_interfaces(directory="."):
+    """Return the interfaces that have a saved primary MAC in directory."""
+    pattern = os.path.join(glob.escape(directory), f"*{PRIMARY_MAC_SUFFIX}")
+    return sorted(os.path.basename(path)[:-len(PRIMARY_MAC_SUFFIX)] for path in glob.glob(pattern))
+
+
+def read_primary_mac(interface, directory="."):
+    try:
+        with open(os.path.join(directory, f"{interface}{PRIMARY_MAC_SUFFIX}"), "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def read_metrics(path=rotation_metrics.METRICS_FILE):
+    """Return the rotator's last published snapshot and an error message (one of them is None)."""
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None, None  # No rotator has run since boot
+    except (OSError, ValueError) as e:
+        return None, f"{path}: {e}"
+    # A rotator that was killed never got to mark its snapshot as not running
+    if snapshot.get("running") and not os.path.exists(f"/proc/{snapshot.get('pid')}"):
+        snapshot["running"] = False
+    return snapshot, None
+
+
+def collect(interfaces=(), directory="."):
+    """Return the status of the managed (and the given) interfaces, the tunnel devices and the
+    rotator, from sysfs, the primary MAC files and the metrics file only."""
+    snapshot, error = read_metrics()
+    snapshot = snapshot or {}
+    macs = snapshot.get("macs", {})
+    names = sorted(set(managed_interfaces(directory)) | set(interfaces))
+
+    status_interfaces = {}
+    for name in names:
+        info = net_inventory.get_interface(name, max_age=0)
+        primary = read_primary_mac(name, directory)
+        entry = {
+            "exists": info is not None,
+            "mac": info["address"] if info else None,
+            "primary_mac": primary,
+            "operstate": info["operstate"] if info else None,
+        }
+        identity = macs.get(name)
+        if identity and identity["device"] != name and snapshot.get("running"):
+            # --mac-pool: the network sees the active macvlan identity's MAC
+            entry["identity"] = identity
+            entry["mac"] = identity["mac"]
+        entry["is_primary"] = entry["mac"] is not None and entry["mac"] == primary
+        status_interfaces[name] = entry
+
+    tunnels = {}
+    for name in net_inventory.list_interfaces():
+        info = net_inventory.get_interface(name, max_age=0)
+        if info and info["type"] == ARPHRD_NONE:
+            tunnels[name] = {"operstate": info["operstate"]}
+
+    current = snapshot.get("current", {})
+    rotations = snapshot.get("rotations") or []
+    exits = snapshot.get("exits") or []
+    return {
+        "time": time.time(),
+        "rotator": {"running": bool(snapshot.get("running")), "pid": snapshot.get("pid"),
+                    "updated": snapshot.get("updated"), "error": error},
+        "interfaces": status_interfaces,
+        "tunnels": tunnels,
+        "active_tunnel": {"vpn_type": current.get("vpn_type"), "profile": current.get("profile"),
+                          "since": current.get("since")} if current else None,
+        "last_rotation": rotations[-1]["time"] if rotations else None,
+        "last_exit_ip": current.get("exit_ip") or next((e["exit_ip"] for e in reversed(exits) if e.get("exit_ip")), None),
+        "health": {profile: entry["health"] for profile, entry in snapshot.get("profiles", {}).items()},
+    }
+
+
+def status_only_request(argv):
+    """Return the interfaces to report if stealth_shift's arguments are exactly '-s --json'
+    with optional '-i IFACE', else None (the full argument parser handles the rest)."""
+    flags, interfaces = set(), []
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-s", "--status", "--json"):
+            flags.add("json" if arg == "--json" else "status")
+        elif arg in ("-i", "--interface"):
+            interface = next(args, None)
+            if interface is None or interface.startswith("-"):
+                return None
+            interfaces.append(interface)
+        elif arg.startswith("--interface="):
+            interfaces.append(arg.split("=", 1)[1])
+        else:
+            return None
+    return interfaces[-1:] if flags == {"status", "json"} else None
+
+
+def print_status(interfaces=(), directory="."):
+    json.dump(collect(interfaces, directory), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the status of the managed interfaces, tunnels and rotator as JSON.")
+    parser.add_argument("-i", "--interface", action="append", default=[], help="Also report this interface (repeatable); managed interfaces are always reported")
+    parser.add_argument("--dir", default=".", help="Directory holding the <interface>_primary_mac.txt files (default: current directory)")
+    args = parser.parse_args()
+    print_status(args.interface, args.dir)
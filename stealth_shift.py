@@ -1,18 +1,49 @@
+import sys
+import status_report
+
+# Monitors poll '-s --json': answer it before the rotation modules below are imported
+if __name__ == "__main__":
+    _status_interfaces = status_report.status_only_request(sys.argv[1:])
+    if _status_interfaces is not None:
+        status_report.print_status(_status_interfaces)
+        sys.exit(0)
+
 import argparse
+import contextlib
+import errno
 import logging
 import os
 import re
 import string
 import subprocess
-import sys
 import time
 import random
 import threading
-import requests
 import socket
 import struct
 import fcntl
 import signal
+import json
+import shutil
+import command_executor
+import config_index
+import dns_cache
+import endpoint_resolver
+import exit_verifier
+import macvlan_pool
+import net_inventory
+import netns_tunnels
+import openvpn_pool
+import privileged_ops
+import profile_benchmark
+import profiling
+import profile_scoreboard
+import profile_templates
+import profile_validator
+import rotation_metrics
+import tor_control
+import traffic_monitor
+import wg_multipath
 from config_manager import ensure_config_files_and_auth
 from banner import display_banner
 
@@ -32,20 +63,54 @@ def get_arguments():
             "\n"
             "  Each tool enhances your anonymity by routing traffic through secure VPN connections.\n"
             "  Choose 'yes' to start a VPN session, and 'no' to proceed without it.\n"
-            "  This script supports up to 10 different VPN configurations for OpenVPN and WireGuard, stored in the VPNS directory.\n"
+            "  This script supports any number of VPN configurations for OpenVPN and WireGuard, stored in the VPNS directories.\n"
+            "  Provider archives can be imported with 'python config_importer.py <archive>'.\n"
             "  Each configuration requires a corresponding authentication file in the AUTH directory."
         )
     )
-    parser.add_argument("-i", "--interface", required=True, help="The network interface to change MAC address")
+    parser.add_argument("-i", "--interface", help="The network interface to change MAC address")
     parser.add_argument("-m", "--mac", help="Set the MAC address to this value")
     parser.add_argument("-r", "--random", action="store_true", help="Set a random MAC address")
     parser.add_argument("-rc", "--random-change", action="store_true", help="Change MAC address/VPN every specified interval")
     parser.add_argument("-vc", "--vpn-change", action="store_true", help="Change VPN every specified interval")
     parser.add_argument("-p", "--primary", action="store_true", help="Set the MAC address to primary (from file)")
     parser.add_argument("-s", "--status", action="store_true", help="Show current status of the interface")
+    parser.add_argument("--json", action="store_true", help="With -s, print the status of all managed interfaces, tunnels and the rotator as JSON, skipping the startup checks (-i is optional)")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output")
-
-    return parser.parse_args()
+    parser.add_argument("--dns-cache", action="store_true", help="Run a local caching DNS stub that keeps its cache across OpenVPN/WireGuard rotations")
+    parser.add_argument("--mac-pool", type=int, default=0, metavar="N", help="With -rc, rotate between N macvlan sub-interfaces of -i, each with its own MAC and DHCP address, instead of changing the MAC of -i (no link bounce; needs dhclient)")
+    parser.add_argument("--openvpn-standby", type=int, default=0, metavar="N", help="With -vc and OpenVPN, keep N pre-connected standby tunnels so a rotation is a route switch")
+    parser.add_argument("--multipath", type=int, default=0, metavar="K", help="With -vc and WireGuard, keep K tunnels up at once, spread flows across them and replace one per interval")
+    parser.add_argument("--defer-grace", type=int, default=0, metavar="SECONDS", help="Defer rotations for up to SECONDS while heavy transfers are active (default: 0, never defer)")
+    parser.add_argument("--defer-rate", type=int, default=256, metavar="KIB_S", help="Throughput on the interface above which a transfer counts as heavy (default: 256 KiB/s)")
+    parser.add_argument("--defer-flows", type=int, default=0, metavar="N", help="Also defer while more than N TCP connections are established (default: 0, ignore)")
+    parser.add_argument("--rotation-budget", type=int, default=0, metavar="SECONDS", help="Roll back to the last known-good profile if a rotation's new exit is not verified within SECONDS (default: 0, no limit)")
+    parser.add_argument("--fallback-profiles", metavar="PATHS", help="Comma-separated config paths to roll back to when no known-good profile works")
+    parser.add_argument("--validate", action="store_true", help="Check every WireGuard/OpenVPN profile (keys, required fields, auth file, endpoints), report the problems and exit")
+    parser.add_argument("--benchmark", action="store_true", help="Measure handshake time, RTT and throughput of every WireGuard/OpenVPN profile, save them to the profile scoreboard and exit")
+    parser.add_argument("--benchmark-target", metavar="HOST:PORT", help="Benchmark target server (run 'python profile_benchmark.py --serve PORT' on it)")
+    parser.add_argument("--benchmark-duration", type=float, default=profile_benchmark.DEFAULT_DURATION, metavar="SECONDS", help="Seconds of download and of upload per profile (default: 5)")
+    parser.add_argument("--benchmark-parallel", type=int, default=0, metavar="N", help="Benchmark up to N WireGuard profiles at once in separate network namespaces (default: 0, one at a time)")
+    parser.add_argument("--exits", type=int, default=0, metavar="M", help="Bring up M WireGuard/OpenVPN exits at once, each in its own network namespace and rotated on its own schedule; run programs through one with 'python netns_tunnels.py run N -- COMMAND'")
+    parser.add_argument("--exit-intervals", metavar="SECONDS", help="Comma-separated rotation interval of each exit; the last one applies to the remaining exits (default: prompt once for all)")
+    parser.add_argument("--tor-control", metavar="ADDR", help="With Anonsurf, change identity with NEWNYM over this Tor ControlPort (HOST:PORT or socket path) and wait for the new circuit instead of running 'anonsurf change'")
+    parser.add_argument("--tor-socks", default=tor_control.DEFAULT_SOCKS, metavar="HOST:PORT", help=f"Tor SOCKS port used to check the exit after NEWNYM (default: {tor_control.DEFAULT_SOCKS})")
+    parser.add_argument("--tor-control-password", metavar="PASSWORD", help="Password for the ControlPort (HashedControlPassword); cookie and no-auth setups need none")
+    parser.add_argument("--exit-check-rate", type=float, default=exit_verifier.DEFAULT_EXTERNAL_RATE, metavar="FRACTION", help=f"Verify rotations from local evidence (handshake, default route, peer endpoint) and confirm this fraction of them with ifconfig.me as well (default: {exit_verifier.DEFAULT_EXTERNAL_RATE}; 1 = always use ifconfig.me only)")
+    parser.add_argument("--prefer-fast", action="store_true", help="When rotating, favour profiles with a higher benchmarked download throughput")
+    parser.add_argument("--profile", choices=profiling.MODES, help="Arm a profiler (cpu: cProfile, alloc: tracemalloc, sample: low-overhead stack sampling); send SIGUSR1 to start and stop it. Reports go to profiles/, split into MAC, VPN, probe and UI")
+    parser.add_argument("--profile-window", type=int, default=60, metavar="SECONDS", help="Stop profiling by itself after SECONDS (default: 60, 0 = only on the next SIGUSR1)")
+    parser.add_argument("--dns-upstream", help="Comma-separated DNS servers for the cache when a config names none (default: current system nameservers)")
+
+    args = parser.parse_args()
+    if not args.interface and not (args.status and args.json):
+        parser.error("the following arguments are required: -i/--interface")
+    if args.mac_pool > 0 and not args.random_change:
+        # One-shot changes (-r, -m) would leave the identities without a process to route them
+        parser.error("--mac-pool only works with -rc/--random-change")
+    if args.exits > netns_tunnels.MAX_EXITS:
+        parser.error(f"--exits: at most {netns_tunnels.MAX_EXITS} exits are supported")
+    return args
 
 def configure_logging(verbose):
     """Configure logging based on verbosity."""
@@ -64,44 +129,39 @@ def prompt_user_for_sudo():
 
 stop_event = threading.Event()
 
+# Modified copies of VPN configs (e.g. without DNS lines) are written here
+RUNTIME_DIR = "/run/stealth-shift"
+
+# Seconds a rotation may take until its new exit is verified before it is rolled back (0 = no limit),
+# and the profiles tried, after the last known-good one, when rolling back
+rotation_budget = 0
+fallback_profiles = []
+
+# Exit of the last Tor identity verified through the SOCKS port (see start_vpn_with_retries)
+tor_exit_ip = None
+
+# Config path each WireGuard device was brought up from (a runtime copy or rendered profile
+# may differ from WG_VPNS/<device>.conf); 'wg-quick down' needs the same file
+wireguard_up_paths = {}
+
 def check_dependencies(logger):
     """Check for all the repositories and tools (softwares) required to run this script."""
     dependencies = {
         "curl": "curl",
-        "pgrep": "pgrep",
         "kill": "kill",
-        "sudo": "sudo",
         "wg": "wireguard-tools",
         "wg-quick": "wireguard-tools",
         "resolvconf": "resolvconf",
     }
 
     # Check for either python or python3
-    python_or_python3 = False
-    try:
-        subprocess.check_output(["which", "python"], stderr=subprocess.STDOUT)
-        python_or_python3 = True
-    except subprocess.CalledProcessError:
-        try:
-            subprocess.check_output(["which", "python3"], stderr=subprocess.STDOUT)
-            python_or_python3 = True
-        except subprocess.CalledProcessError:
-            pass
+    python_or_python3 = bool(shutil.which("python") or shutil.which("python3"))
 
     if not python_or_python3:
         dependencies["python"] = "python"
 
     # Check for either ip or ifconfig
-    ifconfig_or_ip = False
-    try:
-        subprocess.check_output(["which", "ifconfig"], stderr=subprocess.STDOUT)
-        ifconfig_or_ip = True
-    except subprocess.CalledProcessError:
-        try:
-            subprocess.check_output(["which", "ip"], stderr=subprocess.STDOUT)
-            ifconfig_or_ip = True
-        except subprocess.CalledProcessError:
-            pass
+    ifconfig_or_ip = bool(shutil.which("ifconfig") or shutil.which("ip"))
 
     if not ifconfig_or_ip:
         dependencies["ifconfig"] = "ifconfig"
@@ -109,9 +169,7 @@ def check_dependencies(logger):
     missing_dependencies = []
 
     for dependency, package in dependencies.items():
-        try:
-            subprocess.check_output(["which", dependency], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError:
+        if shutil.which(dependency) is None:
             missing_dependencies.append(package)
 
     # Check for Python libraries
@@ -136,62 +194,16 @@ def check_dependencies(logger):
     logger.debug("All dependencies are satisfied.")
 
 def is_valid_interface(interface):
-    """Check if the interface name is valid based on known naming conventions."""
-    valid_prefixes = [
-        'eth', 'wlan', 'ens', 'wlp', 'wlx',  # Traditional Linux and newer Linux naming
-        'em', 're', 'ath', 'wi',  # BSD systems
-        'en', 'lo',  # macOS and loopback
-        'e1000g', 'bge',  # Solaris
-        'veth', 'br', 'docker',  # Virtual and Docker interfaces
-    ]
-    
-    # Match common patterns for interface names
-    valid_patterns = [
-        r'^eth\d+$',         # eth0, eth1, etc.
-        r'^wlan\d+$',        # wlan0, wlan1, etc.
-        r'^ens\d+$',         # ens33, ens160, etc.
-        r'^wlp\d+s\d+$',     # wlp2s0, etc.
-        r'^wlx[a-fA-F0-9]{12}$',  # wlx0024e8b6d3a, etc.
-        r'^em\d+$',          # em0, em1, etc.
-        r'^re\d+$',          # re0, re1, etc.
-        r'^ath\d+$',         # ath0, ath1, etc.
-        r'^wi\d+$',          # wi0, wi1, etc.
-        r'^e1000g\d+$',      # e1000g0, e1000g1, etc.
-        r'^bge\d+$',         # bge0, bge1, etc.
-        r'^en\d+$',          # en0, en1, etc. (macOS)
-        r'^lo$',             # loopback
-        r'^veth\d+$',        # veth0, veth1, etc.
-        r'^br-\w+$',         # br-<id> for bridge interfaces
-        r'^docker0$',       # Docker bridge
-    ]
-
-    # Check if the interface name matches any of the valid patterns
-    return any(re.match(pattern, interface) for pattern in valid_patterns)
-
+    """Check if the interface name is valid according to the kernel's naming rules."""
+    return net_inventory.is_valid_interface_name(interface)
 
 def interface_exists(interface, logger):
-    """Check if the network interface exists using ifconfig or ip."""
-    ifconfig_command = ["ifconfig", interface]
-    ip_command = ["ip", "link", "show", interface]
-    
-    try:
-        # Check if ifconfig is available
-        logger.debug(f"Checking if interface {interface} exists using 'ifconfig'")
-        subprocess.check_output(ifconfig_command, stderr=subprocess.STDOUT)
+    """Check if the network interface exists in /sys/class/net."""
+    logger.debug(f"Checking if interface {interface} exists")
+    if net_inventory.interface_exists(interface):
         return True
-    except FileNotFoundError:
-        logger.debug("'ifconfig' command not found, falling back to 'ip'")
-        # If ifconfig is not available, check with ip
-        try:
-            logger.debug(f"Checking if interface {interface} exists using 'ip link'")
-            subprocess.check_output(ip_command, stderr=subprocess.STDOUT)
-            return True
-        except subprocess.CalledProcessError:
-            logger.debug(f"Interface {interface} does not exist.")
-            return False
-    except subprocess.CalledProcessError:
-        logger.debug(f"Interface {interface} does not exist.")
-        return False
+    logger.debug(f"Interface {interface} does not exist.")
+    return False
 
 def generate_mac_address(logger):
     """Generate a new MAC address with a local administered bit set."""
@@ -229,73 +241,49 @@ def is_valid_ip(ip):
 
 def get_current_mac(interface, logger):
     """Retrieve the current MAC address of the specified interface."""
-    ifconfig_command = ["ifconfig", interface]
-    ip_command = ["ip", "link", "show", interface]
-
-    try:
-        # Try to get MAC address using ifconfig
-        logger.debug(f"Getting current MAC address for {interface} using 'ifconfig'")
-        ifconfig_result = subprocess.check_output(ifconfig_command).decode('utf-8')
-        mac_address_search_result = re.search(r"([0-9a-fA-F]{2}[:-]){5}[0-9a-fA-F]{2}", ifconfig_result)
-    except FileNotFoundError:
-        logger.debug("'ifconfig' command not found, falling back to 'ip link'")
-        try:
-            # If ifconfig is not available, use ip link
-            logger.debug(f"Getting current MAC address for {interface} using 'ip link'")
-            ip_result = subprocess.check_output(ip_command).decode('utf-8')
-            mac_address_search_result = re.search(r"link/ether ([0-9a-fA-F]{2}[:-]){5}[0-9a-fA-F]{2}", ip_result)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Could not retrieve MAC address using 'ip link': {e}")
-            return None
-    except subprocess.CalledProcessError:
-        logger.error(f"Could not retrieve MAC address using 'ifconfig'")
-        return None
-
-    if mac_address_search_result:
-        current_mac = mac_address_search_result.group(0)
+    logger.debug(f"Getting current MAC address for {interface}")
+    current_mac = net_inventory.get_mac(interface)
+    if current_mac:
         logger.debug(f"Current MAC address: {current_mac}")
         return current_mac
     else:
         logger.error("Could not read MAC address")
         return None
 
-def change_mac_interface_ioctl(interface, new_mac, logger):
-    """Change the MAC address of the specified interface using ioctl."""
-    try:
-        # Open a socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        
+def set_mac_ioctl(interface, new_mac):
+    """Change the MAC address of the specified interface using ioctl. Raises OSError on failure."""
+    # Open a socket; it is closed even when the ioctl raises (this runs every rotation)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
         # Ensure interface name is 16 bytes long (pad if necessary)
         interface_padded = interface.ljust(16, '\0').encode('utf-8')
-        
+
         # Convert MAC address to bytes
         new_mac_bytes = bytes.fromhex(new_mac.replace(':', ''))
-        
+
         # Prepare the ifreq structure
         ifr = struct.pack('16sH6s', interface_padded, socket.AF_UNIX, new_mac_bytes)
-        
+
         # Define the SIOCSIFHWADDR constant (for Linux, it's 0x8924)
         SIOCSIFHWADDR = 0x8924
-        
+
         # Perform the ioctl call to change the MAC address
         fcntl.ioctl(s.fileno(), SIOCSIFHWADDR, ifr)
-        
-        # Close the socket
-        s.close()
-        
-        logger.info(f"MAC address successfully changed to {new_mac}")
+
+def change_mac_interface_ioctl(interface, new_mac, logger):
+    """Change the MAC address of the specified interface using ioctl."""
+    try:
+        set_mac_ioctl(interface, new_mac)
         return True
     except Exception as e:
-        logger.error(f"Error changing MAC address using ioctl: {e}")
+        logger.debug(f"Error changing MAC address using ioctl: {e}")
         return False
 
 def execute_commands(commands, logger):
     """Execute a list of commands with error handling and logging."""
     for cmd in commands:
         try:
-            logger.debug(f"Executing command: {' '.join(cmd)}")
-            subprocess.run(cmd, check=True)
-            time.sleep(1)  # Delay between commands
+            command_executor.run_command(cmd, logger, phase="link", stdout=None)
+            command_executor.sleep(1)  # Delay between commands
         except subprocess.CalledProcessError as e:
             logger.error(f"Command failed with error: {e}")
             raise  # Re-raise the exception to stop execution if a command fails
@@ -303,43 +291,145 @@ def execute_commands(commands, logger):
 def bring_interface_down_and_up(interface, new_mac, logger, use_ip=False):
     """Bring the interface down, change MAC address, and bring it up using either 'ifconfig' or 'ip link'."""
     if use_ip:
-        commands = [
-            ["sudo", "ip", "link", "set", "dev", interface, "down"],
-            ["sudo", "ip", "link", "set", "dev", interface, "address", new_mac],
-            ["sudo", "ip", "link", "set", "dev", interface, "up"]
-        ]
-    else:
-        commands = [
-            ["sudo", "ifconfig", interface, "down"],
-            ["sudo", "ifconfig", interface, "hw", "ether", new_mac],
-            ["sudo", "ifconfig", interface, "up"]
-        ]
-    
+        # All three link changes are applied by a single 'ip -batch' process
+        privileged_ops.set_link_address(interface, new_mac, logger)
+        return
+
+    commands = [
+        privileged_ops.privileged(["ifconfig", interface, "down"]),
+        privileged_ops.privileged(["ifconfig", interface, "hw", "ether", new_mac]),
+        privileged_ops.privileged(["ifconfig", interface, "up"])
+    ]
+
     execute_commands(commands, logger)
 
-def change_mac(interface, new_mac, logger):
-    """Change the MAC address of the specified interface."""
-    try:
-        logger.debug(f"Attempting to change MAC address for {interface} to {new_mac} using ioctl")
-        if change_mac_interface_ioctl(interface, new_mac, logger):
-            return True
-        else:
-            logger.debug("Failed to change MAC address using ioctl. Trying 'ifconfig'...")
-            if subprocess.call(["which", "ifconfig"], stdout=subprocess.DEVNULL) == 0:
-                bring_interface_down_and_up(interface, new_mac, logger, use_ip=False)
-                logger.info(f"MAC address successfully changed to {new_mac}")
-                return True
-            else:
-                raise FileNotFoundError("ifconfig not found")
-    except FileNotFoundError:
-        logger.debug(f"Failed to change MAC address using 'ifconfig'. Trying 'ip link'...")
+# MAC change methods, cheapest first. Live methods change the address without a link bounce.
+MAC_CHANGE_STRATEGIES = ["ioctl", "ip_live", "ip_bounce", "ifconfig_bounce"]
+LIVE_MAC_STRATEGIES = {"ioctl", "ip_live"}
+MAC_STRATEGY_FILE = "mac_strategy_cache.json"
+
+# A live method is only given up on after this many failures in a row, unless the driver
+# rejects it outright (errors below); other failures may be transient (link busy, timeout)
+MAC_STRATEGY_MAX_FAILURES = 3
+UNSUPPORTED_MAC_ERRORS = (errno.EOPNOTSUPP, errno.EBUSY)
+
+# Results of apply_mac_strategy
+MAC_CHANGED = "changed"
+MAC_FAILED = "failed"
+MAC_UNSUPPORTED = "unsupported"
+
+mac_strategy_cache = None
+mac_strategy_lock = threading.Lock()
+
+def get_interface_driver(interface):
+    """Return the kernel driver bound to the interface, or 'unknown' for virtual devices."""
+    info = net_inventory.get_interface(interface)
+    return (info and info["driver"]) or "unknown"
+
+def load_mac_strategy_cache(logger):
+    """Load the remembered MAC change strategies from file (once per process)."""
+    global mac_strategy_cache
+    if mac_strategy_cache is None:
         try:
+            with open(MAC_STRATEGY_FILE, 'r') as file:
+                mac_strategy_cache = json.load(file)
+            logger.debug(f"Loaded MAC change strategies from {MAC_STRATEGY_FILE}")
+        except (OSError, ValueError):
+            mac_strategy_cache = {}
+    return mac_strategy_cache
+
+def save_mac_strategy_cache(logger):
+    """Persist the remembered MAC change strategies so the next run skips probing."""
+    try:
+        with open(MAC_STRATEGY_FILE, 'w') as file:
+            json.dump(mac_strategy_cache, file, indent=2)
+    except OSError as e:
+        logger.debug(f"Could not save MAC change strategies: {e}")
+
+def is_unsupported_mac_error(error):
+    """Return True if a MAC change failed because the driver does not support the method."""
+    if isinstance(error, OSError):
+        return error.errno in UNSUPPORTED_MAC_ERRORS
+    message = str(getattr(error, "stderr", None) or "")
+    return any(os.strerror(code) in message for code in UNSUPPORTED_MAC_ERRORS)
+
+def apply_mac_strategy(strategy, interface, new_mac, logger):
+    """Change the MAC address with a single strategy.
+
+    Return MAC_CHANGED, MAC_UNSUPPORTED if the driver rejected the method, or MAC_FAILED.
+    """
+    logger.debug(f"Attempting to change MAC address for {interface} to {new_mac} using {strategy}")
+    net_inventory.invalidate(interface)
+    try:
+        if strategy == "ioctl":
+            set_mac_ioctl(interface, new_mac)
+        elif strategy == "ip_live":
+            privileged_ops.set_link_address(interface, new_mac, logger, bounce=False)
+        elif strategy == "ip_bounce":
             bring_interface_down_and_up(interface, new_mac, logger, use_ip=True)
-            logger.info(f"MAC address successfully changed to {new_mac}")
-            return True
-        except Exception as e:
-            logger.error(f"Error changing MAC address using 'ip link': {e}")
-            return False
+        elif strategy == "ifconfig_bounce":
+            if not shutil.which("ifconfig"):
+                return MAC_FAILED
+            bring_interface_down_and_up(interface, new_mac, logger, use_ip=False)
+        return MAC_CHANGED
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.debug(f"Changing MAC address using {strategy} failed: {e}")
+        return MAC_UNSUPPORTED if is_unsupported_mac_error(e) else MAC_FAILED
+
+def change_mac(interface, new_mac, logger):
+    """Change the MAC address of the specified interface.
+
+    The method that last worked for this interface and driver is tried first. Live methods
+    that the driver rejects (or that fail MAC_STRATEGY_MAX_FAILURES times in a row) are
+    remembered and skipped on later rotations.
+    """
+    with mac_strategy_lock:
+        cache = load_mac_strategy_cache(logger)
+        key = f"{interface}:{get_interface_driver(interface)}"
+        entry = cache.setdefault(key, {"strategy": None, "live": None, "unsupported": []})
+        failures = entry.setdefault("failures", {})
+        known = entry["strategy"]
+        candidates = [strategy for strategy in MAC_CHANGE_STRATEGIES if strategy not in entry["unsupported"]]
+        # Live methods that have only failed transiently are retried before a remembered bounce
+        retry = [] if known in LIVE_MAC_STRATEGIES else [
+            strategy for strategy in candidates if strategy in failures
+        ]
+        order = retry + ([known] if known else []) + [
+            strategy for strategy in candidates if strategy != known and strategy not in retry
+        ]
+
+        changed = False
+        success = False
+        for strategy in order:
+            result = apply_mac_strategy(strategy, interface, new_mac, logger)
+            if result == MAC_CHANGED:
+                success = True
+                if failures.pop(strategy, None):
+                    changed = True
+                if strategy != known:
+                    logger.debug(f"Using {strategy} to change MAC address on {key} from now on")
+                    entry["strategy"] = strategy
+                    entry["live"] = strategy in LIVE_MAC_STRATEGIES
+                    changed = True
+                logger.info(f"MAC address successfully changed to {new_mac}")
+                break
+            if strategy == known:
+                # The remembered method stopped working; probe again from the cheapest one
+                entry["strategy"] = None
+                changed = True
+            if strategy in LIVE_MAC_STRATEGIES:
+                failures[strategy] = failures.get(strategy, 0) + 1
+                if result == MAC_UNSUPPORTED or failures[strategy] >= MAC_STRATEGY_MAX_FAILURES:
+                    logger.debug(f"{strategy} is not supported on {key}; skipping it from now on")
+                    entry["unsupported"].append(strategy)
+                    del failures[strategy]
+                changed = True
+        else:
+            logger.error(f"Error changing MAC address for {interface}: all methods failed")
+
+        if changed:
+            save_mac_strategy_cache(logger)
+        return success
 
 def save_primary_mac_to_file(interface, primary_mac, logger):
     """Save the primary MAC address to a file."""
@@ -403,19 +493,18 @@ def get_interface_status(interface, primary_mac, logger):
     else:
         logger.error(f"Could not retrieve current MAC address for {interface}")
 
-def wait_for_interface_up(interface, logger):
-    """Wait for the interface to come up."""
+def wait_for_interface_up(interface, logger, timeout=60):
+    """Wait for the interface to come up, giving up after timeout seconds or on shutdown."""
     logger.debug(f"Waiting for interface {interface} to come up...")
-    while True:
-        ip_command = ["ip", "link", "show", interface]
-        try:
-            ip_result = subprocess.check_output(ip_command).decode('utf-8')
-            if "state UP" in ip_result:
-                logger.debug(f"Interface {interface} is up.")
-                break
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error checking interface status: {e}")
-        time.sleep(1)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if net_inventory.is_oper_up(interface):
+            logger.debug(f"Interface {interface} is up.")
+            return True
+        if command_executor.sleep(1):
+            return False
+    logger.error(f"Interface {interface} did not come up within {timeout} seconds.")
+    return False
 
 def set_file_permissions(directory, logger):
     """Set file permissions for all .conf files in the given directory."""
@@ -424,23 +513,98 @@ def set_file_permissions(directory, logger):
             if filename.endswith(".conf"):
                 file_path = os.path.join(directory, filename)
                 # Set read and write permissions for the owner only
-                subprocess.run(['sudo', 'chmod', '600', file_path], check=True)
-                logger.debug(f"Permissions set for file: {file_path}")
+                privileged_ops.chmod(file_path, 0o600, logger)
     except Exception as e:
         logger.error(f"Error setting file permissions: {e}")
 
+def write_runtime_config(filename, lines, logger):
+    """Write a modified copy of a config under RUNTIME_DIR, keeping its file name, and return its path."""
+    os.makedirs(RUNTIME_DIR, mode=0o700, exist_ok=True)
+    runtime_path = os.path.join(RUNTIME_DIR, os.path.basename(filename))
+    fd = os.open(runtime_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as file:
+        file.writelines(lines)
+    logger.debug(f"Wrote runtime copy of {filename} to {runtime_path}")
+    return runtime_path
+
+def choose_vpn_config(vpn_type, exclude=()):
+    """Select a valid config file for vpn_type, at random or weighted by benchmark results (--prefer-fast).
+
+    Configs in exclude (e.g. those other tunnels use) are not chosen; None is returned if
+    no other valid one is left. Without a valid profile at all, logs an error and stops
+    the rotator (SystemExit in this thread).
+    """
+    profiles = profile_validator.valid_profiles(vpn_type)
+    if not profiles:
+        # Rotating through profiles known to be broken would only fail (or leak): stop instead
+        directory = config_index.VPN_PROFILE_DIRS[vpn_type][0]
+        logging.getLogger(__name__).error(f"No valid {vpn_type} profile in {directory}; "
+                                          f"run with --validate to see the problems. Stopping.")
+        stop_event.set()
+        raise SystemExit(1)
+    profiles = [path for path in profiles if path not in exclude]
+    if not profiles:
+        return None
+    # A templated profile is written to tmpfs only once it is selected
+    return profile_templates.materialize(profile_scoreboard.choose(profiles))
+
+def choose_vpn_candidates(vpn_type, count, logger):
+    """Select the configs for the next rotation's attempts and resolve their endpoints now,
+    while the current tunnel (and its DNS) is still up."""
+    if vpn_type not in ("wireguard", "openvpn"):
+        return None
+    candidates = [choose_vpn_config(vpn_type) for _ in range(count)]
+    endpoint_resolver.prefetch(set(candidates), logger)
+    return candidates
+
+def wireguard_device(filename):
+    """Return the device wg-quick creates for a config: it is named after the file."""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def wireguard_device_exists(filename):
+    return net_inventory.get_interface(wireguard_device(filename), max_age=0) is not None
+
+def wireguard_up(filename, logger):
+    """Bring up a WireGuard config with wg-quick.
+
+    Endpoint host names are replaced by their (pre-)resolved IPs. With the DNS cache
+    running, the config's DNS servers become the cache's upstreams and the DNS line is
+    left out so wg-quick does not replace the system resolver.
+    """
+    with open(filename, 'r') as file:
+        original = file.readlines()
+    lines = endpoint_resolver.with_literal_endpoints(original, logger)
+    if dns_cache.is_running():
+        dns_cache.use_config_upstreams(filename, logger)
+        lines = [line for line in lines if not re.match(r"^\s*DNS\s*=", line, re.IGNORECASE)]
+    config_path = filename
+    if lines != original:
+        config_path = write_runtime_config(filename, lines, logger)
+    privileged_ops.run_privileged(['wg-quick', 'up', config_path], logger, phase="vpn_up")
+    wireguard_up_paths[wireguard_device(config_path)] = config_path
+
+def openvpn_up(filename, logger):
+    """Start OpenVPN as a daemon with the given config, using literal IPs for its remotes."""
+    if dns_cache.is_running():
+        dns_cache.use_config_upstreams(filename, logger)
+    with open(filename, 'r') as file:
+        original = file.readlines()
+    lines = endpoint_resolver.with_literal_endpoints(original, logger)
+    config_path = filename
+    if lines != original:
+        config_path = write_runtime_config(filename, lines, logger)
+    privileged_ops.run_privileged(['openvpn', '--config', config_path, '--daemon'], logger, phase="vpn_up")
+
 def start_wireguard(verbose, logger, interface):
     """Start WireGuard."""
     logger.debug("Attempting to start WireGuard")
     try:
-        # Generate a random number between 1 and 10
-        random_number = random.randint(1, 10)
-        
-        # Construct the filename using the random number
-        filename = f"WG_VPNS/config-{random_number}.conf"
+        # Randomly select a WireGuard configuration
+        filename = choose_vpn_config("wireguard")
         
         # Start the WireGuard interface
-        subprocess.run(['sudo', 'wg-quick', 'up', filename], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        wireguard_up(filename, logger)
+        rotation_metrics.set_current_tunnel("wireguard", filename)
 
         # Wait for the interface to come up
         wait_for_interface_up(interface, logger)
@@ -462,15 +626,19 @@ def stop_wireguard(verbose, logger):
     logger.debug("Attempting to stop WireGuard")
     try:
         # Get the currently running interface
-        interface = subprocess.run(['sudo', 'wg', 'show'], capture_output=True, text=True, check=True)
+        interface = privileged_ops.run_privileged(['wg', 'show'], logger, phase="probe")
         # Extract the interface name from the output
-        lines = interface.stdout.strip().split('\n')
+        lines = [line for line in interface.stdout.strip().split('\n') if line.startswith('interface: ')]
         if lines:
             running_interface = lines[0].split(': ')[1]  # Get the interface name from the first line
             logger.debug(f"Running WireGuard interface found: {running_interface}")
 
-            # Stop the WireGuard interface
-            subprocess.run(['sudo', 'wg-quick', 'down', f'WG_VPNS/{running_interface}.conf'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            # Stop the WireGuard interface with the file it was brought up from, if still there
+            config_path = wireguard_up_paths.pop(running_interface, None)
+            if config_path and os.path.isfile(config_path):
+                privileged_ops.run_privileged(['wg-quick', 'down', config_path], logger, phase="vpn_down")
+            else:
+                privileged_ops.run_privileged(['ip', 'link', 'del', running_interface], logger, phase="vpn_down")
             if verbose:
                 print(f"Stopped WireGuard interface: {running_interface}")
             else:
@@ -486,10 +654,10 @@ def start_openvpn(verbose, logger, interface):
     """Start OpenVPN."""
     logger.debug("Attempting to start OpenVPN")
     try:
-        random_number = random.randint(1, 10)
-        filename = f"OP_VPNS/config-{random_number}.ovpn"
+        filename = choose_vpn_config("openvpn")
         wait_for_interface_up(interface, logger)
-        subprocess.run(['sudo', 'openvpn', '--config', filename, '--daemon'], check=True)
+        openvpn_up(filename, logger)
+        rotation_metrics.set_current_tunnel("openvpn", filename)
         if verbose:
             print(f"Started OpenVPN with config: {filename}")
         logger.info("OpenVPN started successfully.")
@@ -504,11 +672,11 @@ def stop_openvpn(verbose, logger):
     """Stop OpenVPN."""
     logger.debug("Attempting to stop OpenVPN")
     try:
-        openvpn_pids = subprocess.check_output(['pgrep', 'openvpn']).decode('utf-8').strip().split('\n')
+        openvpn_pids = privileged_ops.find_pids('openvpn')
         if openvpn_pids:
-            subprocess.run(['sudo', 'kill'] + openvpn_pids, check=True)
+            privileged_ops.kill_pids(openvpn_pids, logger)
             if verbose:
-                print(f"Stopped OpenVPN processes: {', '.join(openvpn_pids)}")
+                print(f"Stopped OpenVPN processes: {', '.join(str(pid) for pid in openvpn_pids)}")
             logger.info("OpenVPN stopped.")
         else:
             logger.debug("No OpenVPN processes found.")
@@ -521,7 +689,8 @@ def start_anonsurf(verbose, logger):
     """Start Anonsurf."""
     logger.debug("Attempting to start Anonsurf")
     try:
-        result = subprocess.run(['sudo', 'anonsurf', 'start'], capture_output=True, text=True, check=True)
+        result = privileged_ops.run_privileged(['anonsurf', 'start'], logger, phase="anonsurf")
+        rotation_metrics.set_current_tunnel("anonsurf", "anonsurf")
         if verbose:
             print(result.stdout)
         logger.info("Anonsurf started successfully.")
@@ -536,7 +705,7 @@ def stop_anonsurf(verbose, logger):
     """Stop Anonsurf."""
     logger.debug("Attempting to stop Anonsurf")
     try:
-        result = subprocess.run(['sudo', 'anonsurf', 'stop'], capture_output=True, text=True, check=True)
+        result = privileged_ops.run_privileged(['anonsurf', 'stop'], logger, phase="anonsurf")
         if verbose:
             print(result.stdout)
         logger.info("Anonsurf stopped.")
@@ -585,20 +754,13 @@ def cleanup(interface, primary_mac, wireguard_started, openvpn_started, anonsurf
     # Bring the interface back up if it was down
     try:
         logger.debug(f"Checking if interface {interface} is up.")
-        ip_command = ["ip", "link", "show", interface]
-        ifconfig_command = ["ifconfig", interface]
-
-        try:
-            ifconfig_result = subprocess.check_output(ifconfig_command).decode('utf-8')
-            if "UP" not in ifconfig_result:
-                logger.debug(f"Interface {interface} is down. Bringing it back up.")
-                subprocess.run(["sudo", "ifconfig", interface, "up"], check=True)
-        except FileNotFoundError:
-            logger.debug("'ifconfig' command not found, falling back to 'ip link'")
-            ip_result = subprocess.check_output(ip_command).decode('utf-8')
-            if "state UP" not in ip_result:
-                logger.debug(f"Interface {interface} is down. Bringing it back up.")
-                subprocess.run(["sudo", "ip", "link", "set", "dev", interface, "up"], check=True)
+        if not net_inventory.is_admin_up(interface):
+            logger.debug(f"Interface {interface} is down. Bringing it back up.")
+            if shutil.which("ip"):
+                privileged_ops.run_privileged(["ip", "link", "set", "dev", interface, "up"], logger, phase="link")
+            else:
+                privileged_ops.run_privileged(["ifconfig", interface, "up"], logger, phase="link")
+            net_inventory.invalidate(interface)
 
         # Recheck if the primary MAC address file exists
         primary_mac_file = f"{interface}_primary_mac.txt"
@@ -623,6 +785,17 @@ def cleanup(interface, primary_mac, wireguard_started, openvpn_started, anonsurf
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to check or bring up interface {interface}: {e}")
 
+    openvpn_pool.shutdown_pool(logger)
+    wg_multipath.shutdown_group(logger)
+    macvlan_pool.shutdown_pool(logger)
+
+    if dns_cache.is_running():
+        try:
+            dns_cache.restore_system_resolver(logger)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to restore the system resolver: {e}")
+        dns_cache.stop_dns_cache(logger)
+
     # Stop WireGuard if it was started
     if wireguard_started:
         stop_wireguard(verbose, logger)
@@ -631,6 +804,24 @@ def cleanup(interface, primary_mac, wireguard_started, openvpn_started, anonsurf
     if anonsurf_started:
         stop_anonsurf(verbose, logger)
 
+def start_dns_cache_if_requested(args, vpn_type, logger):
+    """Start the local DNS cache and make it the system resolver when --dns-cache was given."""
+    if not args.dns_cache:
+        return
+    if vpn_type not in ("wireguard", "openvpn"):
+        logger.warning("The DNS cache is only used with OpenVPN and WireGuard; skipping it.")
+        return
+    if args.dns_upstream:
+        upstreams = [server.strip() for server in args.dns_upstream.split(",") if server.strip()]
+    else:
+        upstreams = dns_cache.system_nameservers()
+    try:
+        dns_cache.start_dns_cache(logger, upstreams=upstreams)
+        dns_cache.use_as_system_resolver(logger)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"Failed to start the DNS cache: {e}")
+        dns_cache.stop_dns_cache(logger)
+
 def prompt_user_for_VPN(vpn_change=False):
     """Prompt user to start VPN and choose the VPN type."""
     max_attempts = 3
@@ -676,112 +867,402 @@ def ask_vpn_choice():
         print("\nInput interrupted. Exiting...")
         sys.exit(1)
         
+def rotate_mac_identity(interface, logger):
+    """Show a new MAC on the network: switch to the next macvlan identity with --mac-pool,
+    otherwise change the interface's own MAC. Return the new MAC, or None on failure."""
+    pool = macvlan_pool.get_pool()
+    if pool:
+        identity = pool.rotate()
+        if identity is None:
+            logger.warning("No fresh MAC identity is ready yet; keeping the current one.")
+            return None
+        rotation_metrics.set_mac(interface, identity.mac, identity.device)
+        return identity.mac
+    new_mac = generate_mac_address(logger)
+    if not change_mac(interface, new_mac, logger):
+        return None
+    rotation_metrics.set_mac(interface, new_mac)
+    return new_mac
+
 def change_mac_periodically(interface, logger, interval):
     """Periodically change the MAC address of the specified interface."""
+    command_executor.bind_stop_event(stop_event)
     try:
         while not stop_event.is_set():
-            new_mac = generate_mac_address(logger)
-            if change_mac(interface, new_mac, logger):
+            traffic_monitor.wait_for_quiet(interface, logger, stop_event)
+            if stop_event.is_set():
+                break
+            forks_before = command_executor.thread_fork_count()
+            new_mac = rotate_mac_identity(interface, logger)
+            if new_mac:
                 clear_line() 
                 sys.stdout.write("\033[K")  # Clear the current line
                 print(f"New MAC address is {new_mac}.")
             else:
                 logger.warning("Failed to change MAC address.")
+            rotation_metrics.record_rotation("mac", command_executor.thread_fork_count() - forks_before, logger)
             stop_event.wait(interval)  # Wait for the user-defined interval or until stop_event is set
     except KeyboardInterrupt:
         logger.debug("Periodic MAC address change interrupted by user.")
 
+def stop_vpn_for_rotation(vpn_type, logger):
+    """Tear down the current tunnel before a rotation. Anonsurf is changed in place."""
+    if vpn_type == "wireguard":
+        stop_wireguard(False, logger)
+    elif vpn_type == "openvpn":
+        stop_openvpn(False, logger)
+
+def start_vpn_with_retries(vpn_type, logger, attempts=5, candidates=None):
+    """Bring up a new tunnel for vpn_type, retrying on failure. Return True on success.
+
+    candidates, if given, are the configs to try in order (see choose_vpn_candidates).
+    """
+    global tor_exit_ip
+    for attempt in range(attempts):
+        if command_executor.deadline_remaining() == 0:
+            # Every command would time out at once; that says nothing about the next profile
+            logger.error(f"The rotation budget is spent; not starting {vpn_type} attempt {attempt + 1}.")
+            break
+        filename = vpn_type
+        try:
+            if vpn_type == "wireguard":
+                # Use the pre-selected configuration, or pick one at random
+                filename = candidates[attempt] if candidates else choose_vpn_config(vpn_type)
+                logger.debug(f"Starting WireGuard with config: {filename} (Attempt {attempt + 1})")
+                wireguard_up(filename, logger)
+                # Kernel WireGuard has no process to look for; its device is the evidence
+                if wireguard_device_exists(filename):
+                    rotation_metrics.set_current_tunnel(vpn_type, filename)
+                    rotation_metrics.record_attempt(filename, True)
+                    clear_line()
+                    sys.stdout.write("\033[K") 
+                    print("WireGuard: New connection established.")
+                    return True
+                # Never leave a half-started tunnel behind before trying the next candidate
+                device = wireguard_device(filename)
+                privileged_ops.run_privileged(["ip", "link", "del", device], logger, phase="vpn_down",
+                                              check=False, cancellable=False)
+                rotation_metrics.record_attempt(filename, False)
+                logger.error(f"WireGuard device {device} did not appear. Retrying... ({attempt + 1}/{attempts})")
+            elif vpn_type == "openvpn":
+                # Start OpenVPN with the pre-selected or a random configuration file
+                filename = candidates[attempt] if candidates else choose_vpn_config(vpn_type)
+                logger.debug(f"Starting OpenVPN with config: {filename} (Attempt {attempt + 1})")
+                openvpn_up(filename, logger)
+                if privileged_ops.find_pids('openvpn'):
+                    rotation_metrics.set_current_tunnel(vpn_type, filename)
+                    rotation_metrics.record_attempt(filename, True)
+                    clear_line()
+                    sys.stdout.write("\033[K") 
+                    print("OpenVPN: New connection established.")
+                    return True
+            elif vpn_type == "anonsurf":
+                logger.debug("Changing Anonsurf...")
+                if tor_control.is_enabled():
+                    # NEWNYM over the control port, returning once the new circuit is built
+                    exit_ip = tor_control.change_identity(logger)
+                    logger.debug(f"Tor exit through the SOCKS port: {exit_ip}")
+                    if exit_ip == tor_exit_ip:
+                        raise tor_control.TorControlError(f"the new circuit kept the exit {exit_ip}")
+                    tor_exit_ip = exit_ip
+                else:
+                    privileged_ops.run_privileged(["anonsurf", "change"], logger, phase="anonsurf")
+                rotation_metrics.set_current_tunnel(vpn_type, filename)
+                rotation_metrics.record_attempt(filename, True)
+                clear_line()
+                sys.stdout.write("\033[K") 
+                print("AnonSurf: New connection established.")
+                return True
+
+        except (subprocess.CalledProcessError, tor_control.TorControlError) as e:
+            # A command cut short by the rotation budget is not the profile's failure
+            if not (isinstance(e, command_executor.CommandTimeout) and command_executor.deadline_remaining() == 0):
+                rotation_metrics.record_attempt(filename, False)
+            logger.error(f"Failed to start {vpn_type}: {e}. Retrying... ({attempt + 1}/{attempts})")
+            if command_executor.sleep(5):  # Wait before retrying
+                break
+
+    logger.error(f"Failed to start {vpn_type} after multiple attempts.")
+    return False
+
+def verify_public_ip_changed(logger, initial_ip, rotation_start=None):
+    """Poll the public IP until it differs from initial_ip. Return the new IP or None
+    (or the VPN server's address, when the tunnel was only verified locally).
+
+    With rotation_start (a time.monotonic() value), the time to the new exit is recorded.
+    The tunnel is first verified from local evidence (see exit_verifier); the echo service
+    is then only asked for a sample of rotations, or when there is no such evidence.
+    """
+    if exit_verifier.local_checks_enabled():
+        tunnel_exit = exit_verifier.verify_local(rotation_metrics.current_profile(), logger)
+        if tunnel_exit:
+            public_ip = get_public_ip(logger) if exit_verifier.external_check_due() else None
+            if public_ip == initial_ip:
+                print(f"Your public IP did not change: {initial_ip}")
+                logger.warning(f"The tunnel to {tunnel_exit} is up, but traffic still leaves from {initial_ip}.")
+                return None
+            clear_line()
+            sys.stdout.write("\033[K")
+            if public_ip and is_valid_ip(public_ip):
+                print(f"Tunnel verified, exit: {public_ip}")
+                if rotation_start is not None:
+                    rotation_metrics.record_exit(public_ip, time.monotonic() - rotation_start, "echo", tunnel_exit)
+                return public_ip
+            # Unsampled, or no answer from the echo service: the exit itself is unknown
+            print(f"Tunnel to {tunnel_exit} verified.")
+            if rotation_start is not None:
+                rotation_metrics.record_exit(None, time.monotonic() - rotation_start, "local", tunnel_exit)
+            return tunnel_exit
+        logger.debug("No local evidence that the tunnel is up; asking the echo service.")
+
+    new_public_ip = None
+    for _ in range(10):  # Retry up to 10 times
+        new_public_ip = get_public_ip(logger)
+        if new_public_ip and new_public_ip != initial_ip and is_valid_ip(new_public_ip):
+            clear_line()
+            sys.stdout.write("\033[K") 
+            print(f"New public IP address: {new_public_ip}")
+            if rotation_start is not None:
+                rotation_metrics.record_exit(new_public_ip, time.monotonic() - rotation_start)
+            return new_public_ip
+        else:
+            logger.debug(f"Current public IP is still the same as initial: {initial_ip}")
+        if command_executor.sleep(5):  # Wait and retry
+            break
+
+    # After the loop, check if IP did not change
+    if new_public_ip == initial_ip:
+        print(f"Your public IP did not change: {initial_ip}")
+        logger.debug("IP address did not change after starting VPN.")
+    return None
+
+def verify_new_exit(vpn_type, logger, initial_ip, rotation_start=None):
+    """Verify the exit of a rotation that start_vpn_with_retries just completed; see
+    verify_public_ip_changed. Return the new exit IP or None.
+
+    An Anonsurf rotation over Tor's control port was already verified through the SOCKS
+    port, so its exit is recorded without asking the echo service again.
+    """
+    if vpn_type == "anonsurf" and tor_control.is_enabled() and tor_exit_ip:
+        clear_line()
+        sys.stdout.write("\033[K")
+        print(f"New Tor exit: {tor_exit_ip}")
+        if rotation_start is not None:
+            rotation_metrics.record_exit(tor_exit_ip, time.monotonic() - rotation_start, "tor")
+        return tor_exit_ip
+    return verify_public_ip_changed(logger, initial_ip, rotation_start)
+
+def rotation_deadline():
+    """Cap the rest of a rotation at the --rotation-budget (no cap when it is 0)."""
+    if rotation_budget:
+        return command_executor.phase_deadline(rotation_budget)
+    return contextlib.nullcontext()
+
+def roll_back_rotation(vpn_type, logger, rotation_start, previous_profile):
+    """Record a rotation that missed its latency budget and bring back a working tunnel.
+
+    The last profile whose exit was verified (or the one active before the rotation) is
+    tried first, then the --fallback-profiles in order. Return True if one came up.
+    """
+    elapsed = time.monotonic() - rotation_start
+    logger.warning(f"Rotation not verified within its {rotation_budget}s budget ({elapsed:.0f}s); rolling back.")
+    if vpn_type == "anonsurf":
+        rotation_metrics.record_slo_violation(vpn_type, elapsed, rotation_budget)
+        return False  # Anonsurf has no profiles to go back to
+
+    extension = config_index.VPN_PROFILE_DIRS[vpn_type][1]
+    candidates = []
+    for profile in [rotation_metrics.last_good_profile() or previous_profile] + fallback_profiles:
+        if profile and profile.endswith(extension) and profile not in candidates:
+            candidates.append(profile)
+    if not candidates:
+        rotation_metrics.record_slo_violation(vpn_type, elapsed, rotation_budget)
+        logger.error("No known-good or fallback profile to roll back to.")
+        return False
+
+    stop_vpn_for_rotation(vpn_type, logger)
+    with rotation_deadline():
+        restored = start_vpn_with_retries(vpn_type, logger, attempts=len(candidates), candidates=candidates)
+    rolled_back_to = rotation_metrics.current_profile() if restored else None
+    rotation_metrics.record_slo_violation(vpn_type, elapsed, rotation_budget, rolled_back_to)
+    if restored:
+        logger.warning(f"Rolled back to {rolled_back_to}.")
+    return restored
+
 def change_vpn_periodically(vpn_type, interface, logger, interval, initial_ip):
     """Periodically restart the specified VPN connection every specified interval."""
+    command_executor.bind_stop_event(stop_event)
     try:
         while not stop_event.is_set():
+            traffic_monitor.wait_for_quiet(interface, logger, stop_event)
+            if stop_event.is_set():
+                break
+            forks_before = command_executor.thread_fork_count()
+            rotation_start = time.monotonic()
+            previous_profile = rotation_metrics.current_profile()
+            new_ip = None
             logger.debug(f"Restarting {vpn_type}")
+            # With a standby pool, a rotation is just a route switch to a connected tunnel
+            pool = openvpn_pool.get_pool() if vpn_type == "openvpn" else None
             try:
-                # Stop the VPN interface if it exists
-                if vpn_type == "wireguard":
-                    stop_wireguard(False, logger)
-                elif vpn_type == "openvpn":
-                    stop_openvpn(False, logger)
-
-                # Wait for the interface to come up
-                wait_for_interface_up(interface, logger)
-
-                # Attempt to start the VPN with retries
-                start_success = False
-                for attempt in range(5):  # Retry up to 5 times
-                    try:
-                        if vpn_type == "wireguard":
-                            # Randomly select a WireGuard configuration
-                            random_number = random.randint(1, 10)
-                            filename = f"WG_VPNS/config-{random_number}.conf"
-                            logger.debug(f"Starting WireGuard with config: {filename} (Attempt {attempt + 1})")
-                            subprocess.run(['sudo', 'wg-quick', 'up', filename], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-                            wireguard_running = subprocess.run(['pgrep', 'wg'], stdout=subprocess.DEVNULL, check=True)
-                            if wireguard_running.returncode == 0:
-                                clear_line()
-                                sys.stdout.write("\033[K") 
-                                print("WireGuard: New connection established.")
-                                start_success = True
-                                break
-                        elif vpn_type == "openvpn":
-                            # Start OpenVPN with the configuration file
-                            random_number = random.randint(1, 10)
-                            filename = f"OP_VPNS/config-{random_number}.ovpn"
-                            logger.debug(f"Starting OpenVPN with config: {filename} (Attempt {attempt + 1})")
-                            subprocess.run(['sudo', 'openvpn', '--config', filename, '--daemon'], check=True)
-                            openvpn_running = subprocess.run(['pgrep', 'openvpn'], stdout=subprocess.DEVNULL, check=True)
-                            if openvpn_running.returncode == 0:
-                                clear_line()
-                                sys.stdout.write("\033[K") 
-                                print("OpenVPN: New connection established.")
-                                start_success = True
-                                break
-                        elif vpn_type == "anonsurf":
-                            logger.debug("Changing Anonsurf...")
-                            subprocess.run(["sudo", "anonsurf", "change"], capture_output=True, text=True, check=True)
-                            clear_line()
-                            sys.stdout.write("\033[K") 
-                            print("AnonSurf: New connection established.")
-                            start_success = True
-                            break
+                with rotation_deadline():
+                    standby_config = pool.activate() if pool else None
+                    if standby_config:
+                        rotation_metrics.set_current_tunnel(vpn_type, standby_config)
+                        clear_line()
+                        sys.stdout.write("\033[K")
+                        print("OpenVPN: Switched to a standby connection.")
+                        new_ip = verify_public_ip_changed(logger, initial_ip, rotation_start)
+                    else:
+                        # Pick and resolve the next configs before the current tunnel goes away
+                        candidates = choose_vpn_candidates(vpn_type, 5, logger)
 
-                    except subprocess.CalledProcessError as e:
-                        logger.error(f"Failed to start {vpn_type}: {e}. Retrying... ({attempt + 1}/5)")
-                        time.sleep(5)  # Wait before retrying
+                        # Stop the VPN interface if it exists
+                        stop_vpn_for_rotation(vpn_type, logger)
+                        if pool:
+                            pool.forget()  # stop_openvpn also killed the standby instances
 
-                if not start_success:
-                    logger.error(f"Failed to start {vpn_type} after multiple attempts.")
-                    continue  # Skip to the next interval if VPN fails to start
+                        # Wait for the interface to come up
+                        wait_for_interface_up(interface, logger)
 
-                # Check if the IP address has changed from the initial
-                for _ in range(10):  # Retry up to 10 times
-                    new_public_ip = get_public_ip(logger)
-                    if new_public_ip and new_public_ip != initial_ip and is_valid_ip(new_public_ip):
+                        # Attempt to start the VPN with retries; skip the IP check if it fails
+                        if start_vpn_with_retries(vpn_type, logger, candidates=candidates):
+                            if pool:
+                                pool.fill_async()
+                            new_ip = verify_new_exit(vpn_type, logger, initial_ip, rotation_start)
+
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Error executing {vpn_type} commands: {e}")
+
+            if new_ip is None and rotation_budget and not stop_event.is_set():
+                if pool:
+                    pool.forget()  # The rollback restarts OpenVPN, which ends the standby instances
+                if roll_back_rotation(vpn_type, logger, rotation_start, previous_profile) and pool:
+                    pool.fill_async()
+
+            rotation_metrics.record_rotation(vpn_type, command_executor.thread_fork_count() - forks_before, logger)
+            stop_event.wait(interval)  # Wait for the user-defined interval or until stop_event is set
+
+    except KeyboardInterrupt:
+        logger.debug(f"Periodic {vpn_type} shift interrupted by user.")
+
+def change_multipath_periodically(interface, logger, interval):
+    """Replace one member of the WireGuard multipath group every interval; the others keep carrying traffic."""
+    command_executor.bind_stop_event(stop_event)
+    group = wg_multipath.get_group()
+    try:
+        while not stop_event.wait(interval):  # The group was brought up by main()
+            traffic_monitor.wait_for_quiet(interface, logger, stop_event)
+            if stop_event.is_set():
+                break
+            forks_before = command_executor.thread_fork_count()
+            try:
+                with rotation_deadline():
+                    replaced = group.replace_one()
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Error replacing a multipath member: {e}")
+                replaced = None
+            if replaced:
+                # The attempt was recorded once the new member's handshake completed
+                rotation_metrics.set_current_tunnel("wireguard", replaced[1])
+                clear_line()
+                sys.stdout.write("\033[K")
+                print(f"WireGuard multipath: replaced {replaced[0]} with {replaced[1]}.")
+            else:
+                logger.warning("Failed to replace a multipath member; keeping the current ones.")
+            # Gap 0: the other members carry traffic throughout
+            rotation_metrics.record_rotation("wireguard-multipath", command_executor.thread_fork_count() - forks_before,
+                                             logger, gap=0.0 if replaced else None)
+    except KeyboardInterrupt:
+        logger.debug("Periodic multipath rotation interrupted by user.")
+
+def change_mac_and_vpn_periodically(vpn_type, interface, logger, interval, initial_ip):
+    """Rotate the MAC address and the VPN together so they share a single downtime window.
+
+    Each cycle runs tunnel down, link down, MAC set, link up, tunnel up in sequence, so a
+    link bounce can never land in the middle of a tunnel handshake.
+    """
+    command_executor.bind_stop_event(stop_event)
+    try:
+        while not stop_event.wait(interval):  # The first MAC and VPN were set up by main()
+            traffic_monitor.wait_for_quiet(interface, logger, stop_event)
+            if stop_event.is_set():
+                break
+            forks_before = command_executor.thread_fork_count()
+            previous_profile = rotation_metrics.current_profile()
+            gap = new_ip = None
+            logger.debug(f"Rotating MAC address and {vpn_type}")
+
+            # Pick and resolve the next configs before the current tunnel goes away
+            candidates = choose_vpn_candidates(vpn_type, 5, logger)
+
+            gap_start = time.monotonic()
+            try:
+                with rotation_deadline():
+                    stop_vpn_for_rotation(vpn_type, logger)
+
+                    new_mac = rotate_mac_identity(interface, logger)
+                    if new_mac:
                         clear_line()
-                        sys.stdout.write("\033[K") 
-                        print(f"New public IP address: {new_public_ip}")
-                        break  # Exit loop if the IP has changed successfully
+                        sys.stdout.write("\033[K")  # Clear the current line
+                        print(f"New MAC address is {new_mac}.")
                     else:
-                        logger.debug(f"Current public IP is still the same as initial: {initial_ip}")
-                    time.sleep(5)  # Wait and retry
+                        logger.warning("Failed to change MAC address.")
 
-                # After the loop, check if IP did not change
-                if new_public_ip == initial_ip:
-                    print(f"Your public IP did not change: {initial_ip}")
-                    logger.debug("IP address did not change after starting VPN.")
+                    wait_for_interface_up(interface, logger)
+
+                    if start_vpn_with_retries(vpn_type, logger, candidates=candidates):
+                        gap = time.monotonic() - gap_start
+                        new_ip = verify_new_exit(vpn_type, logger, initial_ip, gap_start)
 
             except subprocess.CalledProcessError as e:
                 logger.error(f"Error executing {vpn_type} commands: {e}")
 
-            stop_event.wait(interval)  # Wait for the user-defined interval or until stop_event is set
+            if new_ip is None and rotation_budget and not stop_event.is_set():
+                roll_back_rotation(vpn_type, logger, gap_start, previous_profile)
+
+            rotation_metrics.record_rotation("mac+" + vpn_type, command_executor.thread_fork_count() - forks_before, logger, gap=gap)
 
     except KeyboardInterrupt:
-        logger.debug(f"Periodic {vpn_type} shift interrupted by user.")
+        logger.debug(f"Periodic MAC address and {vpn_type} rotation interrupted by user.")
+
+def run_exits(args, logger):
+    """Run --exits: M parallel exits in network namespaces until Ctrl+C, then remove them."""
+    vpn_type = ask_vpn_choice()
+    if vpn_type == "anonsurf":
+        logger.error("Anonsurf routes the whole host through Tor and cannot run per namespace; choose OpenVPN or WireGuard.")
+        sys.exit(1)
+    if args.exit_intervals:
+        try:
+            intervals = [int(value) for value in args.exit_intervals.split(",") if value.strip()]
+        except ValueError:
+            intervals = []
+        if not intervals or min(intervals) <= 0:
+            logger.error(f"Invalid --exit-intervals: {args.exit_intervals} (expected positive whole seconds)")
+            sys.exit(1)
+    else:
+        intervals = [prompt_for_interval_time(default=300)]
+    intervals += [intervals[-1]] * (args.exits - len(intervals))
+
+    rotation_metrics.enable()
+    threads = []
+    try:
+        threads = netns_tunnels.start_exits(vpn_type, intervals[:args.exits], choose_vpn_config, logger, stop_event)
+        print(f"Started {args.exits} exits. Run a program through one with 'python netns_tunnels.py run N -- COMMAND'.")
+        print("Press CTRL+C to exit.", flush=True)
+        wait_for_threads(threads, logger, until_stopped=True)
+    finally:
+        stop_event.set()
+        command_executor.bind_stop_event(None)
+        for thread in threads:  # Let in-flight rotations unwind before their namespaces go
+            thread.join(timeout=netns_tunnels.READY_TIMEOUT)
+        netns_tunnels.stop_exits(logger)
+        rotation_metrics.disable()
 
 def fetch_initial_public_ip(logger):
     """Fetch and return the initial public IP address before any VPN is started."""
     try:
-        initial_ip = subprocess.check_output(['curl', '-s', 'ifconfig.me']).decode('utf-8').strip()
+        initial_ip = command_executor.check_output(['curl', '-s', 'ifconfig.me'], logger, phase="public_ip").strip()
         logger.info(f"Primary public IP address: {initial_ip}")
         return initial_ip
     except subprocess.CalledProcessError as e:
@@ -791,8 +1272,7 @@ def fetch_initial_public_ip(logger):
 def get_public_ip(logger):
     """Get the current public IP address."""
     try:
-        response = subprocess.check_output(['curl', '-s', 'ifconfig.me'])
-        public_ip = response.decode('utf-8').strip()
+        public_ip = command_executor.check_output(['curl', '-s', 'ifconfig.me'], logger, phase="public_ip").strip()
         logger.debug(f"Public IP address retrieved: {public_ip}")
         return public_ip
     except subprocess.CalledProcessError as e:
@@ -815,6 +1295,17 @@ def prompt_for_interval_time(default=300):
         except ValueError:
             print("Invalid input. Please enter a valid number.")
 
+def wait_for_threads(threads, logger, until_stopped=False):
+    """Wait for threads to finish (with until_stopped, for stop_event instead), revalidating
+    new or changed profiles every profile_validator.REFRESH_INTERVAL seconds here in the
+    main thread, so selections never wait for it."""
+    last_refresh = time.monotonic()
+    while not stop_event.is_set() if until_stopped else any(thread.is_alive() for thread in threads):
+        time.sleep(1)
+        if time.monotonic() - last_refresh >= profile_validator.REFRESH_INTERVAL:
+            profile_validator.refresh(logger)
+            last_refresh = time.monotonic()
+
 def countdown(interval):
     """Countdown timer."""
     original_interval = interval  # Store the original interval value
@@ -825,6 +1316,7 @@ def countdown(interval):
             clear_line()
             sys.stdout.write(f"\rRemaining time: {timer} | Press Ctrl+C to Exit")
             sys.stdout.flush()
+            profiling.checkpoint()
             time.sleep(1)
             interval -= 1
             if stop_event.is_set():
@@ -844,14 +1336,33 @@ def signal_handler(sig, frame):
 
 def main():
     """Main function to handle arguments and execute the script logic."""
-    global stop_event
+    global stop_event, rotation_budget, fallback_profiles
     args = get_arguments()
+    if args.status and args.json:
+        # Fast path for monitoring: sysfs and the metrics file only
+        status_report.print_status([args.interface] if args.interface else [])
+        sys.exit(0)
     logger = configure_logging(args.verbose)
     interface = args.interface
 
     display_banner()
 
     signal.signal(signal.SIGINT, signal_handler)
+    if args.profile:
+        profiling.configure(args.profile, args.profile_window, logger)
+        print(f"Profiler ({args.profile}) armed: run 'kill -USR1 {os.getpid()}' to start and stop it.")
+
+    if args.tor_control:
+        tor_control.configure(args.tor_control, args.tor_socks, args.tor_control_password)
+
+    exit_verifier.configure(args.exit_check_rate)
+    traffic_monitor.configure(args.defer_grace, args.defer_rate, args.defer_flows)
+    rotation_budget = args.rotation_budget
+    if args.fallback_profiles:
+        fallback_profiles = [path.strip() for path in args.fallback_profiles.split(",") if path.strip()]
+
+    # Commands run from the main thread are killed as soon as shutdown is requested
+    command_executor.bind_stop_event(stop_event)
 
     # Check dependencies
     check_dependencies(logger)
@@ -862,6 +1373,37 @@ def main():
     #check config files and folders
     ensure_config_files_and_auth('OP_VPNS', 'AUTH', 'WG_VPNS')
 
+    if args.validate:
+        profile_validator.refresh()
+        invalid = 0
+        for vpn_type in ("wireguard", "openvpn"):
+            for path in config_index.list_profiles(vpn_type):
+                problems = profile_validator.get_problems(path)
+                if problems:
+                    invalid += 1
+                    print(f"{path}:\n  " + "\n  ".join(problems))
+        print(f"{invalid} invalid profile(s) found.")
+        sys.exit(1 if invalid else 0)
+
+    # Invalid profiles are left out of every rotation
+    profile_validator.refresh(logger)
+
+    if args.prefer_fast:
+        profile_scoreboard.prefer("download_mbps")
+
+    if args.benchmark:
+        if not args.benchmark_target:
+            logger.error("--benchmark requires --benchmark-target HOST:PORT")
+            sys.exit(1)
+        profile_benchmark.run_benchmark(("wireguard", "openvpn"), args.benchmark_target, logger,
+                                        duration=args.benchmark_duration, parallel=args.benchmark_parallel,
+                                        stop_event=stop_event)
+        sys.exit(0)
+
+    if args.exits > 0:
+        run_exits(args, logger)
+        sys.exit(0)
+
     # Fetch and store the initial public IP
     initial_ip = fetch_initial_public_ip(logger)
 
@@ -901,6 +1443,9 @@ def main():
     # Handle MAC address changes
     mac_changed = False
     try:
+        if args.random_change or args.vpn_change:
+            rotation_metrics.enable()  # For the dashboard in vpn_manager.py
+
         if args.random_change:
             # Prompt for interval time if -rc is used
             interval_time = prompt_for_interval_time(default=300)
@@ -914,23 +1459,31 @@ def main():
                     logger.error("Failed to retrieve current MAC address to save as primary.")
                     sys.exit(1)
 
+            if args.mac_pool > 0:
+                if macvlan_pool.start_pool(interface, max(args.mac_pool, 2), generate_mac_address, logger):
+                    print(f"Rotating between {max(args.mac_pool, 2)} macvlan MAC identities on {interface}.")
+                else:
+                    logger.error("No macvlan MAC identity came up; changing the MAC of the interface instead.")
+
             # Set logging level to WARNING or higher when -rc is selected
             logging.getLogger().setLevel(logging.WARNING)
 
-            # Start the MAC address change thread
-            mac_thread = threading.Thread(target=change_mac_periodically, args=(interface, logger, interval_time))
-            mac_thread.start()
-
-            time.sleep(1)
-
             anonsurf_started = False
             openvpn_started = False
             wireguard_started = False
-            vpn_thread = None
 
-            # Prompt for starting WireGuard
+            # Prompt for starting a VPN
             vpn_type = prompt_user_for_VPN()
             if vpn_type:
+                start_dns_cache_if_requested(args, vpn_type, logger)
+
+                # Set the first MAC address before the first tunnel comes up
+                new_mac = rotate_mac_identity(interface, logger)
+                if new_mac:
+                    print(f"New MAC address is {new_mac}.")
+                else:
+                    logger.warning("Failed to change MAC address.")
+
                 if vpn_type == "anonsurf":
                     anonsurf_started = start_anonsurf(args.verbose, logger)
                 elif vpn_type == "openvpn":
@@ -938,22 +1491,19 @@ def main():
                 elif vpn_type == "wireguard":
                     wireguard_started = start_wireguard(args.verbose, logger, interface)
 
-                # Start the WireGuard periodic change task if WireGuard was started
-                vpn_thread = threading.Thread(target=change_vpn_periodically, args=(vpn_type, interface, logger, interval_time, initial_ip))
-                vpn_thread.start()
+                # MAC and VPN rotate together in one pipeline so they share one downtime window
+                rotation_thread = threading.Thread(target=change_mac_and_vpn_periodically, args=(vpn_type, interface, logger, interval_time, initial_ip))
             else:
-                # Handle the case when WireGuard is not started
-                logger.debug("Skipping WireGuard periodic change task.")
+                logger.debug("Skipping VPN periodic change task.")
+                rotation_thread = threading.Thread(target=change_mac_periodically, args=(interface, logger, interval_time))
+            rotation_thread.start()
 
             # Start the countdown timer
             countdown_thread = threading.Thread(target=countdown, args=(interval_time,))
             countdown_thread.start()
 
             # Wait for both threads to complete
-            mac_thread.join()
-            if vpn_thread is not None and vpn_thread.is_alive():
-                vpn_thread.join()
-            countdown_thread.join()
+            wait_for_threads([rotation_thread, countdown_thread], logger)
 
         elif args.vpn_change:
             anonsurf_started = False
@@ -961,11 +1511,20 @@ def main():
             wireguard_started = False
             vpn_thread = None
             vpn_type = ask_vpn_choice()
+            multipath = None
             if vpn_type:
+                start_dns_cache_if_requested(args, vpn_type, logger)
                 if vpn_type == "anonsurf":
                     anonsurf_started = start_anonsurf(args.verbose, logger)
                 elif vpn_type == "openvpn":
                     openvpn_started = start_openvpn(args.verbose, logger, interface)
+                elif vpn_type == "wireguard" and args.multipath > 1:
+                    multipath = wg_multipath.start_group(args.multipath, choose_vpn_config, logger)
+                    if multipath:
+                        print(f"WireGuard multipath: {len(multipath.configs())} tunnels up.")
+                    else:
+                        logger.error("No multipath member could be brought up; falling back to a single tunnel.")
+                        wireguard_started = start_wireguard(args.verbose, logger, interface)
                 elif vpn_type == "wireguard":
                     wireguard_started = start_wireguard(args.verbose, logger, interface)
 
@@ -974,12 +1533,16 @@ def main():
 
             # Prompt for interval time if -vc is used
             interval_time = prompt_for_interval_time(default=300)
-            vpn_thread = threading.Thread(target=change_vpn_periodically, args=(vpn_type, interface, logger, interval_time, initial_ip))
+            if vpn_type == "openvpn" and args.openvpn_standby > 0:
+                openvpn_pool.start_pool(args.openvpn_standby, choose_vpn_config, logger)
+            if multipath:
+                vpn_thread = threading.Thread(target=change_multipath_periodically, args=(interface, logger, interval_time))
+            else:
+                vpn_thread = threading.Thread(target=change_vpn_periodically, args=(vpn_type, interface, logger, interval_time, initial_ip))
             vpn_thread.start()
             countdown_thread = threading.Thread(target=countdown, args=(interval_time,))
             countdown_thread.start()
-            vpn_thread.join()
-            countdown_thread.join()
+            wait_for_threads([vpn_thread, countdown_thread], logger)
 
         else:
             if args.random:
@@ -1014,6 +1577,7 @@ def main():
             
             vpn_type = prompt_user_for_VPN()
             if vpn_type:
+                start_dns_cache_if_requested(args, vpn_type, logger)
                 if vpn_type == "anonsurf":
                     anonsurf_started = start_anonsurf(args.verbose, logger)
                 elif vpn_type == "openvpn":
@@ -1034,7 +1598,8 @@ def main():
                             logger.error(f"Error while printing new public IP: {e}")
                     else:
                         logger.debug(f"Current public IP is still the same as initial: {initial_ip}")
-                    time.sleep(5)  # Wait and retry
+                    if command_executor.sleep(5):  # Wait and retry
+                        break
 
                 # After the loop, check if IP did not change
                 if new_public_ip == initial_ip:
@@ -1054,9 +1619,35 @@ def main():
         sys.exit(1)
     finally:
         stop_event.set()  # Signal threads to stop
+        # Cleanup commands must run to completion even though shutdown was requested
+        command_executor.bind_stop_event(None)
         print('\n')
         cleanup(interface, primary_mac, wireguard_started, openvpn_started, anonsurf_started, mac_changed, args.verbose, logger)
+        rotation_metrics.disable()
+        log_run_summary(logger)
         print("\nAll settings have been restored to their default state.", flush=True)  # Prevent new line after printing
 
+def log_run_summary(logger):
+    """Log the forks per rotation and the deferrals of this run, printing them when -rc/-vc
+    have raised the log level above INFO."""
+    stats = command_executor.get_stats()
+    lines = [f"External commands: {stats['forks']} run, {stats['timeouts']} timed out, "
+             f"{stats['cancellations']} cancelled, {stats['exec_time']:.1f}s total"]
+    rotations = list(command_executor.rotation_history)
+    if rotations:
+        forks = sum(r["forks"] for r in rotations) / len(rotations)
+        gaps = [r["gap"] for r in rotations if r["gap"] is not None]
+        gap = f", {sum(gaps) / len(gaps):.1f}s downtime" if gaps else ""
+        lines.append(f"Last {len(rotations)} rotation(s): {forks:.1f} process(es) forked{gap} per rotation on average")
+    if traffic_monitor.is_enabled():
+        deferrals = traffic_monitor.get_stats()
+        lines.append(f"Rotations deferred {deferrals['deferrals']} time(s) for {deferrals['deferred_time']:.0f}s in total "
+                     f"(longest {deferrals['longest_deferral']:.0f}s, {deferrals['forced']} forced after the grace window)")
+    for line in lines:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(line)
+        else:
+            print(line)
+
 if __name__ == "__main__":
     main()
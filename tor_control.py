@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import hmac
+import ipaddress
+import os
+import re
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import command_executor
+
+DEFAULT_CONTROL = "127.0.0.1:9051"
+DEFAULT_SOCKS = "127.0.0.1:9050"
+
+CIRCUIT_TIMEOUT = 60      # Seconds to wait for a fresh circuit after NEWNYM
+SOCKET_TIMEOUT = 10       # Seconds per control-port reply and per SOCKS exchange
+EXIT_CHECK_HOST = "ifconfig.me"
+
+SAFECOOKIE_SERVER_KEY = b"Tor safe cookie authentication server-to-controller hash"
+SAFECOOKIE_CLIENT_KEY = b"Tor safe cookie authentication controller-to-server hash"
+
+_settings = None
+
+
+class TorControlError(Exception):
+    """Raised when Tor refuses a command, the connection fails or no circuit is built in time."""
+
+
+def parse_address(address, default_port):
+    """Return ('unix', path) for a ControlSocket path, else ('tcp', (host, port))."""
+    if address.startswith("unix:") or address.startswith("/"):
+        return "unix", address[5:] if address.startswith("unix:") else address
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        return "tcp", (address, default_port)
+    return "tcp", (host.strip("[]"), int(port))
+
+
+class TorController:
+    """A minimal client for Tor's control protocol (control-spec.txt).
+
+    Asynchronous events (650 replies) that arrive while waiting for a command's reply are
+    queued and handed to wait_for_event.
+    """
+
+    def __init__(self, address=DEFAULT_CONTROL, timeout=SOCKET_TIMEOUT):
+        kind, target = parse_address(address, 9051)
+        try:
+            if kind == "unix":
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(timeout)
+                self.sock.connect(target)
+            else:
+                self.sock = socket.create_connection(target, timeout=timeout)
+        except OSError as e:
+            raise TorControlError(f"Cannot connect to the Tor control port {address}: {e}") from e
+        self.timeout = timeout
+        self.file = self.sock.makefile("rb")
+        self.events = []
+
+    def close(self):
+        try:
+            self.sock.sendall(b"QUIT\r\n")
+        except OSError:
+            pass
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_line(self):
+        try:
+            line = self.file.readline()
+        except OSError as e:  # Includes socket.timeout
+            raise TorControlError(f"No reply from Tor: {e}") from e
+        if not line:
+            raise TorControlError("Tor closed the control connection")
+        return line.decode(errors="replace").rstrip("\r\n")
+
+    def _read_message(self):
+        """Read one complete reply or event: (status code, [lines])."""
+        lines = []
+        while True:
+            line = self._read_line()
+            code, separator, text = line[:3], line[3:4], line[4:]
+            if separator == "+":  # Data block, terminated by a lone "."
+                data = []
+                while True:
+                    data_line = self._read_line()
+                    if data_line == ".":
+                        break
+                    data.append(data_line[1:] if data_line.startswith("..") else data_line)
+                text = "\n".join([text] + data)
+            lines.append(text)
+            if separator == " ":
+                return code, lines
+
+    def command(self, line):
+        """Send a command and return the lines of its 2xx reply."""
+        self.sock.sendall(line.encode() + b"\r\n")
+        while True:
+            code, lines = self._read_message()
+            if code == "650":
+                self.events.append(lines)
+                continue
+            if not code.startswith("2"):
+                raise TorControlError(f"{line.split()[0]} failed: {code} {' '.join(lines)}")
+            return lines
+
+    def authenticate(self, password=None):
+        """Authenticate with the first method Tor offers that we can use."""
+        info = " ".join(self.command("PROTOCOLINFO 1"))
+        match = re.search(r"METHODS=(\S+)", info)
+        methods = set(match.group(1).split(",")) if match else set()
+        match = re.search(r'COOKIEFILE="((?:[^"\\]|\\.)*)"', info)
+        cookie_file = match.group(1).replace('\\"', '"').replace("\\\\", "\\") if match else None
+
+        if "NULL" in methods:
+            self.command("AUTHENTICATE")
+        elif password is not None and "HASHEDPASSWORD" in methods:
+            quoted = password.replace("\\", "\\\\").replace('"', '\\"')
+            self.command(f'AUTHENTICATE "{quoted}"')
+        elif cookie_file and methods & {"SAFECOOKIE", "COOKIE"}:
+            try:
+                with open(cookie_file, "rb") as f:
+                    cookie = f.read()
+            except OSError as e:
+                raise TorControlError(f"Cannot read the Tor auth cookie {cookie_file}: {e}") from e
+            if "SAFECOOKIE" in methods:
+                self._authenticate_safecookie(cookie)
+            else:
+                self.command(f"AUTHENTICATE {cookie.hex()}")
+        else:
+            raise TorControlError(f"No usable authentication method (Tor offers {', '.join(sorted(methods)) or 'none'})")
+
+    def _authenticate_safecookie(self, cookie):
+        client_nonce = os.urandom(32)
+        reply = " ".join(self.command(f"AUTHCHALLENGE SAFECOOKIE {client_nonce.hex()}"))
+        match = re.search(r"SERVERHASH=([0-9A-Fa-f]+)\s+SERVERNONCE=([0-9A-Fa-f]+)", reply)
+        if not match:
+            raise TorControlError(f"Unexpected AUTHCHALLENGE reply: {reply}")
+        server_hash, server_nonce = bytes.fromhex(match.group(1)), bytes.fromhex(match.group(2))
+        message = cookie + client_nonce + server_nonce
+        if not hmac.compare_digest(hmac.new(SAFECOOKIE_SERVER_KEY, message, hashlib.sha256).digest(), server_hash):
+            raise TorControlError("Tor's SAFECOOKIE server hash does not match the cookie")
+        self.command(f"AUTHENTICATE {hmac.new(SAFECOOKIE_CLIENT_KEY, message, hashlib.sha256).hexdigest()}")
+
+    def wait_for_event(self, predicate, timeout):
+        """Return the first queued or arriving event (its lines) for which predicate holds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            while self.events:
+                event = self.events.pop(0)
+                if predicate(event):
+                    return event
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                code, lines = self._read_message()
+            except TorControlError as e:
+                if isinstance(e.__cause__, TimeoutError):
+                    return None  # The connection is unusable after a timeout; the caller closes it
+                raise
+            finally:
+                self.sock.settimeout(self.timeout)
+            if code == "650":
+                self.events.append(lines)
+
+    def new_identity(self, timeout=CIRCUIT_TIMEOUT):
+        """Send NEWNYM and wait until a fresh general-purpose circuit is BUILT.
+
+        Return (circuit id, seconds until it was built).
+        """
+        self.command("SETEVENTS CIRC")
+        self.events.clear()
+        start = time.monotonic()
+        self.command("SIGNAL NEWNYM")
+        event = self.wait_for_event(_is_general_circuit_built, timeout)
+        if event is None:
+            raise TorControlError(f"No new circuit was built within {timeout:.0f}s of NEWNYM")
+        self.command("SETEVENTS")
+        return event[0].split()[1], time.monotonic() - start
+
+
+def _is_general_circuit_built(event):
+    """Match '650 CIRC <id> BUILT ...' for circuits that carry ordinary streams."""
+    fields = event[0].split()
+    if len(fields) < 3 or fields[0] != "CIRC" or fields[2] != "BUILT":
+        return False
+    purpose = re.search(r"\bPURPOSE=(\S+)", event[0])
+    return purpose is None or purpose.group(1) == "GENERAL"
+
+
+def _recv_exact(sock, count):
+    data = b""
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise TorControlError("SOCKS proxy closed the connection")
+        data += chunk
+    return data
+
+
+def exit_ip_via_socks(socks=DEFAULT_SOCKS, host=EXIT_CHECK_HOST, timeout=SOCKET_TIMEOUT):
+    """Ask host for our public IP through Tor's SOCKS port (host name resolved by Tor)."""
+    _, target = parse_address(socks, 9050)
+    try:
+        with socket.create_connection(target, timeout=timeout) as sock:
+            sock.sendall(b"\x05\x01\x00")  # SOCKS5, no authentication
+            if _recv_exact(sock, 2) != b"\x05\x00":
+                raise TorControlError("SOCKS proxy refused the handshake")
+            name = host.encode()
+            sock.sendall(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + struct.pack(">H", 80))
+            reply = _recv_exact(sock, 4)
+            if reply[1] != 0:
+                raise TorControlError(f"SOCKS connect to {host} failed (reply {reply[1]})")
+            bound = {1: 4, 4: 16}.get(reply[3]) or _recv_exact(sock, 1)[0]
+            _recv_exact(sock, bound + 2)
+            sock.sendall(f"GET / HTTP/1.0\r\nHost: {host}\r\nUser-Agent: curl/8\r\n\r\n".encode())
+            response = b""
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                response += chunk
+    except OSError as e:
+        raise TorControlError(f"Exit check through SOCKS {socks} failed: {e}") from e
+    body = response.partition(b"\r\n\r\n")[2].decode(errors="replace").strip()
+    try:
+        return str(ipaddress.ip_address(body))
+    except ValueError:
+        raise TorControlError(f"Unexpected exit check answer: {body[:60]!r}")
+
+
+def configure(control=DEFAULT_CONTROL, socks=DEFAULT_SOCKS, password=None):
+    """Use the control port instead of 'anonsurf change' for Anonsurf rotations."""
+    global _settings
+    _settings = {"control": control, "socks": socks, "password": password}
+
+
+def is_enabled():
+    return _settings is not None
+
+
+def change_identity(logger):
+    """Get a new Tor identity and verify it: NEWNYM, wait for a BUILT circuit, check the exit.
+
+    Return the new exit IP. Raise TorControlError on failure.
+    """
+    timeout = CIRCUIT_TIMEOUT
+    remaining = command_executor.deadline_remaining()
+    if remaining is not None:
+        timeout = min(timeout, remaining)
+    with TorController(_settings["control"]) as controller:
+        controller.authenticate(_settings["password"])
+        circuit, seconds = controller.new_identity(timeout)
+    logger.debug(f"Tor built circuit {circuit} {seconds:.1f}s after NEWNYM")
+    return exit_ip_via_socks(_settings["socks"])
+
+
+# Stand-in Tor for tests: a control port that answers PROTOCOLINFO (NULL auth), AUTHENTICATE,
+# SETEVENTS, SIGNAL NEWNYM (followed by CIRC LAUNCHED/BUILT events) and GETINFO, plus a SOCKS5
+# port whose every HTTP request is answered with the current stand-in exit IP.
+
+class _StubControlHandler(socketserver.StreamRequestHandler):
+    def _reply(self, *lines):
+        self.wfile.write("".join(f"{line}\r\n" for line in lines).encode())
+
+    def handle(self):
+        events = set()
+        for raw in self.rfile:
+            words = raw.decode(errors="replace").strip().split()
+            verb = words[0].upper() if words else ""
+            if verb == "PROTOCOLINFO":
+                self._reply("250-PROTOCOLINFO 1", "250-AUTH METHODS=NULL", '250-VERSION Tor="0.4.8-stub"', "250 OK")
+            elif verb in ("AUTHENTICATE", "RESETCONF", "SETCONF"):
+                self._reply("250 OK")
+            elif verb == "SETEVENTS":
+                events = {word.upper() for word in words[1:]}
+                self._reply("250 OK")
+            elif verb == "SIGNAL" and len(words) == 2 and words[1].upper() == "NEWNYM":
+                circuit = self.server.newnym()
+                self._reply("250 OK")
+                if "CIRC" in events:
+                    self._reply(f"650 CIRC {circuit} LAUNCHED BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL")
+                    time.sleep(self.server.build_delay)
+                    self._reply(f"650 CIRC {circuit} BUILT $0000000000000000000000000000000000000000~stub "
+                                f"BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL")
+            elif verb == "GETINFO":
+                self._reply(f"250-{' '.join(words[1:])}=", "250 OK")
+            elif verb == "QUIT":
+                self._reply("250 closing connection")
+                return
+            else:
+                self._reply(f'510 Unrecognized command "{verb}"')
+
+
+class _StubSocksHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        try:
+            greeting = _recv_exact(sock, 2)
+            _recv_exact(sock, greeting[1])
+            sock.sendall(b"\x05\x00")
+            request = _recv_exact(sock, 4)
+            length = {1: 4, 4: 16}.get(request[3]) or _recv_exact(sock, 1)[0]
+            _recv_exact(sock, length + 2)
+            sock.sendall(b"\x05\x00\x00\x01" + b"\x00" * 6)
+            data = b""
+            while b"\r\n\r\n" not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    return
+                data += chunk
+            sock.sendall(f"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\n{self.server.stub.exit_ip()}\n".encode())
+        except (OSError, TorControlError):
+            pass
+
+
+class _StubServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubTor:
+    """Stand-in Tor control and SOCKS ports on localhost. Port 0 picks a free port."""
+
+    def __init__(self, control_port=0, socks_port=0, build_delay=0.2):
+        self.lock = threading.Lock()
+        self.identity = 0
+        self.build_delay = build_delay
+        self.control = _StubServer(("127.0.0.1", control_port), _StubControlHandler)
+        self.socks = _StubServer(("127.0.0.1", socks_port), _StubSocksHandler)
+        self.control.newnym = self.newnym
+        self.control.build_delay = build_delay
+        self.socks.stub = self
+
+    @property
+    def control_address(self):
+        return "%s:%d" % self.control.server_address
+
+    @property
+    def socks_address(self):
+        return "%s:%d" % self.socks.server_address
+
+    def newnym(self):
+        """Switch to the next stand-in exit; return the new circuit's id."""
+        with self.lock:
+            self.identity += 1
+            return self.identity
+
+    def exit_ip(self):
+        with self.lock:
+            return f"203.0.113.{self.identity % 254 + 1}"
+
+    def start(self):
+        for server in (self.control, self.socks):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        for server in (self.control, self.socks):
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Request a new Tor identity over the control port, or run a stand-in Tor for tests.")
+    parser.add_argument("--control", default=DEFAULT_CONTROL, help=f"ControlPort HOST:PORT or ControlSocket path (default: {DEFAULT_CONTROL})")
+    parser.add_argument("--socks", default=DEFAULT_SOCKS, help=f"SOCKS port HOST:PORT used to check the exit (default: {DEFAULT_SOCKS})")
+    parser.add_argument("--password", help="Control port password (HashedControlPassword)")
+    parser.add_argument("--stub", action="store_true", help="Run a stand-in Tor on the --control and --socks ports instead")
+    args = parser.parse_args()
+
+    if args.stub:
+        stub = StubTor(parse_address(args.control, 9051)[1][1], parse_address(args.socks, 9050)[1][1]).start()
+        print(f"Stand-in Tor: control port {stub.control_address}, SOCKS port {stub.socks_address}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            stub.shutdown()
+        sys.exit(0)
+
+    import logging
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+    configure(args.control, args.socks, args.password)
+    try:
+        print(f"New Tor exit: {change_identity(logging.getLogger(__name__))}")
+    except TorControlError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,128 @@
+import threading
+import time
+import exit_verifier
+from net_inventory import SYSFS_NET
+
+PROC_TCP_TABLES = ("/proc/net/tcp", "/proc/net/tcp6")
+TCP_ESTABLISHED = "01"
+
+# Length (seconds) of each throughput measurement
+SAMPLE_WINDOW = 2
+
+_policy = None
+_stats_lock = threading.Lock()
+_stats = {"deferrals": 0, "deferred_time": 0.0, "forced": 0, "longest_deferral": 0.0}
+
+
+def configure(grace, rate_kib=256, flows=0):
+    """Enable deferral: wait up to grace seconds while the link moves more than rate_kib KiB/s
+    or more than flows TCP connections are established (0 ignores the flow count)."""
+    global _policy
+    _policy = {"grace": grace, "rate": rate_kib * 1024, "flows": flows} if grace > 0 else None
+
+
+def is_enabled():
+    return _policy is not None
+
+
+def read_byte_counters(interface):
+    """Return rx_bytes + tx_bytes of the interface, or None if unavailable."""
+    total = 0
+    for counter in ("rx_bytes", "tx_bytes"):
+        try:
+            with open(f"{SYSFS_NET}/{interface}/statistics/{counter}", "r") as f:
+                total += int(f.read())
+        except (OSError, ValueError):
+            return None
+    return total
+
+
+def _is_loopback(hex_address):
+    """Check a /proc/net/tcp{,6} address (hex, 32-bit little-endian words) for loopback."""
+    if len(hex_address) == 8:
+        return hex_address[-2:] == "7F"  # 127.0.0.0/8
+    if hex_address == "00000000000000000000000001000000":
+        return True  # ::1
+    return hex_address.startswith("0000000000000000FFFF0000") and hex_address[-2:] == "7F"
+
+
+def count_established_flows():
+    """Count established non-loopback TCP connections from /proc/net/tcp{,6}."""
+    count = 0
+    for table in PROC_TCP_TABLES:
+        try:
+            with open(table, "r") as f:
+                next(f)  # Header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 4 or fields[3] != TCP_ESTABLISHED:
+                        continue
+                    if not _is_loopback(fields[2].split(":")[0]):
+                        count += 1
+        except (OSError, StopIteration):
+            continue
+    return count
+
+
+def measure(interface, stop_event=None):
+    """Return (bytes per second over SAMPLE_WINDOW, established flows), or None if stopped."""
+    before = read_byte_counters(interface)
+    start = time.monotonic()
+    if stop_event is None:
+        time.sleep(SAMPLE_WINDOW)
+    elif stop_event.wait(SAMPLE_WINDOW):
+        return None
+    after = read_byte_counters(interface)
+    elapsed = time.monotonic() - start
+    rate = (after - before) / elapsed if before is not None and after is not None else 0
+    return rate, count_established_flows()
+
+
+def is_busy(rate, flows):
+    return rate > _policy["rate"] or (_policy["flows"] > 0 and flows > _policy["flows"])
+
+
+def wait_for_quiet(interface, logger, stop_event=None):
+    """Delay a rotation while heavy transfers are active, for at most the grace window.
+
+    Throughput is measured on the device traffic is routed through, falling back to interface.
+
+    Returns the number of seconds the rotation was deferred.
+    """
+    if _policy is None:
+        return 0
+    # Measure the device the user's traffic leaves through (the active tunnel, when there is
+    # one): the physical interface also carries every standby tunnel's encrypted keepalives
+    device = exit_verifier.route_device(logger=logger) or interface
+    start = time.monotonic()
+    deferred = False
+    while True:
+        sample = measure(device, stop_event)
+        if sample is None:
+            break  # Shutting down
+        rate, flows = sample
+        if not is_busy(rate, flows):
+            break
+        waited = time.monotonic() - start
+        if waited >= _policy["grace"]:
+            logger.debug(f"Grace window of {_policy['grace']}s used up; rotating despite active transfers")
+            with _stats_lock:
+                _stats["forced"] += 1
+            break
+        if not deferred:
+            logger.debug(f"Deferring rotation: {rate / 1024:.0f} KiB/s on {device}, {flows} established flows")
+            deferred = True
+
+    waited = time.monotonic() - start if deferred else 0
+    if deferred:
+        with _stats_lock:
+            _stats["deferrals"] += 1
+            _stats["deferred_time"] += waited
+            _stats["longest_deferral"] = max(_stats["longest_deferral"], waited)
+        logger.debug(f"Rotation deferred for {waited:.0f}s")
+    return waited
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -1,7 +1,23 @@
+import bisect
+import datetime
+import json
 import os
-import sys
 import re
+import sys
 from PyQt5 import QtWidgets, QtGui, QtCore
+import config_index
+import profile_templates
+import profile_validator
+import rotation_metrics
+
+# Delay (ms) before re-listing after a directory change, so bulk imports cause one refresh
+REFRESH_DELAY = 300
+
+# How often (ms) the dashboard checks the rotator's metrics file; it redraws only when the file changed
+DASHBOARD_INTERVAL = 1000
+
+# Number of recent rotations drawn in each chart
+CHART_POINTS = 50
 
 class CloseableTab(QtWidgets.QWidget):
     """Custom widget for tabs with a close button."""
@@ -12,16 +28,235 @@ class CloseableTab(QtWidgets.QWidget):
         self.close_button = QtWidgets.QPushButton("X")
         self.close_button.setFixedSize(20, 20)  # Size for close button
         self.close_button.clicked.connect(close_callback)
-        
+
         self.layout.addWidget(self.label)
         self.layout.addWidget(self.close_button)
 
+class TaskSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+class FileTask(QtCore.QRunnable):
+    """Run a file operation on the thread pool and report back on the UI thread."""
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.function(*self.args)
+        except (OSError, ValueError) as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+class ProfileListModel(QtCore.QAbstractListModel):
+    """List of the profiles of one VPN type, backed by the config index.
+
+    Only visible rows are rendered by the view; refreshes insert and remove rows
+    incrementally instead of resetting the list.
+    """
+    def __init__(self, vpn_type, parent=None):
+        super().__init__(parent)
+        self.vpn_type = vpn_type
+        self.paths = []
+        self.keys = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return os.path.basename(path)
+        if role == QtCore.Qt.UserRole:
+            return path
+        if role == QtCore.Qt.ToolTipRole:
+            entry = config_index.get(path)
+            if entry and entry.get("source"):
+                return f"Imported from {entry['source']}"
+        return None
+
+    def set_profiles(self, paths):
+        """Apply a new (naturally sorted) list of paths as row removals and insertions."""
+        new_paths = set(paths)
+        for row in range(len(self.paths) - 1, -1, -1):
+            if self.paths[row] not in new_paths:
+                self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+                del self.paths[row]
+                del self.keys[row]
+                self.endRemoveRows()
+        current = set(self.paths)
+        for path in paths:
+            if path in current:
+                continue
+            key = config_index.natural_key(path)
+            row = bisect.bisect(self.keys, key)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self.paths.insert(row, path)
+            self.keys.insert(row, key)
+            self.endInsertRows()
+
+def read_profile(vpn_type, path):
+    """Read a config and, for OpenVPN, the auth file it names. Runs on a worker thread."""
+    with open(path, 'r') as f:
+        content = f.read()
+    auth_path = auth_content = None
+    if vpn_type == "openvpn":
+        match = re.search(r"^auth-user-pass\s+(\S+)", content, re.MULTILINE)
+        if match:
+            auth_path = match.group(1)
+        elif '-' in os.path.basename(path):
+            # config-N.ovpn pairs with AUTH/auth-N.txt
+            auth_index = os.path.basename(path).split('-')[1].split('.')[0]
+            auth_path = os.path.join('AUTH', f"auth-{auth_index}.txt")
+        if auth_path and os.path.isfile(auth_path):
+            with open(auth_path, 'r') as f:
+                auth_content = f.read()
+    return content, auth_path, auth_content
+
+def write_file(path, content):
+    """Save through a temporary file and rename, so the rotator never reads half a file."""
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+def list_profiles(vpn_type):
+    """Return the editable profiles: templated ones have no file until selected, and are
+    edited through their template and server table instead."""
+    return vpn_type, [path for path in config_index.list_profiles(vpn_type) if not profile_templates.is_templated(path)]
+
+def read_metrics(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+class SparklineChart(QtWidgets.QWidget):
+    """Minimal line chart of recent values, drawn with QPainter."""
+    def __init__(self, title, unit):
+        super().__init__()
+        self.title = title
+        self.unit = unit
+        self.values = []
+        self.setMinimumHeight(110)
+
+    def set_values(self, values):
+        self.values = values[-CHART_POINTS:]
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        rect = self.rect().adjusted(8, 22, -8, -8)
+        painter.drawText(8, 16, self.title if not self.values else
+                         f"{self.title}: last {self.values[-1]:.1f}{self.unit}, max {max(self.values):.1f}{self.unit}")
+        painter.setPen(QtGui.QPen(QtCore.Qt.lightGray))
+        painter.drawRect(rect)
+        if len(self.values) < 2:
+            return
+        top = max(self.values) or 1
+        step = rect.width() / (len(self.values) - 1)
+        points = [QtCore.QPointF(rect.left() + i * step, rect.bottom() - value / top * rect.height())
+                  for i, value in enumerate(self.values)]
+        painter.setPen(QtGui.QPen(QtGui.QColor(30, 120, 200), 2))
+        painter.drawPolyline(QtGui.QPolygonF(points))
+
+class DashboardTab(QtWidgets.QWidget):
+    """Live view of the running rotator, fed by the metrics file it publishes."""
+    def __init__(self, run_task):
+        super().__init__()
+        self.run_task = run_task
+        self.last_mtime = None
+        self.loading = False
+
+        layout = QtWidgets.QVBoxLayout(self)
+        self.status_label = QtWidgets.QLabel("Waiting for the rotator...")
+        layout.addWidget(self.status_label)
+        self.gap_chart = SparklineChart("Rotation gap", "s")
+        layout.addWidget(self.gap_chart)
+        self.exit_chart = SparklineChart("Time to new exit", "s")
+        layout.addWidget(self.exit_chart)
+
+        self.profile_table = QtWidgets.QTableWidget(0, 5)
+        self.profile_table.setHorizontalHeaderLabels(["Profile", "Health", "Time to exit (s)", "Attempts", "Failures"])
+        self.profile_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.profile_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.profile_table)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(DASHBOARD_INTERVAL)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start()
+
+    def poll(self):
+        """Reload the metrics if the tab is visible and the file changed since the last load."""
+        if not self.isVisible() or self.loading:
+            return
+        try:
+            mtime = os.stat(rotation_metrics.METRICS_FILE).st_mtime_ns
+        except OSError:
+            self.status_label.setText(f"Rotator not running (no metrics in {rotation_metrics.METRICS_FILE}).")
+            return
+        if mtime == self.last_mtime:
+            return
+        self.last_mtime = mtime
+        self.loading = True
+        self.run_task(FileTask(read_metrics, rotation_metrics.METRICS_FILE), self.show_metrics, self.load_failed)
+
+    def load_failed(self, message):
+        self.loading = False
+        self.status_label.setText(f"Could not read metrics: {message}")
+
+    def show_metrics(self, metrics):
+        self.loading = False
+        current = metrics.get("current") or {}
+        if not metrics.get("running"):
+            self.status_label.setText("Rotator stopped.")
+        elif current:
+            since = datetime.datetime.fromtimestamp(current["since"]).strftime("%H:%M:%S")
+            if current.get("exit_ip"):
+                exit_ip = current["exit_ip"]
+            elif current.get("endpoint"):
+                exit_ip = f"unknown (tunnel to {current['endpoint']} verified)"
+            else:
+                exit_ip = "not verified yet"
+            self.status_label.setText(f"Current tunnel: {current['vpn_type']} ({current['profile']}) since {since}, exit {exit_ip}")
+        else:
+            self.status_label.setText("Rotator running without a tunnel.")
+        violations = metrics.get("slo_violations", [])
+        if violations:
+            last = violations[-1]
+            self.status_label.setText(self.status_label.text() + f"\nRotation budget missed {len(violations)} time(s); "
+                                      f"last rolled back to {last.get('rolled_back_to') or 'nothing'}")
+
+        self.gap_chart.set_values([r["gap"] for r in metrics.get("rotations", []) if r.get("gap") is not None])
+        self.exit_chart.set_values([e["seconds"] for e in metrics.get("exits", [])])
+
+        profiles = sorted(metrics.get("profiles", {}).items(), key=lambda item: config_index.natural_key(item[0]))
+        self.profile_table.setRowCount(len(profiles))
+        for row, (profile, entry) in enumerate(profiles):
+            latency = entry.get("latency")
+            values = [profile, f"{entry['health']:.2f}", "" if latency is None else f"{latency:.1f}",
+                      str(entry["attempts"]), str(entry["failures"])]
+            for column, value in enumerate(values):
+                self.profile_table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+
 class VPNManager(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("VPN Configuration Manager")
         self.setGeometry(100, 100, 800, 600)
 
+        self.thread_pool = QtCore.QThreadPool.globalInstance()
+        self.tasks = set()  # Keeps running tasks (and their signals) alive
+        self.open_tabs = {}  # Config path -> its editor tab
+
         self.tab_widget = QtWidgets.QTabWidget()
         self.setCentralWidget(self.tab_widget)
 
@@ -30,139 +265,159 @@ class VPNManager(QtWidgets.QMainWindow):
         self.wireguard_tab = QtWidgets.QWidget()
         self.tab_widget.addTab(self.openvpn_tab, "OpenVPN")
         self.tab_widget.addTab(self.wireguard_tab, "WireGuard")
+        self.dashboard_tab = DashboardTab(self.run_task)
+        self.tab_widget.addTab(self.dashboard_tab, "Dashboard")
 
-        # Layouts for tabs
-        self.setup_openvpn_tab()
-        self.setup_wireguard_tab()
-
-    def setup_openvpn_tab(self):
-        layout = QtWidgets.QVBoxLayout(self.openvpn_tab)
-        self.openvpn_list = QtWidgets.QListWidget()
-        self.openvpn_list.itemClicked.connect(self.load_openvpn_config)
-        layout.addWidget(self.openvpn_list)
-
-        self.load_openvpn_files()
-
-        self.openvpn_subtab_widget = QtWidgets.QTabWidget()
-        layout.addWidget(self.openvpn_subtab_widget)
-
-    def setup_wireguard_tab(self):
-        layout = QtWidgets.QVBoxLayout(self.wireguard_tab)
-        self.wireguard_list = QtWidgets.QListWidget()
-        self.wireguard_list.itemClicked.connect(self.load_wireguard_config)
-        layout.addWidget(self.wireguard_list)
-
-        self.load_wireguard_files()
-
-        self.wireguard_subtab_widget = QtWidgets.QTabWidget()
-        layout.addWidget(self.wireguard_subtab_widget)
+        self.models = {}
+        self.lists = {}
+        self.subtab_widgets = {}
 
-    def natural_sort(self, lst):
-        """Sort a list using natural order (numeric values are taken into account)."""
-        return sorted(lst, key=lambda x: [int(i) if i.isdigit() else i for i in re.split(r'(\d+)', x)])
-
-    def load_openvpn_files(self):
-        self.openvpn_dir = 'OP_VPNS'
-        if not os.path.exists(self.openvpn_dir):
-            QtWidgets.QMessageBox.warning(self, "Warning", f"OpenVPN directory '{self.openvpn_dir}' does not exist.")
-            return
-
-        filenames = [f for f in os.listdir(self.openvpn_dir) if f.endswith('.ovpn')]
-        sorted_filenames = self.natural_sort(filenames)
-        self.openvpn_list.addItems(sorted_filenames)
-
-    def load_wireguard_files(self):
-        self.wireguard_dir = 'WG_VPNS'
-        if not os.path.exists(self.wireguard_dir):
-            QtWidgets.QMessageBox.warning(self, "Warning", f"WireGuard directory '{self.wireguard_dir}' does not exist.")
+        # Layouts for tabs
+        self.setup_profile_tab(self.openvpn_tab, "openvpn")
+        self.setup_profile_tab(self.wireguard_tab, "wireguard")
+
+        # Re-list a directory when files are added, removed or renamed in it
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_refresh)
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(REFRESH_DELAY)
+        self.refresh_timer.timeout.connect(self.refresh_profiles)
+        for vpn_type, (directory, _) in config_index.VPN_PROFILE_DIRS.items():
+            if os.path.isdir(directory):
+                self.watcher.addPath(directory)
+            else:
+                QtWidgets.QMessageBox.warning(self, "Warning", f"{self.type_label(vpn_type)} directory '{directory}' does not exist.")
+        self.refresh_profiles()
+
+    def type_label(self, vpn_type):
+        return "OpenVPN" if vpn_type == "openvpn" else "WireGuard"
+
+    def setup_profile_tab(self, tab, vpn_type):
+        layout = QtWidgets.QVBoxLayout(tab)
+        model = ProfileListModel(vpn_type, self)
+        view = QtWidgets.QListView()
+        view.setModel(model)
+        view.setUniformItemSizes(True)  # Lets the view lay out thousands of rows without measuring each
+        view.clicked.connect(lambda index: self.open_config(vpn_type, index.data(QtCore.Qt.UserRole)))
+        layout.addWidget(view)
+
+        subtab_widget = QtWidgets.QTabWidget()
+        layout.addWidget(subtab_widget)
+
+        self.models[vpn_type] = model
+        self.lists[vpn_type] = view
+        self.subtab_widgets[vpn_type] = subtab_widget
+
+    def run_task(self, task, on_finished, on_failed=None):
+        self.tasks.add(task)
+        task.signals.finished.connect(on_finished)
+        task.signals.failed.connect(on_failed or (lambda message: QtWidgets.QMessageBox.warning(self, "Error", message)))
+        task.signals.finished.connect(lambda _: self.tasks.discard(task))
+        task.signals.failed.connect(lambda _: self.tasks.discard(task))
+        self.thread_pool.start(task)
+
+    def schedule_refresh(self, _path=None):
+        self.refresh_timer.start()
+
+    def refresh_profiles(self):
+        """Re-list both directories through the index on a worker thread."""
+        for vpn_type in self.models:
+            self.run_task(FileTask(list_profiles, vpn_type), self.apply_profiles)
+
+    def apply_profiles(self, result):
+        vpn_type, paths = result
+        self.models[vpn_type].set_profiles(paths)
+        # Tabs of deleted configs are left open so unsaved edits are not lost
+
+    def open_config(self, vpn_type, path):
+        """Show the editor tab of a config, reusing it if the config is already open."""
+        subtab_widget = self.subtab_widgets[vpn_type]
+        if path in self.open_tabs:
+            subtab_widget.setCurrentWidget(self.open_tabs[path])
             return
 
-        filenames = [f for f in os.listdir(self.wireguard_dir) if f.endswith('.conf')]
-        sorted_filenames = self.natural_sort(filenames)
-        self.wireguard_list.addItems(sorted_filenames)
-
-    def load_openvpn_config(self, item):
-        filename = item.text()
+        filename = os.path.basename(path)
         sub_tab = QtWidgets.QWidget()
-        self.openvpn_subtab_widget.addTab(sub_tab, filename)
+        self.open_tabs[path] = sub_tab
+        subtab_widget.addTab(sub_tab, filename)
+        subtab_widget.setCurrentWidget(sub_tab)
 
         layout = QtWidgets.QVBoxLayout(sub_tab)
-
         text_area = QtWidgets.QTextEdit()
-        with open(os.path.join(self.openvpn_dir, filename), 'r') as f:
-            content = f.read()
-            text_area.setPlainText(content)
+        text_area.setPlaceholderText("Loading...")
+        text_area.setReadOnly(True)
         layout.addWidget(text_area)
 
-        save_button = QtWidgets.QPushButton("Save OpenVPN Config")
-        save_button.clicked.connect(lambda: self.save_openvpn_config(filename, text_area))
+        save_button = QtWidgets.QPushButton(f"Save {self.type_label(vpn_type)} Config")
+        save_button.setEnabled(False)
+        save_button.clicked.connect(lambda: self.save_config(vpn_type, path, text_area))
         layout.addWidget(save_button)
 
-        # Auth file handling
-        auth_index = filename.split('-')[1].split('.')[0]
-        auth_filename = f"auth-{auth_index}.txt"
-        auth_file_path = os.path.join('AUTH', auth_filename)
-
-        auth_filename_label = QtWidgets.QLabel(f"Auth File: {auth_filename}")
-        layout.addWidget(auth_filename_label)
-
-        auth_area = QtWidgets.QTextEdit()
-        if os.path.isfile(auth_file_path):
-            with open(auth_file_path, 'r') as f:
-                auth_content = f.read()
-                auth_area.setPlainText(auth_content)
-        layout.addWidget(auth_area)
-
-        auth_save_button = QtWidgets.QPushButton("Save Auth File")
-        auth_save_button.clicked.connect(lambda: self.save_auth_file(auth_file_path, auth_area))
-        layout.addWidget(auth_save_button)
+        auth_widgets = None
+        if vpn_type == "openvpn":
+            auth_filename_label = QtWidgets.QLabel("Auth File:")
+            layout.addWidget(auth_filename_label)
+            auth_area = QtWidgets.QTextEdit()
+            auth_area.setReadOnly(True)
+            layout.addWidget(auth_area)
+            auth_save_button = QtWidgets.QPushButton("Save Auth File")
+            auth_save_button.setEnabled(False)
+            layout.addWidget(auth_save_button)
+            auth_widgets = (auth_filename_label, auth_area, auth_save_button)
 
         # Closeable tab
-        closeable_tab = CloseableTab(filename, lambda: self.openvpn_subtab_widget.removeTab(self.openvpn_subtab_widget.indexOf(sub_tab)))
-        self.openvpn_subtab_widget.setTabText(self.openvpn_subtab_widget.indexOf(sub_tab), "")
-        self.openvpn_subtab_widget.tabBar().setTabButton(self.openvpn_subtab_widget.indexOf(sub_tab), QtWidgets.QTabBar.RightSide, closeable_tab)
+        closeable_tab = CloseableTab(filename, lambda: self.close_config(vpn_type, path))
+        subtab_widget.setTabText(subtab_widget.indexOf(sub_tab), "")
+        subtab_widget.tabBar().setTabButton(subtab_widget.indexOf(sub_tab), QtWidgets.QTabBar.RightSide, closeable_tab)
 
-    def load_wireguard_config(self, item):
-        filename = item.text()
-        sub_tab = QtWidgets.QWidget()
-        self.wireguard_subtab_widget.addTab(sub_tab, filename)
-
-        layout = QtWidgets.QVBoxLayout(sub_tab)
-
-        text_area = QtWidgets.QTextEdit()
-        with open(os.path.join(self.wireguard_dir, filename), 'r') as f:
-            content = f.read()
+        def loaded(result):
+            content, auth_path, auth_content = result
             text_area.setPlainText(content)
-        layout.addWidget(text_area)
-
-        save_button = QtWidgets.QPushButton("Save WireGuard Config")
-        save_button.clicked.connect(lambda: self.save_wireguard_config(filename, text_area))
-        layout.addWidget(save_button)
-
-        # Closeable tab
-        closeable_tab = CloseableTab(filename, lambda: self.wireguard_subtab_widget.removeTab(self.wireguard_subtab_widget.indexOf(sub_tab)))
-        self.wireguard_subtab_widget.setTabText(self.wireguard_subtab_widget.indexOf(sub_tab), "")
-        self.wireguard_subtab_widget.tabBar().setTabButton(self.wireguard_subtab_widget.indexOf(sub_tab), QtWidgets.QTabBar.RightSide, closeable_tab)
-
-    def save_openvpn_config(self, filename, text_area):
-        file_path = os.path.join(self.openvpn_dir, filename)
-        with open(file_path, 'w') as f:
-            content = text_area.toPlainText().strip()
-            f.write(content)
-        QtWidgets.QMessageBox.information(self, "Info", f"Saved OpenVPN configuration: {filename}.")
+            text_area.setReadOnly(False)
+            save_button.setEnabled(True)
+            if auth_widgets and not auth_path:
+                auth_widgets[0].setText("Auth File: none found")
+            if auth_widgets and auth_path:
+                auth_filename_label, auth_area, auth_save_button = auth_widgets
+                auth_filename_label.setText(f"Auth File: {os.path.basename(auth_path)}")
+                auth_area.setPlainText(auth_content or "")
+                auth_area.setReadOnly(False)
+                auth_save_button.setEnabled(True)
+                auth_save_button.clicked.connect(lambda: self.save_auth_file(auth_path, auth_area))
+
+        def failed(message):
+            text_area.setPlaceholderText(f"Could not read {filename}: {message}")
+
+        self.run_task(FileTask(read_profile, vpn_type, path), loaded, failed)
+
+    def close_config(self, vpn_type, path):
+        sub_tab = self.open_tabs.pop(path, None)
+        if sub_tab is not None:
+            subtab_widget = self.subtab_widgets[vpn_type]
+            subtab_widget.removeTab(subtab_widget.indexOf(sub_tab))
+
+    def save_config(self, vpn_type, path, text_area):
+        """Validate the edited config on a worker thread, then save it (after confirmation if it has problems)."""
+        content = text_area.toPlainText().strip()
+
+        def validated(problems):
+            if problems:
+                answer = QtWidgets.QMessageBox.question(
+                    self, "Invalid configuration",
+                    f"{os.path.basename(path)} has problems and would be skipped by the rotator:\n\n- "
+                    + "\n- ".join(problems) + "\n\nSave anyway?")
+                if answer != QtWidgets.QMessageBox.Yes:
+                    return
+            self.run_task(FileTask(write_file, path, content),
+                          lambda _: QtWidgets.QMessageBox.information(self, "Info", f"Saved {self.type_label(vpn_type)} configuration: {os.path.basename(path)}."))
+
+        self.run_task(FileTask(profile_validator.validate_text, content, vpn_type), validated)
 
     def save_auth_file(self, auth_file_path, auth_area):
-        with open(auth_file_path, 'w') as f:
-            auth_content = auth_area.toPlainText().strip()
-            f.write(auth_content)
-        QtWidgets.QMessageBox.information(self, "Info", f"Saved authentication file: {os.path.basename(auth_file_path)}.")
-
-    def save_wireguard_config(self, filename, text_area):
-        file_path = os.path.join(self.wireguard_dir, filename)
-        with open(file_path, 'w') as f:
-            content = text_area.toPlainText().strip()
-            f.write(content)
-        QtWidgets.QMessageBox.information(self, "Info", f"Saved WireGuard configuration: {filename}.")
+        auth_content = auth_area.toPlainText().strip()
+        self.run_task(FileTask(write_file, auth_file_path, auth_content),
+                      lambda _: QtWidgets.QMessageBox.information(self, "Info", f"Saved authentication file: {os.path.basename(auth_file_path)}."))
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
@@ -0,0 +1,247 @@
+import os
+import subprocess
+import threading
+import time
+import dns_cache
+import endpoint_resolver
+import exit_verifier
+import net_inventory
+import netns_tunnels
+import privileged_ops
+import rotation_metrics
+
+# Rendered 'wg setconf' files of the members
+MULTIPATH_DIR = "/run/stealth-shift/multipath"
+
+# Members are named DEVICE_PREFIX0, DEVICE_PREFIX1, ...
+DEVICE_PREFIX = "ssmp"
+
+# The members' own UDP packets carry FWMARK and use the main table; everything else is routed
+# through ROUTE_TABLE, whose default route is a multipath route over all members (as wg-quick does
+# for a single tunnel)
+FWMARK = 51821
+ROUTE_TABLE = 51821
+RULE_PRIORITY = 32000
+
+# Hash flows on addresses and ports (not just addresses), so connections to one host spread too
+SYSCTLS = {
+    "/proc/sys/net/ipv4/fib_multipath_hash_policy": "1",
+    "/proc/sys/net/ipv4/conf/all/src_valid_mark": "1",
+}
+
+_group = None
+
+
+class Member:
+    """One WireGuard device of the group, carrying one profile."""
+
+    def __init__(self, config, device):
+        self.config = config
+        self.device = device
+        self.since = time.monotonic()
+
+    def start(self, logger):
+        with open(self.config, "r") as file:
+            lines = endpoint_resolver.with_literal_endpoints(file.readlines(), logger)
+        setconf, addresses = netns_tunnels.wireguard_setconf_lines(lines)
+        interface = next(i for i, line in enumerate(setconf) if line.strip().lower() == "[interface]")
+        setconf.insert(interface + 1, f"FwMark = {FWMARK}\n")
+        setconf_path = os.path.join(MULTIPATH_DIR, f"{self.device}.conf")
+        fd = os.open(setconf_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            file.writelines(setconf)
+        try:
+            privileged_ops.ip_batch([["link", "add", self.device, "type", "wireguard"]], logger)
+            privileged_ops.run_privileged(["wg", "setconf", self.device, setconf_path], logger, phase="vpn_up")
+            commands = [["addr", "add", address, "dev", self.device] for address in addresses if ":" not in address]
+            commands.append(["link", "set", self.device, "up"])
+            privileged_ops.ip_batch(commands, logger, phase="vpn_up")
+            # A flow's source address is picked before the ECMP hash chooses its member, so
+            # rewrite it to the address of the member the packet actually leaves through
+            privileged_ops.run_privileged(["iptables", "-t", "nat"] + self._snat_rule("-A"), logger, phase="vpn_up")
+        except subprocess.CalledProcessError:
+            self.stop(logger)
+            raise
+        finally:
+            os.remove(setconf_path)
+
+    def _snat_rule(self, action):
+        return [action, "POSTROUTING", "-o", self.device, "-j", "MASQUERADE"]
+
+    def stop(self, logger):
+        privileged_ops.run_privileged(["iptables", "-t", "nat"] + self._snat_rule("-D"), logger, phase="vpn_down",
+                                      check=False, cancellable=False)
+        privileged_ops.run_privileged(["ip", "link", "del", self.device], logger, phase="vpn_down",
+                                      check=False, cancellable=False)
+
+
+class MultipathGroup:
+    """K WireGuard tunnels up at once, with flows spread across them by an ECMP default route.
+
+    A rotation replaces one member at a time (make-before-break), so the group never has
+    fewer than K-1 working paths.
+    """
+
+    def __init__(self, size, choose_config, logger):
+        self.size = size
+        self.choose_config = choose_config
+        self.logger = logger
+        self.members = []
+        self.lock = threading.Lock()
+        self.saved_sysctls = {}
+        self.rules_added = False
+        os.makedirs(MULTIPATH_DIR, mode=0o700, exist_ok=True)
+
+    def _free_device(self):
+        used = {m.device for m in self.members}
+        number = 0
+        while f"{DEVICE_PREFIX}{number}" in used or net_inventory.interface_exists(f"{DEVICE_PREFIX}{number}"):
+            number += 1
+        return f"{DEVICE_PREFIX}{number}"
+
+    def _set_sysctls(self):
+        for path, value in SYSCTLS.items():
+            try:
+                with open(path, "r") as f:
+                    self.saved_sysctls[path] = f.read().strip()
+                with open(path, "w") as f:
+                    f.write(value + "\n")
+            except OSError as e:
+                self.logger.warning(f"Could not set {path}: {e}")
+
+    def _add_rules(self):
+        privileged_ops.ip_batch([
+            ["rule", "add", "table", "main", "suppress_prefixlength", "0", "priority", str(RULE_PRIORITY)],
+            ["rule", "add", "not", "fwmark", str(FWMARK), "table", str(ROUTE_TABLE), "priority", str(RULE_PRIORITY + 1)],
+        ], self.logger, phase="vpn_up")
+        self.rules_added = True
+
+    def _route(self, members):
+        """Make members the next hops of the group's default route."""
+        nexthops = []
+        for member in members:
+            nexthops += ["nexthop", "dev", member.device, "weight", "1"]
+        privileged_ops.ip_batch([["route", "replace", "default", "table", str(ROUTE_TABLE)] + nexthops],
+                                self.logger, phase="vpn_up")
+        if dns_cache.is_running():
+            dns_cache.use_config_upstreams(members[-1].config, self.logger)
+
+    def _choose(self):
+        """Choose a profile no member uses; None (logged) if there is none left."""
+        with self.lock:
+            in_use = {m.config for m in self.members}
+        config = self.choose_config("wireguard", exclude=in_use)
+        if config is None:
+            self.logger.error(f"No valid WireGuard profile is left besides the {len(in_use)} the multipath group uses")
+        return config
+
+    def _spawn(self, config):
+        with self.lock:
+            member = Member(config, self._free_device())
+        try:
+            member.start(self.logger)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.error(f"Failed to bring up multipath member {member.device} with {member.config}: {e}")
+            rotation_metrics.record_attempt(member.config, False)
+            return None
+        # Only a member whose peer answered is put into the route
+        endpoints = set(endpoint_resolver.config_endpoints(member.config, self.logger))
+        if exit_verifier.wait_for_handshake(member.device, endpoints, self.logger, bind=True) is None:
+            self.logger.error(f"Multipath member {member.device} got no handshake from {member.config}")
+            member.stop(self.logger)
+            rotation_metrics.record_attempt(member.config, False)
+            return None
+        rotation_metrics.record_attempt(member.config, True)
+        self.logger.debug(f"Brought up multipath member {member.device} with {member.config}")
+        return member
+
+    def start(self, attempts=3):
+        """Bring up the members and route through them. Return the number of members up."""
+        self._set_sysctls()
+        failures = 0
+        while len(self.members) < self.size and failures < self.size * attempts:
+            config = self._choose()
+            if config is None:
+                break
+            member = self._spawn(config)
+            if member is None:
+                failures += 1
+                continue
+            with self.lock:
+                self.members.append(member)
+        if self.members:
+            self._route(self.members)
+            self._add_rules()
+        return len(self.members)
+
+    def replace_one(self):
+        """Replace the longest-serving member with a new profile.
+
+        The new member is added to the route before the old one is removed.
+        Return (old config, new config), or None if no other profile is left or the new
+        member could not be brought up.
+        """
+        config = self._choose()
+        if config is None:
+            return None
+        member = self._spawn(config)
+        if member is None:
+            return None
+        with self.lock:
+            old = min(self.members, key=lambda m: m.since)
+            members = [m for m in self.members if m is not old] + [member]
+        try:
+            self._route(members)
+        except subprocess.CalledProcessError:
+            member.stop(self.logger)
+            raise
+        with self.lock:
+            self.members = members
+        old.stop(self.logger)
+        return old.config, member.config
+
+    def configs(self):
+        with self.lock:
+            return [m.config for m in self.members]
+
+    def shutdown(self):
+        with self.lock:
+            members, self.members = self.members, []
+        if self.rules_added:
+            privileged_ops.ip_batch([
+                ["rule", "del", "priority", str(RULE_PRIORITY + 1)],
+                ["rule", "del", "priority", str(RULE_PRIORITY)],
+            ], self.logger, phase="vpn_down", check=False, cancellable=False)
+            self.rules_added = False
+        for member in members:
+            member.stop(self.logger)
+        for path, value in self.saved_sysctls.items():
+            try:
+                with open(path, "w") as f:
+                    f.write(value + "\n")
+            except OSError:
+                pass
+        self.saved_sysctls.clear()
+
+
+def start_group(size, choose_config, logger):
+    """Bring up a multipath group of size WireGuard tunnels. Return it, or None if no member came up."""
+    global _group
+    _group = MultipathGroup(size, choose_config, logger)
+    if not _group.start():
+        _group.shutdown()
+        _group = None
+    return _group
+
+
+def get_group():
+    return _group
+
+
+def shutdown_group(logger):
+    global _group
+    if _group is None:
+        return
+    logger.debug("Stopping multipath WireGuard tunnels")
+    _group.shutdown()
+    _group = None